@@ -0,0 +1,11 @@
+"""
+Benchmarks
+
+Micro-benchmarks of the parsers and of the ban detection, over a corpus of
+representative pages. Run from the repository root:
+
+    python -m benchmarks.parser_bench --save baseline.json
+    python -m benchmarks.parser_bench --compare baseline.json --tolerance 0.25
+
+See `parser_bench` for the options.
+"""
@@ -0,0 +1,122 @@
+"""
+Benchmark Corpus
+
+Representative pages for the parser benchmarks. Small pages are bundled as fixtures
+in `fixtures/`; large ones are generated, deterministically, so the repository
+stays light and every run measures the same bytes.
+
+Pages are corescrape.archive.page_archive.ArchivedPage objects, the same pages the
+replay reads, so parsers and ban rules see what they would see in a run.
+"""
+
+from os.path import dirname, abspath, join
+from random import Random
+
+from corescrape.archive.page_archive import ArchivedPage
+
+# pylint: disable=invalid-name
+
+FIXTURES = join(dirname(abspath(__file__)), 'fixtures')
+CONF = join(FIXTURES, 'conf')
+
+# fixture file -> (final URL, headers)
+BUNDLED = {
+    'small': ('https://store.example.com/product/kettle-17',
+              {'Content-Type': 'text/html; charset=utf-8'}),
+    'malformed': ('https://store.example.com/category/lamps?page=3',
+                  {'Content-Type': 'text/html'}),
+    'latin1': ('https://boutique.example.fr/produit/cafe-tradition',
+               {'Content-Type': 'text/html'}),  # charset only in the meta tag
+    'ban': ('https://store.example.com/product/kettle-17',
+            {'Content-Type': 'text/html; charset=UTF-8'}),
+}
+
+WORDS = ('steel', 'lamp', 'kettle', 'cotton', 'desk', 'glass', 'oak', 'compact',
+         'wireless', 'ceramic', 'travel', 'premium', 'classic', 'mini', 'pro')
+
+
+def page(content, url, headers=None, status=200):
+    """Builds a corpus page."""
+
+    return ArchivedPage({'url': url, 'status': status, 'headers': headers or {},
+                         'encoding': None, 'outcome': None}, content)
+
+
+def large_listing(size=500 * 1024, seed=0):
+    """
+    Category listing of about 'size' bytes, with a product card per item: name,
+    prices, specs and links. Deterministic for a given seed.
+    """
+
+    rnd = Random(seed)
+    head = ('<!DOCTYPE html><html><head><meta charset="utf-8">'
+            '<title>Kitchen - page 1 of 80 - Example Store</title>'
+            '<link rel="stylesheet" href="/static/site.css"></head><body>'
+            '<nav><a href="/">Home</a><a href="/category/kitchen">Kitchen</a></nav>'
+            '<main class="listing">')
+    tail = '</main><footer><a href="/help">Help</a></footer></body></html>'
+
+    cards = []
+    total = len(head) + len(tail)
+    i = 0
+    while total < size:
+        name = ' '.join(rnd.choice(WORDS) for _ in range(3)).title()
+        card = (
+            '<div class="product" data-id="{i}">'
+            '<a href="/product/{slug}-{i}"><img src="/img/{i}.jpg" alt="{name}"></a>'
+            '<h2 class="name"><a href="/product/{slug}-{i}">{name}</a></h2>'
+            '<span class="price">$ {price:.2f}</span>'
+            '<span class="price old">$ {old:.2f}</span>'
+            '<ul class="specs"><li>Weight: {weight:.1f} kg</li>'
+            '<li>Rating: {rating} / 5</li></ul>'
+            '<p class="description">{text}</p></div>'
+        ).format(i=i, name=name, slug=name.lower().replace(' ', '-'),
+                 price=rnd.uniform(5, 500), old=rnd.uniform(500, 900),
+                 weight=rnd.uniform(0.1, 20), rating=rnd.randint(1, 5),
+                 text=' '.join(rnd.choice(WORDS) for _ in range(30)))
+        cards.append(card)
+        total += len(card)
+        i += 1
+    return (head + ''.join(cards) + tail).encode('utf-8')
+
+
+def large_malformed(size=500 * 1024, seed=0):
+    """
+    The large listing with a fifth of the closing tags of its body mangled. The
+    head is kept intact: an unclosed 'title' would swallow the whole page.
+    """
+
+    rnd = Random(seed)
+    head, body = large_listing(size, seed).split(b'<body>', 1)
+    parts = body.split(b'</')
+    mangled = [head, b'<body>', parts[0]]
+    for part in parts[1:]:
+        if rnd.random() < 0.8:
+            mangled.append(b'</')
+        else:
+            mangled.append(rnd.choice([b'<', b'</b ', b'<p>']))
+        mangled.append(part)
+    return b''.join(mangled)
+
+
+def large_ban(size=500 * 1024, seed=0):
+    """Large page whose ban message only appears at its very end."""
+
+    content = large_listing(size, seed)
+    return content.replace(b'</main>', b'<p>Please verify you are a human</p></main>')
+
+
+def corpus(size=500 * 1024):
+    """Dict name -> page of the whole corpus."""
+
+    pages = {}
+    for name, (url, headers) in BUNDLED.items():
+        with open(join(FIXTURES, name + '.html'), 'rb') as _file:
+            pages[name] = page(_file.read(), url, headers)
+
+    url = 'https://store.example.com/category/kitchen?page=1'
+    headers = {'Content-Type': 'text/html; charset=utf-8'}
+    pages['large'] = page(large_listing(size), url, headers)
+    pages['large_malformed'] = page(large_malformed(size), url, headers)
+    pages['large_ban'] = page(large_ban(size), url, headers)
+    return pages
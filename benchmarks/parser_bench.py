@@ -0,0 +1,262 @@
+"""
+Parser Benchmark
+
+Times every parser configuration below over every page of the corpus (see
+`corpus`), measures the peak memory of parsing each page and the cost of the ban
+scan, then optionally saves the results as a baseline or compares them with one.
+
+Memory is the growth of the peak resident set size of a fresh interpreter running
+the measurement once, so the trees built by libxml2 are counted (tracemalloc only
+sees the allocations of Python). On Linux the peak is reset right before the call
+through /proc/self/clear_refs. Elsewhere the growth of ru_maxrss is used, which
+misses calls peaking below the memory used to build the corpus. Growths below
+MEMFLOOR KB are noise and are not compared.
+
+    python -m benchmarks.parser_bench --save baseline.json
+    python -m benchmarks.parser_bench --compare baseline.json --tolerance 0.25
+
+Times are the best of 'repeat' rounds, each round running the measurement enough
+times to last about 'mintime' seconds. When comparing, a measurement slower (or
+using more memory) than the baseline by more than 'tolerance' is a regression and
+the exit status is 1. Baselines are only meaningful on the machine that made them.
+"""
+
+import argparse
+import json
+import platform
+import re
+import subprocess
+import sys
+from os.path import dirname, abspath
+from time import perf_counter
+
+from lxml import etree
+
+from corescrape.pgparser.simple_parser import SimpleParser
+from corescrape.pgparser.custom_parser import CustomPageParser
+from corescrape.rules.rule_engine import RuleEngine
+
+from . import corpus as cp
+
+# pylint: disable=invalid-name, import-outside-toplevel
+
+ROOT = dirname(dirname(abspath(__file__)))
+MEMORY = 'rss'  # how 'peakkb' is measured, saved with the baselines
+MEMFLOOR = 256  # KB
+
+
+NUMBER = re.compile(r'\d+(?:[.,]\d+)?')
+
+def strip_prices(hs):
+    """Filter of the custom parser: price strings to floats."""
+
+    found = (NUMBER.search(h) for h in hs)
+    return [float(f.group(0).replace(',', '.')) for f in found if f]
+
+
+def parsers():
+    """Dict name -> (parser, method name) of the configurations measured."""
+
+    custom = {
+        'title': ['//title/text()', None],
+        'names': ['//*[@class="name"]//text()', None],
+        'prices': ['//span[starts-with(@class, "price")]/text()', strip_prices],
+    }
+    return {
+        'simple_title': (SimpleParser('//title/text()'), 'parse'),
+        'simple_title_head': (SimpleParser('//title/text()', stoptag='head'),
+                              'parse'),
+        'simple_links_regex': (SimpleParser('//a/@href', regex=r'^/product/'),
+                               'parse'),
+        'simple_maxmatches': (SimpleParser('//a/@href', maxmatches=5), 'parse'),
+        'custom': (CustomPageParser(custom), 'parse'),
+        'custom_follow': (CustomPageParser(custom, follow='//a/@href'),
+                          'parse_and_follow'),
+    }
+
+
+def best_time(func, repeat, mintime):
+    """Best time in seconds of a single call of 'func'."""
+
+    start = perf_counter()
+    func()
+    single = perf_counter() - start
+    number = max(1, int(mintime / max(single, 1e-9)))
+
+    best = single
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (perf_counter() - start) / number)
+    return best
+
+
+def status_kb(field):
+    """Field of /proc/self/status in KB."""
+
+    with open('/proc/self/status', 'r') as _file:
+        for line in _file:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise OSError('No {} in /proc/self/status'.format(field))
+
+
+def peak_growth(func):
+    """Growth of the peak RSS, in KB, of a call of 'func' in this process."""
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as _file:
+            _file.write('5')  # the peak RSS becomes the current RSS
+        base = status_kb('VmRSS')
+        func()
+        return max(status_kb('VmHWM') - base, 0)
+    except OSError:
+        pass
+
+    import resource
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    func()
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    return max(growth / 1024 if sys.platform == 'darwin' else growth, 0)
+
+
+def peak_memory(key, size):
+    """Peak RSS growth, in KB, of a measurement run in a fresh interpreter."""
+
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.parser_bench',
+                          '--peak', key, '--size', str(size)],
+                         cwd=ROOT, stdout=subprocess.PIPE, check=True)
+    return float(out.stdout.split()[-1])
+
+
+def measurements(size, only=None):
+    """Yields (name, function, bytes of the page) of every measurement."""
+
+    pages = cp.corpus(size)
+    for pname, (parser, method) in parsers().items():
+        func = getattr(parser, method)
+        for name, page in pages.items():
+            key = 'parse/{}/{}'.format(pname, name)
+            if only and only not in key: continue
+            yield key, lambda f=func, p=page: f(p), len(page.content)
+
+    engine = RuleEngine(cp.CONF, interval=None)
+    for name, page in pages.items():
+        key = 'banscan/{}'.format(name)
+        if only and only not in key: continue
+        # a fresh page each time, since decoding the text is part of the scan
+        scan = lambda p=page: engine.banned(
+            cp.page(p.content, p.url, p.headers), 'store.example.com')
+        yield key, scan, len(page.content)
+
+
+def run(args):
+    """Runs every measurement. Returns a dict name -> measurement."""
+
+    results = {}
+    print('{:<40} {:>12} {:>10} {:>10}'.format('measurement', 'us/page', 'MB/s',
+                                                'peak KB'))
+    for key, func, size in measurements(args.size, args.only):
+        seconds = best_time(func, args.repeat, args.mintime)
+        result = {'seconds': seconds, 'mbps': size / seconds / 1024 ** 2,
+                  'peakkb': peak_memory(key, args.size)}
+        print('{:<40} {:>12.1f} {:>10.2f} {:>10.1f}'.format(
+            key, seconds * 1e6, result['mbps'], result['peakkb']))
+        results[key] = result
+    return results
+
+
+def compare(results, baseline, tolerance, only=None, memory=True):
+    """
+    Prints the ratios to the baseline. Returns the list of regressions. Memory
+    is only compared if 'memory', and from MEMFLOOR KB up.
+    """
+
+    regressions = []
+    print('\n{:<40} {:>10} {:>10}'.format('compared to baseline', 'time', 'memory'))
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print('{:<40} {:>21}'.format(key, 'new'))
+            continue
+        ratios = (result['seconds'] / base['seconds'],
+                  max(result['peakkb'], MEMFLOOR) / max(base['peakkb'], MEMFLOOR)
+                  if memory else 1.0)
+        flag = ''
+        if max(ratios) > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        print('{:<40} {:>9.2f}x {:>9.2f}x{}'.format(key, ratios[0], ratios[1],
+                                                     flag))
+    for key in baseline:
+        if key not in results and (not only or only in key):
+            print('{:<40} {:>21}'.format(key, 'missing'))
+    return regressions
+
+
+def parse_args(argv=None):
+    """Reads the command line arguments."""
+
+    ap = argparse.ArgumentParser(prog='parser_bench',
+                                 description='Parser micro-benchmarks.')
+    ap.add_argument('--save', help='saves the results as a baseline to this file')
+    ap.add_argument('--compare', help='baseline file to compare the results with')
+    ap.add_argument('--tolerance', type=float, default=0.25,
+                    help='accepted slowdown (or memory growth) ratio over the '
+                    'baseline. Default 0.25')
+    ap.add_argument('--repeat', type=int, default=5,
+                    help='rounds of each measurement. Default 5')
+    ap.add_argument('--mintime', type=float, default=0.05,
+                    help='minimum seconds of a round. Default 0.05')
+    ap.add_argument('--size', type=int, default=500 * 1024,
+                    help='bytes of the generated large pages. Default 512000')
+    ap.add_argument('--only', help='runs only the measurements matching this name')
+    ap.add_argument('--peak', help=argparse.SUPPRESS)  # used by 'peak_memory'
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    """Runs the benchmarks. Returns the exit status."""
+
+    args = parse_args(argv)
+    if args.peak:
+        for key, func, _ in measurements(args.size):
+            if key == args.peak:
+                print(peak_growth(func))
+                return 0
+        return 2
+
+    results = run(args)
+
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r') as _file:
+            baseline = json.load(_file)
+        if baseline.get('size') != args.size:
+            print('Baseline was made with --size {}'.format(baseline.get('size')))
+            return 2
+        memory = baseline.get('memory') == MEMORY
+        if not memory:
+            print('Baseline memory was not measured as {}, only times are '
+                  'compared'.format(MEMORY))
+        regressions = compare(results, baseline['results'], args.tolerance,
+                              args.only, memory)
+        if regressions:
+            print('\n{} regressions over {:.0%}'.format(len(regressions),
+                                                       args.tolerance))
+            status = 1
+
+    if args.save:
+        with open(args.save, 'w') as _file:
+            json.dump({'python': platform.python_version(),
+                       'lxml': '.'.join(map(str, etree.LXML_VERSION)),
+                       'machine': platform.machine(), 'size': args.size,
+                       'memory': MEMORY,
+                       'results': results}, _file, indent=1, sort_keys=True)
+        print('Baseline saved to {}'.format(args.save))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""
+corescrape
+
+Toolkit for web scraping. Subpackages and their modules are imported only when
+first accessed, so importing the package (or running the command line interface)
+does not load 'requests' or 'lxml' unless the chosen mode needs them.
+"""
+
+from importlib import import_module
+
+# pylint: disable=invalid-name
+
+def lazy_submodules(package, names):
+    """Module level '__getattr__' that imports the listed submodules on access."""
+
+    def __getattr__(name):
+        """Imports the submodule."""
+
+        if name in names:
+            return import_module('{}.{}'.format(package, name))
+        raise AttributeError('module {!r} has no attribute {!r}'.format(package,
+                                                                       name))
+
+    return __getattr__
+
+
+__getattr__ = lazy_submodules(__name__, [
+    'archive',
+    'cli',
+    'core',
+    'logs',
+    'pgparser',
+    'proxy',
+    'rules',
+    'sink',
+    'sitemap',
+    'threads',
+])
@@ -0,0 +1,7 @@
+"""Entry point: python -m corescrape. See corescrape.cli."""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,9 @@
+"""Subpackage archive."""
+
+from .. import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    'page_archive',
+    'replay',
+    'segment_store',
+])
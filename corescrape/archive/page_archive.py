@@ -0,0 +1,205 @@
+"""
+Page Archive
+
+WARC-like, append-only archive of fetched pages. Each record is an independent gzip
+member holding a JSON header line (URL, status code, headers, encoding, outcome and
+fetch time) followed by the raw body. Since members are independent, any record can
+be read alone from its offset, and the archive can still be read sequentially as a
+regular gzip stream.
+
+Next to the archive, an index file (same path plus '.idx') keeps one line per
+record: offset, compressed size, status code and URL, separated by tabs. Indexes
+written before the status code was recorded (offset, size and URL) are still
+read, line by line, with an unknown status.
+
+Archived pages are read back as `ArchivedPage` objects, which offer the attributes
+of a requests.models.Response used by the parsers and the ban rules.
+"""
+
+import gzip
+import json
+from threading import Lock
+from time import time
+
+from ..core import CoreScrape
+
+# pylint: disable=invalid-name, too-many-arguments, too-many-instance-attributes
+
+class Headers(dict):
+    """Dict of headers with case insensitive 'get'."""
+
+    def __init__(self, headers=None):
+        """Constructor."""
+
+        super().__init__((k.lower(), v) for k, v in (headers or {}).items())
+
+    def get(self, key, default=None):
+        """Case insensitive get."""
+
+        return super().get(key.lower(), default)
+
+    def __getitem__(self, key):
+        """Case insensitive item."""
+
+        return super().__getitem__(key.lower())
+
+    def __contains__(self, key):
+        """Case insensitive membership."""
+
+        return super().__contains__(key.lower())
+
+
+class ArchivedPage:
+    """
+    Page read from an archive. Quacks like a requests.models.Response.
+
+    Params:
+        header: dict header of the record
+        content: bytes body of the page
+    """
+
+    def __init__(self, header, content):
+        """Constructor."""
+
+        self.requested = header['url']
+        self.url = header.get('final') or self.requested
+        self.status_code = header['status']
+        self.headers = Headers(header.get('headers'))
+        self.encoding = header.get('encoding')
+        self.outcome = header.get('outcome')
+        self.fetched = header.get('time')
+        self.content = content
+        self.__text = None
+
+    @property
+    def text(self):
+        """Body decoded with the page encoding (UTF-8 if unknown)."""
+
+        if self.__text is None:
+            try:
+                self.__text = self.content.decode(self.encoding or 'utf-8',
+                                                  errors='replace')
+            except LookupError:
+                self.__text = self.content.decode('utf-8', errors='replace')
+        return self.__text
+
+
+def encode_record(page, url=None, outcome=None, compresslevel=6):
+    """Compresses a response into an archive record (a gzip member)."""
+
+    header = {
+        'url': url or page.url,
+        'final': page.url,
+        'status': page.status_code,
+        'headers': dict(page.headers),
+        'encoding': page.encoding,
+        'outcome': outcome,
+        'time': time(),
+    }
+    data = json.dumps(header).encode('utf-8') + b'\n' + (page.content or b'')
+    return gzip.compress(data, compresslevel=compresslevel)
+
+
+def decode_record(record):
+    """Inverse of 'encode_record'. Returns an ArchivedPage."""
+
+    data = gzip.decompress(record)
+    header, _, content = data.partition(b'\n')
+    return ArchivedPage(json.loads(header.decode('utf-8')), content)
+
+
+def read_index(path):
+    """
+    Yields (offset, size, status code, url) from the index of an archive. The
+    status code is None in lines of the older layout, without it.
+    """
+
+    with open(path + '.idx', 'r', encoding='utf-8') as _file:
+        for line in _file:
+            fields = line.rstrip('\n').split('\t', 3)
+            if len(fields) == 3:  # offset, size and url
+                yield int(fields[0]), int(fields[1]), None, fields[2]
+                continue
+            offset, size, status, url = fields
+            yield int(offset), int(size), int(status), url
+
+
+def read_record(_file, offset, size):
+    """Reads a single record from an open archive file."""
+
+    _file.seek(offset)
+    return decode_record(_file.read(size))
+
+
+def iter_archive(path):
+    """Yields every ArchivedPage of an archive, in order."""
+
+    with open(path, 'rb') as _file:
+        for offset, size, _, _ in read_index(path):
+            yield read_record(_file, offset, size)
+
+
+class PageArchive(CoreScrape):
+    """
+    Append-only page archive writer. Thread safe.
+
+    Params:
+        path: str path of the archive file. The index is written to path + '.idx'.
+        outcomes: list of str or None. Outcomes to be archived (see
+            corescrape.proxy.request_stats). None archives every answered page.
+        compresslevel: int gzip compression level
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, path, outcomes=None, compresslevel=6, logoperator=None):
+        """Constructor."""
+
+        self.path = path
+        self.outcomes = outcomes
+        self.compresslevel = compresslevel
+        self.lock = Lock()
+        self.__file = open(path, 'ab')
+        self.__index = open(path + '.idx', 'a', encoding='utf-8')
+        self.count = 0
+
+        super().__init__(logoperator=logoperator)
+
+    def write(self, page, url=None, outcome=None):
+        """
+        Archives a response.
+
+        Params:
+            page: requests.models.Response
+            url: str or None. URL requested, if it differs from the page URL.
+            outcome: str or None. Outcome of the request.
+
+        Returns:
+            tuple (offset, size) of the record or None if it was not archived
+        """
+
+        if self.outcomes is not None and outcome not in self.outcomes:
+            return None
+
+        url = url or page.url
+        record = encode_record(page, url, outcome, self.compresslevel)
+        with self.lock:
+            offset = self.__file.tell()
+            self.__file.write(record)
+            self.__index.write('{}\t{}\t{}\t{}\n'.format(
+                offset, len(record), page.status_code, url.replace('\t', '%09')))
+            self.count += 1
+        return offset, len(record)
+
+    def flush(self):
+        """Flushes the files."""
+
+        with self.lock:
+            self.__file.flush()
+            self.__index.flush()
+
+    def close(self):
+        """Closes the files."""
+
+        with self.lock:
+            self.__file.close()
+            self.__index.close()
@@ -0,0 +1,133 @@
+"""
+Replay
+
+Offline re-evaluation of archived pages. Pages are streamed from a `PageArchive`
+through the ban rules and a parser, without any network access, across several
+processes. Use it to check new rules in `ignoremsgs.txt`/`banrules.txt` or a new set
+of xpaths against pages already fetched.
+
+Workers are forked, so parsers with lambdas as filters work as they are: they are
+inherited by the workers instead of being pickled.
+"""
+
+import multiprocessing as mp
+from os import cpu_count
+from urllib.parse import urlsplit
+
+from ..core import CoreScrape
+from ..sink.result_sink import plain
+from . import page_archive as pa
+
+# pylint: disable=invalid-name, too-many-arguments, global-statement
+
+_JOB = {}  # parser and rules inherited by the forked workers
+
+
+def _replay_batch(batch):
+    """Evaluates a batch of records. Runs in the workers."""
+
+    parser, rules = _JOB['parser'], _JOB['rules']
+    files = _JOB.setdefault('files', {})
+    if _JOB['path'] not in files:
+        files[_JOB['path']] = open(_JOB['path'], 'rb')
+    _file = files[_JOB['path']]
+
+    res = []
+    for offset, size in batch:
+        page = pa.read_record(_file, offset, size)
+        banned = None
+        if page.status_code == 403:
+            banned = 'status 403'
+        elif rules is not None:
+            domain = (urlsplit(page.url).hostname or '').lower()
+            banned = rules.banned(page, domain)
+
+        result = None
+        if banned is None and parser is not None and page.status_code != 404:
+            result = plain(parser.parse(page))  # lxml results are not picklable
+        res.append((page.requested, banned, result))
+    return res
+
+
+class Replay(CoreScrape):
+    """
+    Replays archived pages through ban rules and a parser.
+
+    Params:
+        path: str path of the archive
+        parser: parser (object with a 'parse' method) or None to only check bans
+        rules: corescrape.rules.rule_engine.RuleEngine or None to skip ban checks
+        processes: int or None. Number of processes. Default is the number of CPUs.
+        batchsize: int number of records handed to a worker at a time
+        logoperator: corescrape.logs.LogOperator or None. It is not used by the
+            workers.
+    """
+
+    def __init__(self, path, parser=None, rules=None, processes=None,
+                 batchsize=256, logoperator=None):
+        """Constructor."""
+
+        self.path = path
+        self.parser = parser
+        self.rules = rules
+        self.processes = processes or cpu_count() or 1
+        self.batchsize = batchsize
+
+        super().__init__(logoperator=logoperator)
+
+    def __batches(self):
+        """Yields batches of (offset, size) from the index."""
+
+        batch = []
+        for offset, size, _, _ in pa.read_index(self.path):
+            batch.append((offset, size))
+            if len(batch) >= self.batchsize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run(self):
+        """
+        Streams the results.
+
+        Yields:
+            tuple (url, ban reason or None, parse result or None) per archived page
+        """
+
+        global _JOB
+
+        # workers must not write in the log file of the parent
+        logs = [(obj, obj.logoperator) for obj in [self.parser, self.rules]
+                if obj is not None and hasattr(obj, 'logoperator')]
+        for obj, _ in logs:
+            obj.logoperator = None
+
+        _JOB = {'parser': self.parser, 'rules': self.rules, 'path': self.path}
+        self.log('Replaying {} with {} processes'.format(self.path, self.processes))
+
+        count = banned = 0
+        try:
+            if self.processes == 1:
+                results = map(_replay_batch, self.__batches())
+                for batch in results:
+                    for item in batch:
+                        count += 1
+                        banned += item[1] is not None
+                        yield item
+                return
+
+            with mp.get_context('fork').Pool(self.processes) as pool:
+                for batch in pool.imap(_replay_batch, self.__batches()):
+                    for item in batch:
+                        count += 1
+                        banned += item[1] is not None
+                        yield item
+        finally:
+            for obj, logoperator in logs:
+                obj.logoperator = logoperator
+            for _file in _JOB.get('files', {}).values():
+                _file.close()
+            _JOB = {}
+            self.log('Replayed {} pages, {} banned'.format(count, banned),
+                     tmsg='info')
@@ -0,0 +1,125 @@
+"""
+Segment Store
+
+On-disk storage for the full-page mode (no parser). Instead of keeping whole
+requests.models.Response objects in memory, bodies are written to a compressed,
+append-only segment file (same record format as `page_archive`) and the thread
+controller keeps lightweight `PageHandle` objects: URL, status code, offset and size.
+The records are read on demand from a memory map of the segment, so the memory used
+by a run does not grow with the size of the crawl.
+"""
+
+import mmap
+from os.path import getsize
+from threading import Lock
+
+from . import page_archive as pa
+
+# pylint: disable=invalid-name, too-many-arguments, too-few-public-methods
+
+class PageHandle:
+    """
+    Handle of a page stored in a SegmentStore.
+
+    The attributes 'content', 'text' and 'headers' are read from the segment each
+    time they are accessed. Use 'page' to load the whole record once.
+    """
+
+    __slots__ = ['store', 'url', 'status_code', 'offset', 'size']
+
+    def __init__(self, store, url, status_code, offset, size):
+        """Constructor."""
+
+        self.store = store
+        self.url = url
+        self.status_code = status_code
+        self.offset = offset
+        self.size = size
+
+    def page(self):
+        """Loads the record as a corescrape.archive.page_archive.ArchivedPage."""
+
+        return self.store.read(self.offset, self.size)
+
+    @property
+    def content(self):
+        """Raw body."""
+
+        return self.page().content
+
+    @property
+    def text(self):
+        """Decoded body."""
+
+        return self.page().text
+
+    @property
+    def headers(self):
+        """Response headers."""
+
+        return self.page().headers
+
+    def __repr__(self):
+        """Representation."""
+
+        return '<PageHandle [{}] {}>'.format(self.status_code, self.url)
+
+
+class SegmentStore(pa.PageArchive):
+    """
+    Append-only segment with memory mapped reads. Thread safe.
+
+    Params:
+        path: str path of the segment file. The index is written to path + '.idx'.
+        compresslevel: int gzip compression level
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, path, compresslevel=6, logoperator=None):
+        """Constructor."""
+
+        super().__init__(path, compresslevel=compresslevel, logoperator=logoperator)
+        self.rlock = Lock()
+        self.reader = None
+        self.map = None
+
+    def put(self, page, url=None):
+        """Stores a response and returns its PageHandle."""
+
+        offset, size = self.write(page, url=url)
+        return PageHandle(self, url or page.url, page.status_code, offset, size)
+
+    def read(self, offset, size):
+        """Reads a record. Remaps the segment if it grew past the current map."""
+
+        with self.rlock:
+            if self.map is None or offset + size > len(self.map):
+                self.flush()
+                if self.map is not None:
+                    self.map.close()
+                if self.reader is None:
+                    self.reader = open(self.path, 'rb')
+                if not getsize(self.path):
+                    raise ValueError('Empty segment {}'.format(self.path))
+                self.map = mmap.mmap(self.reader.fileno(), 0, access=mmap.ACCESS_READ)
+            record = self.map[offset:offset + size]
+        return pa.decode_record(record)
+
+    def handles(self):
+        """Yields handles of every page stored, read from the index."""
+
+        self.flush()
+        for offset, size, status, url in pa.read_index(self.path):
+            yield PageHandle(self, url, status, offset, size)
+
+    def close(self):
+        """Closes the segment and the memory map."""
+
+        with self.rlock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
+        super().close()
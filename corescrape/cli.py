@@ -0,0 +1,205 @@
+"""
+Command Line Interface
+
+Streams URLs (one per line) from a file or stdin through a ScrapeService and writes
+one NDJSON record per URL to stdout, as soon as it is completed. Records are not in
+the input order. Usage:
+
+    cat urls.txt | python -m corescrape -x '//title/text()' -p proxies.txt
+    python -m corescrape urls.txt -x 'title=//title/text()' -x 'links=//a/@href'
+
+Modules are imported only once the arguments are read, and lxml only if there are
+xpaths to apply, to keep the start up of short lived jobs cheap.
+"""
+
+import argparse
+import json
+import sys
+from threading import BoundedSemaphore, Lock
+
+# pylint: disable=invalid-name, import-outside-toplevel
+
+def parse_args(argv=None):
+    """Reads the command line arguments."""
+
+    ap = argparse.ArgumentParser(
+        prog='corescrape',
+        description='Scrape URLs read from a file or stdin, writing NDJSON to stdout.')
+    ap.add_argument('input', nargs='?', default='-',
+                    help="file with one URL per line. Default '-' (stdin)")
+    ap.add_argument('-x', '--xpath', action='append', default=[],
+                    help="xpath applied to each page, either 'XPATH' or "
+                    "'key=XPATH' (repeat for several keys). Without xpaths, the "
+                    "status and size of each page are written")
+    ap.add_argument('--regex', help='regex filtering the results of a single xpath')
+    ap.add_argument('--maxmatches', type=int,
+                    help='stop parsing a page after this many matches')
+    ap.add_argument('--stoptag', help='stop parsing a page at the end of this tag')
+    ap.add_argument('--body', action='store_true',
+                    help='without xpaths, also write the text of each page')
+    ap.add_argument('-t', '--threads', type=int, default=8,
+                    help='number of threads. Default 8')
+    ap.add_argument('-c', '--conf', help='conf dir. Default is the package conf/')
+    ap.add_argument('-p', '--proxies',
+                    help='file with one proxy (IP:PORT) per line')
+    ap.add_argument('--retrieve', action='store_true',
+                    help='collect proxies from the APIs in apilist.txt')
+    ap.add_argument('--timeout', type=int, default=3,
+                    help='timeout of each request in seconds. Default 3')
+    ap.add_argument('--urlbudget', type=int, default=10,
+                    help='failed attempts allowed per URL. Default 10')
+    ap.add_argument('--inflight', type=int,
+                    help='URLs submitted and not completed at a time. '
+                    'Default 4 per thread')
+    ap.add_argument('--log', help='log file. Default is no log')
+    ap.add_argument('-v', '--verbose', action='store_true',
+                    help='print the log messages to stderr')
+    return ap.parse_args(argv)
+
+
+def build_parser(args, logoperator=None):
+    """Parser defined by the xpaths or None to collect whole pages."""
+
+    if not args.xpath:
+        return None
+
+    kwargs = {'stoptag': args.stoptag, 'maxmatches': args.maxmatches}
+    keyed = []
+    for xpath in args.xpath:
+        key, sep, rest = xpath.partition('=')
+        keyed.append((key, rest) if sep and key.isidentifier() else (None, xpath))
+
+    if all(key is None for key, _ in keyed):
+        if len(keyed) > 1:
+            raise SystemExit("Several xpaths must be given as 'key=XPATH'")
+        from .pgparser.simple_parser import SimpleParser
+        return SimpleParser(keyed[0][1], regex=args.regex, logoperator=logoperator,
+                            **kwargs)
+
+    if any(key is None for key, _ in keyed):
+        raise SystemExit("Several xpaths must be given as 'key=XPATH'")
+    if args.regex:
+        raise SystemExit("Option '--regex' requires a single xpath")
+    from .pgparser.custom_parser import CustomPageParser
+    return CustomPageParser({key: [xpath, None] for key, xpath in keyed},
+                            logoperator=logoperator, **kwargs)
+
+
+def read_proxies(path):
+    """Set of proxies of a file."""
+
+    with open(path, 'r') as _file:
+        return {line.strip() for line in _file if line.strip()}
+
+
+class Writer:
+    """Thread safe NDJSON writer. Stops writing once the reader goes away."""
+
+    def __init__(self, stream):
+        """Constructor."""
+
+        self.stream = stream
+        self.lock = Lock()
+        self.closed = False
+
+    def write(self, record):
+        """Writes a record as a line."""
+
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.stream.write(line)
+                self.stream.flush()
+            except BrokenPipeError:
+                self.closed = True  # e.g. piped to 'head'
+
+
+def record_of(url, future, body=False):
+    """NDJSON record of a completed future."""
+
+    from .sink.result_sink import plain
+
+    if future.cancelled():
+        return {'url': url, 'error': 'cancelled'}
+    err = future.exception()
+    if err is not None:
+        return {'url': url, 'error': str(err)}
+
+    result = future.result()
+    if result is None or not hasattr(result, 'status_code'):
+        return {'url': url, 'result': plain(result)}
+
+    record = {'url': url, 'status': result.status_code, 'final': result.url,
+              'length': len(result.content)}
+    if body:
+        record['text'] = result.text
+    return record
+
+
+def main(argv=None):
+    """Runs the command line interface. Returns the exit status."""
+
+    args = parse_args(argv)
+
+    from .logs.log_operator import LogOperator
+    from .proxy.rotator import Rotator
+    from .threads.service import ScrapeService
+
+    out = Writer(sys.stdout)
+    logoperator = None
+    if args.log or args.verbose:
+        # verbose messages must not mix with the records in stdout
+        logoperator = LogOperator(args.log or '/dev/null', verbose=args.verbose,
+                                  stream=sys.stderr)
+
+    parser = build_parser(args, logoperator)
+    rotator = Rotator(confpath=args.conf, timeout=args.timeout,
+                      logoperator=logoperator, sessions=True,
+                      urlbudget=args.urlbudget,
+                      importdyn=read_proxies(args.proxies) if args.proxies else None)
+    if args.retrieve:
+        rotator.retrieve()
+
+    slots = BoundedSemaphore(args.inflight or 4 * args.threads)
+
+    def done(url, future):
+        out.write(record_of(url, future, args.body))
+        slots.release()
+
+    status = 0
+    source = sys.stdin if args.input == '-' else open(args.input, 'r')
+    service = ScrapeService(args.threads, rotator, parser, logoperator=logoperator)
+    service.start()
+    try:
+        for line in source:
+            url = line.strip()
+            if not url or url.startswith('#'):
+                continue
+            if out.closed:
+                break
+            slots.acquire()
+            try:
+                future = service.submit(url)
+            except ValueError as err:
+                out.write({'url': url, 'error': str(err)})
+                slots.release()
+                continue
+            except RuntimeError:  # the service stopped, e.g. out of proxies
+                slots.release()
+                status = 1
+                break
+            future.add_done_callback(lambda f, url=url: done(url, f))
+        service.shutdown(cancel=out.closed)
+    except KeyboardInterrupt:
+        service.shutdown(cancel=True)
+        status = 130
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    if service.event.state.is_OUT_OF_PROXIES():
+        sys.stderr.write('corescrape: out of proxies\n')
+        status = 1
+    return status
@@ -4,7 +4,7 @@ Defines the base class for this package.
 Imports log operator and takes a log or None
 """
 
-import logs
+from .. import logs
 
 # pylint: disable=too-few-public-methods
 
@@ -28,3 +28,23 @@ class CoreScrapeInvalidProxy(CoreScrapeException):
         """Constructor."""
 
         super().__init__('Invalid proxy')
+
+class CoreScrapeCancelled(CoreScrapeException):
+    """Request cancelled by an event."""
+
+    def __init__(self):
+        """Constructor."""
+
+        super().__init__('Request cancelled')
+
+class CoreScrapeUrlFailed(CoreScrapeException):
+    """URL failed more times than its budget allows."""
+
+    def __init__(self, url, outcomes, fault):
+        """Constructor."""
+
+        self.url = url
+        self.outcomes = outcomes
+        self.fault = fault
+        super().__init__('URL {} failed {} times ({} fault)'.format(
+            url, len(outcomes), fault))
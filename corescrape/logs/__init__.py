@@ -1,3 +1,8 @@
 """Subpackage logs."""
 
-from . import log_operator
+from .. import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    'log_operator',
+    'tracer',
+])
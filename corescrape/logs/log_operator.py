@@ -14,15 +14,24 @@ from datetime import datetime
 # pylint: disable=invalid-name
 
 class LogOperator:
-    """Log Operator."""
+    """
+    Log Operator.
 
-    def __init__(self, file=None, verbose=False):
+    Params:
+        file: str or None path of the log file
+        verbose: bool. If True, messages are also printed.
+        stream: file object or None the verbose messages are printed to. If None,
+            they go to the standard output.
+    """
+
+    def __init__(self, file=None, verbose=False, stream=None):
         """Constructor."""
 
         self.open = False
         self.filename = file if file else abspath(dirname(__file__)) + '/log.txt'
         self.__file = open(self.filename, 'a+')
         self.verbose = verbose
+        self.stream = stream
         self.buffer = ''
         self.count = 0
         self.dtformat = '%Y-%m-%d %H:%M:%S:%f'
@@ -53,7 +62,7 @@ class LogOperator:
 
         if self.verbose:
             colors = LogOperator.color(tmsg)
-            print('{0}{2}{1}'.format(*colors, _msg))
+            print('{0}{2}{1}'.format(*colors, _msg), file=self.stream)
 
     def close(self):
         """Close file."""
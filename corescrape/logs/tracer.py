@@ -0,0 +1,218 @@
+"""
+Tracer
+
+Opt-in, per URL span tracing. Each URL collected is a trace and the stages it goes
+through (waiting for a proxy, connecting, downloading, ban scan, parsing...) are
+spans of that trace. Traces are sampled: only a fraction 'samplerate' of the URLs
+is traced and, for the others, spans cost a thread local lookup.
+
+Spans are aggregated by stage (constant memory) and the last 'maxspans' of them are
+kept to be exported as Chrome trace event JSON (chrome://tracing, Perfetto,
+speedscope). The aggregates can be exported as a cProfile compatible stats file,
+readable with pstats, snakeviz or gprof2dot.
+
+IMPORTANT:
+Like the log operator, this module can NEVER import from core.CoreScrape
+"""
+
+import json
+import marshal
+from collections import deque
+from contextlib import nullcontext
+from os import getpid
+from random import random
+from threading import Lock, local, get_ident
+from time import perf_counter
+
+# pylint: disable=invalid-name, too-many-instance-attributes, too-few-public-methods
+
+NOOP = nullcontext()
+PSTATS_FILE = 'corescrape'
+
+
+class _Trace:
+    """Context manager of a trace. Nested traces of a thread are ignored."""
+
+    def __init__(self, tracer, url):
+        """Constructor."""
+
+        self.tracer = tracer
+        self.url = url
+        self.owner = False
+
+    def __enter__(self):
+        """Starts the trace unless one is already running in this thread."""
+
+        ctx = self.tracer.ctx
+        if getattr(ctx, 'url', None) is None:
+            self.owner = True
+            ctx.url = self.url
+            ctx.sampled = random() < self.tracer.samplerate
+            ctx.stack = []  # [name, time spent in children]
+        return self
+
+    def __exit__(self, *args):
+        """Ends the trace."""
+
+        if self.owner:
+            self.tracer.ctx.url = None
+
+
+class _Span:
+    """Context manager of a span."""
+
+    __slots__ = ['tracer', 'ctx', 'name', 'args', 'start']
+
+    def __init__(self, tracer, ctx, name, args):
+        """Constructor."""
+
+        self.tracer = tracer
+        self.ctx = ctx
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        """Starts the span."""
+
+        self.ctx.stack.append([self.name, 0.0])
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        """Ends the span."""
+
+        duration = perf_counter() - self.start
+        _, children = self.ctx.stack.pop()
+        self.tracer.add(self.ctx, self.name, self.start, duration,
+                        duration - children, self.args)
+
+
+class Tracer:
+    """
+    Span tracer.
+
+    Usage:
+        with tracer.trace(url):
+            with tracer.span('parse'):
+                ...
+
+    Params:
+        samplerate: float. Fraction of the URLs traced, from 0 to 1. Low rates make
+            it safe to leave tracing on in production.
+        maxspans: int. Number of the most recent spans kept for 'export_chrome'.
+            0 keeps only the aggregates.
+    """
+
+    def __init__(self, samplerate=1.0, maxspans=100000):
+        """Constructor."""
+
+        if not 0 <= samplerate <= 1:
+            raise ValueError("Param 'samplerate' must be between 0 and 1")
+
+        self.samplerate = samplerate
+        self.ctx = local()
+        self.lock = Lock()
+        self.origin = perf_counter()
+        self.spans = deque(maxlen=maxspans)
+        self.aggregates = {}  # (parent, name) -> [count, total, self, max]
+
+    def trace(self, url):
+        """Context manager tracing a URL, sampled or not."""
+
+        return _Trace(self, url)
+
+    def sampled(self):
+        """Tells if the URL running in this thread is traced."""
+
+        return getattr(self.ctx, 'url', None) is not None and self.ctx.sampled
+
+    def span(self, name, **args):
+        """Context manager of a span of the current trace."""
+
+        if not self.sampled():
+            return NOOP
+        return _Span(self, self.ctx, name, args)
+
+    def record(self, name, start, duration, **args):
+        """Records a span measured elsewhere, child of the current span."""
+
+        if self.sampled():
+            self.add(self.ctx, name, start, duration, duration, args)
+
+    def add(self, ctx, name, start, duration, selftime, args):
+        """Adds a finished span."""
+
+        parent = None
+        if ctx.stack:
+            ctx.stack[-1][1] += duration
+            parent = ctx.stack[-1][0]
+
+        if self.spans.maxlen:
+            self.spans.append((name, ctx.url, get_ident(), start, duration, args))
+
+        with self.lock:
+            agg = self.aggregates.get((parent, name))
+            if agg is None:
+                agg = self.aggregates[(parent, name)] = [0, 0.0, 0.0, 0.0]
+            agg[0] += 1
+            agg[1] += duration
+            agg[2] += selftime
+            agg[3] = max(agg[3], duration)
+
+    def stats(self):
+        """Count, total, self and max seconds by stage."""
+
+        stats = {}
+        with self.lock:
+            for (_, name), (cnt, total, selftime, top) in self.aggregates.items():
+                stage = stats.setdefault(name, {'count': 0, 'total': 0.0,
+                                                'self': 0.0, 'max': 0.0})
+                stage['count'] += cnt
+                stage['total'] += total
+                stage['self'] += selftime
+                stage['max'] = max(stage['max'], top)
+        return stats
+
+    def export_chrome(self, path):
+        """Writes the spans kept as Chrome trace event JSON."""
+
+        pid = getpid()
+        events = []
+        for name, url, tid, start, duration, args in list(self.spans):
+            events.append({
+                'name': name, 'cat': 'corescrape', 'ph': 'X', 'pid': pid,
+                'tid': tid, 'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6,
+                'args': dict(args, url=url),
+            })
+        with open(path, 'w', encoding='utf-8') as _file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, _file,
+                      default=str)
+
+    def export_pstats(self, path):
+        """
+        Writes the aggregates as a cProfile compatible stats file. Stages are the
+        functions, e.g. pstats.Stats(path).sort_stats('cumulative').print_stats()
+        """
+
+        def func(name):
+            return (PSTATS_FILE, 0, name)
+
+        stats = {}
+        with self.lock:
+            aggregates = list(self.aggregates.items())
+        for (parent, name), (cnt, total, selftime, _) in aggregates:
+            cc, nc, tt, ct, callers = stats.get(func(name), (0, 0, 0.0, 0.0, {}))
+            if parent is not None:
+                callers[func(parent)] = (cnt, cnt, selftime, total)
+            stats[func(name)] = (cc + cnt, nc + cnt, tt + selftime, ct + total,
+                                 callers)
+        with open(path, 'wb') as _file:
+            marshal.dump(stats, _file)
+
+    def clear(self):
+        """Drops every span and aggregate."""
+
+        with self.lock:
+            self.spans.clear()
+            self.aggregates = {}
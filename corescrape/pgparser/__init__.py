@@ -0,0 +1,10 @@
+"""Subpackage pgparser."""
+
+from .. import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    'simple_parser',
+    'custom_parser',
+    'deduplicator',
+    'memo_store',
+])
@@ -6,12 +6,77 @@ be constructed in this project. We advise you to build your own parser.
 
 Do parsing in a requests.model.Response to retrieve information based on informed
 xpaths.
+
+Filters decorated with 'batched' take the values of many pages at once. If the
+parser has a 'batchsize', the thread controller keeps the raw values of the pages
+in a FilterBatch and runs each batched filter once per batch, e.g. with NumPy or
+pandas string operations, instead of once per page. Results are mapped back to
+their URLs and the last batch is flushed at the end of the run.
 """
 
-import pgparser.simple_parser as sp
+from hashlib import blake2b
+from threading import Lock
+
+from . import simple_parser as sp
+from ..core import CoreScrape
 
 # pylint: disable=invalid-name, too-few-public-methods, multiple-statements
 
+def func_id(func):
+    """Identifies a filter function by its name and its code."""
+
+    if func is None:
+        return None
+
+    name = '{}.{}'.format(getattr(func, '__module__', None),
+                          getattr(func, '__qualname__', repr(func)))
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return name
+    return '{}:{}'.format(name, blake2b(
+        code.co_code + repr(code.co_consts).encode('utf-8'),
+        digest_size=8).hexdigest())
+
+def batched(func=None, numpy=False):
+    """
+    Marks a filter as batched. A batched filter receives a flat sequence with the
+    values of one or many pages and returns a sequence of the same length, one
+    output per input. Outputs equal to None are dropped.
+
+    Params:
+        numpy: bool. If True, the values are given as a NumPy array of str, e.g. for
+            'numpy.char' operations. Requires the package 'numpy'.
+
+    Use as '@batched' or '@batched(numpy=True)'.
+    """
+
+    def mark(f):
+        f.batched = True
+        f.numpy = numpy
+        return f
+
+    return mark(func) if func is not None else mark
+
+def is_batched(func):
+    """Tells if the filter is batched."""
+
+    return getattr(func, 'batched', False)
+
+def run_batched(func, values):
+    """Runs a batched filter over a flat list of values."""
+
+    if func.numpy:
+        import numpy  # pylint: disable=import-outside-toplevel
+        values = numpy.asarray(values, dtype=str)
+
+    out = func(values)
+    if len(out) != len(values):
+        raise ValueError('Batched filter {} returned {} values for {}'.format(
+            func_id(func), len(out), len(values)))
+    if hasattr(out, 'tolist'):
+        out = out.tolist()  # NumPy or pandas to plain values
+    return out
+
 class CustomPageParser(sp.SimpleParser):
     """
     Custom Page Parser.
@@ -22,12 +87,21 @@ class CustomPageParser(sp.SimpleParser):
     Params:
         xpaths: dict - User defined keys to organize values, each one being a list
             of xpath (str) and function to filter information. The function should
-            either be None or capable of filtering a list of str.
+            either be None or capable of filtering a list of str. Filters decorated
+            with 'batched' may run over the values of many pages at once.
         logoperator: corescraper.logs.log_operator.LogOperator - Log object or None
             to manage logging messages. Default None
+        kwargs: options of SimpleParser ('encoding', 'stoptag', 'maxmatches',
+            'chunksize', 'prefix' and 'follow'). 'maxmatches' is satisfied only
+            when every key has collected that many matches.
+        batchsize: int or None. If informed, filters decorated with 'batched' are
+            not applied by 'parse' but by 'filter_batch', over the raw values of
+            'batchsize' pages at a time (see FilterBatch). Only
+            corescrape.threads.corescrape_thread.CoreScrapeThread runs batches.
+            If None, batched filters run once per page.
     """
 
-    def __init__(self, xpaths, logoperator=None):
+    def __init__(self, xpaths, logoperator=None, batchsize=None, **kwargs):
         """Constructor."""
 
         errmsg = (
@@ -44,22 +118,202 @@ class CustomPageParser(sp.SimpleParser):
                 raise ValueError(errmsg)
             if xpaths[key][1] is not None and not callable(xpaths[key][1]):
                 raise ValueError(errmsg)
+            if getattr(xpaths[key][1], 'numpy', False):
+                # pylint: disable=import-outside-toplevel, unused-import
+                try:
+                    import numpy
+                except ImportError as err:
+                    raise ImportError("Filter of key {} requires the package "
+                                      "'numpy'".format(key)) from err
+
+        if batchsize is not None and (not isinstance(batchsize, int) or
+                                      batchsize < 1):
+            raise ValueError("Param 'batchsize' must be a positive 'int' or None")
 
         self.xpaths = xpaths
-        super().__init__(None, logoperator=logoperator)
+        self.batchsize = batchsize
+        super().__init__(None, logoperator=logoperator, **kwargs)
 
         self.log('Started parser for xpaths {}'.format(self.xpaths))
 
-    def parse(self, response, threadid=None):
-        """From a request.model.Response, applies xpaths and retrieves data."""
+    def config(self):
+        """Configuration that defines the output of this parser."""
 
-        if not self.valid_response(response, threadid): return []
+        xpaths = [(key, self.xpaths[key][0], func_id(self.xpaths[key][1]))
+                  for key in sorted(self.xpaths)]
+        config = [type(self).__name__, xpaths, self.stoptag, self.maxmatches,
+                  self.encoding]
+        if self.prefix is not None:
+            config.append(self.prefix)  # pages are truncated
+        if self.batchsize is not None:
+            config.append('batched')  # 'parse' leaves batched filters out
+        return config
+
+    def watched_tags(self):
+        """Tags whose end may bring new matches of any xpath, or None."""
+
+        tags = set()
+        for key in self.xpaths:
+            tag = sp.last_tag(self.xpaths[key][0])
+            if tag is None:
+                return None
+            tags.add(tag)
+        return tags
+
+    def enough(self, root):
+        """Test if every xpath already collected 'maxmatches' matches."""
+
+        if self.maxmatches is None:
+            return False
+        return all(len(root.xpath(self.xpaths[key][0])) >= self.maxmatches
+                   for key in self.xpaths)
+
+    def extract(self, root, threadid=None):
+        """Applies xpaths and their filters to an already parsed tree."""
 
         res = {}
         for key in self.xpaths:
-            hs = sp.html.fromstring(response.text).xpath(self.xpaths[key][0])
-            hs = self.xpaths[key][1](hs)
+            hs = root.xpath(self.xpaths[key][0])
+            if self.maxmatches: hs = hs[:self.maxmatches]
+            func = self.xpaths[key][1]
+            if func is not None and is_batched(func):
+                if self.batchsize is None:
+                    hs = [h for h in run_batched(func, [str(h) for h in hs])
+                          if h is not None]
+                else:
+                    hs = [str(h) for h in hs]  # raw, filtered by 'filter_batch'
+            elif func is not None:
+                hs = func(hs)
             self.log('Collected {} info for key {} [Thread {}]'.format(
                 len(hs), key, threadid))
             res[key] = hs
         return res if any(res.values()) else {}
+
+    def parse(self, response, threadid=None):
+        """From a request.model.Response, applies xpaths and retrieves data."""
+
+        if not self.valid_response(response, threadid): return []
+
+        root = self.tree(response, threadid)
+        if root is None: return []
+
+        return self.extract(root, threadid)
+
+    def filter_batch(self, records):
+        """
+        Runs the batched filters over the raw results of many pages, each filter
+        called once for the whole batch.
+
+        Params:
+            records: list of (url, result) with results returned by 'parse'
+
+        Returns:
+            list of (url, result) with the filtered results. Pages left without
+            values are dropped, as 'parse' would have done.
+        """
+
+        # copies, since results may be shared with the deduplicator
+        records = [(url, dict(res)) for url, res in records]
+        for key in self.xpaths:
+            func = self.xpaths[key][1]
+            if func is None or not is_batched(func):
+                continue
+
+            flat = []
+            for _, res in records:
+                flat.extend(res.get(key, []))
+            out = run_batched(func, flat) if flat else []
+
+            start = 0
+            for _, res in records:
+                if key not in res: continue  # e.g. duplicates marked
+                end = start + len(res[key])
+                res[key] = [h for h in out[start:end] if h is not None]
+                start = end
+
+        return [(url, res) for url, res in records if any(res.values())]
+
+
+class FilterBatch(CoreScrape):
+    """
+    Thread safe accumulator of raw results for a parser with batched filters.
+    Once 'batchsize' results are held, the batch is filtered and each filtered
+    result is handed to 'emit'. If a filter fails over the batch, its pages are
+    filtered one by one and the pages it still fails on are dropped and counted
+    in 'failed'.
+
+    Params:
+        parser: CustomPageParser with a 'batchsize'
+        emit: callable receiving (url, result) for each filtered result
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, parser, emit, logoperator=None):
+        """Constructor."""
+
+        self.parser = parser
+        self.emit = emit
+        self.records = []
+        self.batches = 0
+        self.pages = 0
+        self.failed = 0
+        self.lock = Lock()
+
+        super().__init__(logoperator=logoperator)
+
+    def put(self, url, result):
+        """Adds the raw result of a page."""
+
+        with self.lock:
+            self.records.append((url, result))
+            if len(self.records) < self.parser.batchsize:
+                return
+            records, self.records = self.records, []
+        self.__run(records)
+
+    def __filter(self, records):
+        """Filters a batch, page by page if it fails as a whole."""
+
+        try:
+            return self.parser.filter_batch(records)
+        except Exception as err:  # pylint: disable=broad-except
+            self.log('Batched filter failed over {} pages: {}. Filtering them one '
+                     'by one'.format(len(records), err), tmsg='error')
+
+        filtered = []
+        for url, res in records:
+            try:
+                filtered.extend(self.parser.filter_batch([(url, res)]))
+            except Exception as err:  # pylint: disable=broad-except
+                self.log('Batched filter failed for {}: {}. Result dropped'.format(
+                    url, err), tmsg='error')
+                with self.lock:
+                    self.failed += 1
+        return filtered
+
+    def __run(self, records):
+        """Filters a batch and emits its results."""
+
+        filtered = self.__filter(records)
+        with self.lock:
+            self.batches += 1
+            self.pages += len(records)
+        self.log('Filtered a batch of {} pages, {} kept'.format(
+            len(records), len(filtered)))
+        for url, res in filtered:
+            self.emit(url, res)
+
+    def flush(self):
+        """Filters the pages still held."""
+
+        with self.lock:
+            records, self.records = self.records, []
+        if records:
+            self.__run(records)
+
+    def stats(self):
+        """Batch counters."""
+
+        with self.lock:
+            return {'batches': self.batches, 'pages': self.pages,
+                    'failed': self.failed, 'pending': len(self.records)}
@@ -0,0 +1,191 @@
+"""
+Deduplicator
+
+Fingerprints page bodies before parsing so identical pages (redirects to the same
+page, soft-404s, parameter variants) are parsed only once. Every body gets a fast
+hash of its raw bytes and, optionally, a 64 bits SimHash of its text that also
+catches near-duplicates (pages differing only by a timestamp or a token, for
+instance).
+
+Fingerprints are kept in a bounded LRU index together with the URL and the parse
+result of the first page seen. When a body is found in the index, the thread
+controller either reuses that result or marks the record as a duplicate of the
+first URL, skipping the parser in both cases.
+"""
+
+import re
+from collections import Counter, OrderedDict
+from hashlib import blake2b
+from threading import Lock
+
+from ..core import CoreScrape
+
+# pylint: disable=invalid-name, too-many-arguments, too-many-instance-attributes
+
+TAGS = re.compile(rb'<(script|style)\b.*?</\1\s*>|<[^>]*>', re.S | re.I)
+WORDS = re.compile(rb'\w+')
+
+NBITS = 64
+NBANDS = 4  # SimHash is split in bands to find candidates without full scans
+
+
+# Bits of a byte spread into lanes of LANE bits, one table per byte of a hash, so
+# the bit counts of many weighted hashes add up in a single integer
+LANE = 32
+SPREAD = [[sum(1 << (LANE * (8 * j + b)) for b in range(8) if byte >> b & 1)
+           for byte in range(256)] for j in range(NBITS // 8)]
+
+
+def simhash(content, shingle=3):
+    """64 bits SimHash of the words of an HTML body (bytes)."""
+
+    words = WORDS.findall(TAGS.sub(b' ', content).lower())
+    if len(words) < shingle:
+        shingles = Counter([b' '.join(words)])
+    else:
+        shingles = Counter(b' '.join(words[i:i + shingle])
+                           for i in range(len(words) - shingle + 1))
+
+    counts = 0
+    for sh, weight in shingles.items():
+        digest = blake2b(sh, digest_size=8).digest()[::-1]  # low byte first
+        spread = 0
+        for j, byte in enumerate(digest):
+            spread += SPREAD[j][byte]
+        counts += weight * spread
+
+    # a bit is set if more than half of the shingles have it
+    total = sum(shingles.values())
+    mask = (1 << LANE) - 1
+    return sum(1 << i for i in range(NBITS)
+               if 2 * (counts >> (LANE * i) & mask) > total)
+
+
+def bands(h):
+    """Splits a SimHash into its bands."""
+
+    width = NBITS // NBANDS
+    mask = (1 << width) - 1
+    return [(i, h >> (i * width) & mask) for i in range(NBANDS)]
+
+
+class Deduplicator(CoreScrape):
+    """
+    Content-hash deduplication with optional near-duplicate detection.
+
+    Params:
+        maxsize: int maximum number of fingerprints held. The least recently seen
+            are evicted first.
+        near: bool. If True, also computes SimHash to detect near-duplicates.
+        maxdistance: int maximum Hamming distance between two SimHashes for the
+            pages to be considered the same. Must be lower than 4 so that candidates
+            can be found by bands.
+        mode: str either 'reuse' (emit the prior parse result for the duplicate
+            URL) or 'mark' (emit {'duplicate': first URL} instead).
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, maxsize=100000, near=False, maxdistance=3, mode='reuse',
+                 logoperator=None):
+        """Constructor."""
+
+        if mode not in ['reuse', 'mark']:
+            raise ValueError("Param 'mode' must either be 'reuse' or 'mark'")
+
+        if not 0 <= maxdistance < NBANDS:
+            raise ValueError(
+                "Param 'maxdistance' must be between 0 and {}".format(NBANDS - 1))
+
+        self.maxsize = maxsize
+        self.near = near
+        self.maxdistance = maxdistance
+        self.mode = mode
+
+        self.index = OrderedDict()  # digest -> (url, result, simhash)
+        self.buckets = {}  # (band, value) -> set of digests
+        self.lock = Lock()
+
+        self.seen = 0
+        self.exact = 0
+        self.similar = 0
+
+        super().__init__(logoperator=logoperator)
+
+    def __candidates(self, h):
+        """Digests whose SimHash share at least one band with 'h'."""
+
+        found = set()
+        for band in bands(h):
+            found |= self.buckets.get(band, set())
+        return found
+
+    def __evict(self):
+        """Drops the least recently seen fingerprints."""
+
+        while len(self.index) > self.maxsize:
+            digest, (_, _, h) = self.index.popitem(last=False)
+            if h is None: continue
+            for band in bands(h):
+                bucket = self.buckets.get(band)
+                if bucket is not None:
+                    bucket.discard(digest)
+                    if not bucket: del self.buckets[band]
+
+    def check(self, content):
+        """
+        Looks a body up in the index.
+
+        Returns:
+            key: tuple to be informed to 'add' if the body was not found
+            entry: tuple (url, result) of the first page with this body or None
+        """
+
+        digest = blake2b(content, digest_size=16).digest()
+        h = simhash(content) if self.near else None
+
+        with self.lock:
+            self.seen += 1
+            if digest in self.index:
+                self.index.move_to_end(digest)
+                self.exact += 1
+                return (digest, h), self.index[digest][:2]
+
+            if h is not None:
+                for candidate in self.__candidates(h):
+                    other = self.index[candidate][2]
+                    if bin(h ^ other).count('1') <= self.maxdistance:
+                        self.index.move_to_end(candidate)
+                        self.similar += 1
+                        return (digest, h), self.index[candidate][:2]
+
+        return (digest, h), None
+
+    def add(self, key, url, result):
+        """Stores the parse result of a body not seen before."""
+
+        digest, h = key
+        with self.lock:
+            self.index[digest] = (url, result, h)
+            if h is not None:
+                for band in bands(h):
+                    self.buckets.setdefault(band, set()).add(digest)
+            self.__evict()
+
+    def emit(self, entry):
+        """Result to be emitted for a duplicate given the first page seen."""
+
+        url, result = entry
+        if self.mode == 'mark':
+            return {'duplicate': url}
+        return result
+
+    def ratio(self):
+        """Ratio of bodies found in the index."""
+
+        return (self.exact + self.similar) / self.seen if self.seen else 0.
+
+    def stats(self):
+        """Deduplication counters."""
+
+        return {'seen': self.seen, 'exact': self.exact, 'similar': self.similar,
+                'ratio': self.ratio(), 'indexed': len(self.index)}
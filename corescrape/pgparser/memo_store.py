@@ -0,0 +1,182 @@
+"""
+Memo Store
+
+Persistent memoization of parsed results across runs. Results are stored in a
+SQLite file keyed by the URL and the fingerprint of the parser, together with the
+ETag and the hash of the body they were parsed from. The parser fingerprint is
+built from its configuration (xpaths, regex, filters), so changing the parser
+invalidates its entries.
+
+On a new run the thread controller sends the stored ETag in 'If-None-Match'. When
+the server answers 304, or when the body has the same hash as before, the memoized
+result is emitted and the page is not parsed again.
+
+The store is bounded by the total size of the serialized results; the least
+recently used entries are evicted first. Writes are committed in batches of
+'commitevery' and on 'flush' or 'close', so a crash loses at most the last batch.
+"""
+
+import json
+import sqlite3
+from hashlib import blake2b
+from threading import Lock
+from time import time
+
+from ..core import CoreScrape
+from ..sink.result_sink import plain
+
+# pylint: disable=invalid-name, too-many-arguments
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memo (
+    url TEXT NOT NULL,
+    parser TEXT NOT NULL,
+    etag TEXT,
+    hash TEXT NOT NULL,
+    result TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (url, parser)
+);
+CREATE INDEX IF NOT EXISTS memo_used ON memo (used);
+"""
+
+
+def content_hash(content):
+    """Hash of a body."""
+
+    return blake2b(content or b'', digest_size=16).hexdigest()
+
+
+class MemoStore(CoreScrape):
+    """
+    SQLite backed memo of parse results.
+
+    Params:
+        path: str path of the SQLite file. Use ':memory:' for a store that lives
+            only during the process.
+        maxbytes: int maximum total size in bytes of the serialized results
+        commitevery: int number of writes (results stored or entries used) between
+            two commits
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, path, maxbytes=512 * 1024 ** 2, commitevery=100,
+                 logoperator=None):
+        """Constructor."""
+
+        self.path = path
+        self.maxbytes = maxbytes
+        self.commitevery = max(1, commitevery)
+        self.pending = 0  # writes not committed yet
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.size = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM memo').fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+
+        super().__init__(logoperator=logoperator)
+
+    def validators(self, url, parserfp):
+        """Conditional request headers for the URL, if an ETag is stored."""
+
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT etag FROM memo WHERE url = ? AND parser = ?',
+                (url, parserfp)).fetchone()
+        if row is None or not row[0]:
+            return None
+        return {'If-None-Match': row[0]}
+
+    def get(self, url, parserfp, bodyhash=None):
+        """
+        Memoized result for the URL and parser.
+
+        Params:
+            bodyhash: str or None. If informed, the result is returned only if it was
+                parsed from a body with this hash.
+
+        Returns:
+            found: bool
+            result: the memoized result or None
+        """
+
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT hash, result FROM memo WHERE url = ? AND parser = ?',
+                (url, parserfp)).fetchone()
+            if row is None or (bodyhash is not None and row[0] != bodyhash):
+                self.misses += 1
+                return False, None
+
+            self.hits += 1
+            self.conn.execute(
+                'UPDATE memo SET used = ? WHERE url = ? AND parser = ?',
+                (time(), url, parserfp))
+            self.__written()
+        return True, json.loads(row[1])
+
+    def put(self, url, parserfp, bodyhash, result, etag=None):
+        """Memoizes a result."""
+
+        data = json.dumps(plain(result), ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+
+        with self.lock:
+            old = self.conn.execute(
+                'SELECT size FROM memo WHERE url = ? AND parser = ?',
+                (url, parserfp)).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, parserfp, etag, bodyhash, data, size, time()))
+            self.size += size - (old[0] if old else 0)
+            self.__evict()
+            self.__written()
+
+    def __written(self):
+        """Counts a write and commits a full batch. Caller must hold the lock."""
+
+        self.pending += 1
+        if self.pending >= self.commitevery:
+            self.conn.commit()
+            self.pending = 0
+
+    def flush(self):
+        """Commits the pending writes."""
+
+        with self.lock:
+            if self.pending:
+                self.conn.commit()
+                self.pending = 0
+
+    def __evict(self):
+        """Drops least recently used entries. Caller must hold the lock."""
+
+        while self.size > self.maxbytes:
+            rows = self.conn.execute(
+                'SELECT url, parser, size FROM memo ORDER BY used LIMIT 100'
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                return
+            for url, parserfp, size in rows:
+                self.conn.execute('DELETE FROM memo WHERE url = ? AND parser = ?',
+                                  (url, parserfp))
+                self.size -= size
+                if self.size <= self.maxbytes:
+                    return
+
+    def stats(self):
+        """Memo counters."""
+
+        return {'hits': self.hits, 'misses': self.misses, 'bytes': self.size}
+
+    def close(self):
+        """Closes the store."""
+
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
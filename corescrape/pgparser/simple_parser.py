@@ -3,15 +3,49 @@ Simple Parser
 
 Do parsing in a requests.model.Response to retrieve information based on informed
 xpath.
+
+The page is parsed straight from the raw bytes (`response.content`) by an
+incremental parser, so no decoded copy of the whole body is ever built. The bytes
+are fed in chunks and the parser can stop early once the requested nodes are found:
+either when the end of a given tag is reached (e.g. 'head') or when enough matches
+were collected.
+
+When crawling, the parser may also emit the links to be followed, taken from the
+same tree (see 'parse_and_follow'), so pages are never parsed twice.
 """
 
+import codecs
 import re
+from hashlib import blake2b
+from urllib.parse import urljoin, urldefrag
+
+from lxml import etree, html
 
-from lxml import html
+from ..core import CoreScrape
 
-from core import CoreScrape
+# pylint: disable=invalid-name, multiple-statements, too-many-arguments
+
+CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+PREDICATE = re.compile(r'\[[^\[\]]*\]')
+NAME = re.compile(r'^[A-Za-z_][\w.-]*$')
+
+def last_tag(xpath):
+    """
+    Tag of the elements whose end may bring new matches of the xpath, i.e. its last
+    element step, or None if it can not be told (unions, wildcards, functions).
+    """
 
-# pylint: disable=invalid-name, multiple-statements
+    if xpath is None or '|' in xpath:
+        return None
+    path = xpath
+    while PREDICATE.search(path):
+        path = PREDICATE.sub('', path)
+    for step in reversed([step for step in path.split('/') if step]):
+        if step.startswith('@') or step.endswith(')') or step == '.':
+            continue  # attributes, text() and the like belong to the element
+        step = step.rpartition('::')[2]
+        return step.lower() if NAME.match(step) else None
+    return None
 
 class SimpleParser(CoreScrape):
     """
@@ -24,41 +58,224 @@ class SimpleParser(CoreScrape):
         regex: str regex to be applied. Only catches info if search returs True based
             on this regex.
         rgflags: enum 'RegexFlag' from re. Pass multiple flags using bitwise (|)
+        logoperator: corescraper.logs.log_operator.LogOperator - Log object or None
+            to manage logging messages. Default None
+        encoding: str or None. Encoding of the pages. If None, the charset in the
+            header 'Content-Type' is used and, if absent, the parser detects it from
+            the page itself (BOM or meta tags).
+        stoptag: str or None. Stops parsing once the end of this tag is found. Use
+            'head' if all information needed lies in the page header.
+        maxmatches: int or None. Stops parsing once the xpath has collected at least
+            this number of matches. Results are truncated to this number.
+        chunksize: int. Number of bytes fed to the parser at a time. Early stops are
+            checked between chunks.
+        prefix: int or None. Declares that only the first 'prefix' bytes of a page
+            are needed (e.g. along with 'stoptag' 'head'). A
+            corescrape.proxy.fetch_profile.FetchProfile built with this parser
+            downloads just that byte range.
+        follow: str or None. Xpath selecting the links to be followed when crawling,
+            e.g. '//a/@href'. It may select attributes or elements with 'href'.
+            Relative links are resolved against the URL of the page. Only the part
+            of the page parsed before an early stop is searched.
     """
 
-    def __init__(self, xpath, regex=None, rgflags=0, logoperator=None):
+    def __init__(self, xpath, regex=None, rgflags=0, logoperator=None,
+                 encoding=None, stoptag=None, maxmatches=None, chunksize=16384,
+                 prefix=None, follow=None):
         """Constructor."""
 
+        if maxmatches is not None and (not isinstance(maxmatches, int) or
+                                       maxmatches < 1):
+            raise ValueError("Param 'maxmatches' must be a positive 'int' or None")
+        if prefix is not None and (not isinstance(prefix, int) or prefix < 1):
+            raise ValueError("Param 'prefix' must be a positive 'int' or None")
+
         self.xpath = xpath
         self.regex = regex
         self.rgfgs = rgflags
         self.brg = bool(regex)
+        self.rg = re.compile(regex, rgflags) if self.brg else None
+
+        self.encoding = encoding
+        self.stoptag = stoptag
+        self.maxmatches = maxmatches
+        self.chunksize = chunksize
+        self.prefix = prefix
+        self.follow = follow
 
         super().__init__(logoperator=logoperator)
 
+    def config(self):
+        """Configuration that defines the output of this parser."""
+
+        config = [type(self).__name__, self.xpath, self.regex, int(self.rgfgs),
+                  self.stoptag, self.maxmatches, self.encoding]
+        if self.prefix is not None:
+            config.append(self.prefix)  # pages are truncated
+        return config
+
+    def fingerprint(self):
+        """Hash of the configuration. Changes whenever the output could change."""
+
+        return blake2b(repr(self.config()).encode('utf-8'),
+                       digest_size=16).hexdigest()
+
     def apply_bool_rg(self, h):
         """Internal controller to apply regex."""
 
         if self.brg:
-            return re.search(self.regex, h, self.rgfgs) is not None
+            return self.rg.search(h) is not None
         return True
 
     def valid_response(self, response, threadid=None):
         """Test if response is valid."""
 
-        if response is None or not response.text:
+        if response is None or not response.content:
             self.log('Parser got invalid response [Thread {}]'.format(threadid))
             return False
         return True
 
-    def parse(self, response, threadid=None):
-        """From a requests.model.Response, applies the xpath and retrieves data."""
+    def page_encoding(self, response):
+        """Returns the encoding to be used to parse the response or None."""
 
-        if not self.valid_response(response, threadid): return []
+        if self.encoding:
+            return self.encoding
+
+        headers = getattr(response, 'headers', None) or {}
+        found = CHARSET.search(headers.get('Content-Type', ''))
+        if found is None:
+            return None
+        try:
+            codecs.lookup(found.group(1))
+        except LookupError:
+            return None  # unknown charset, lxml detects the encoding
+        return found.group(1)
+
+    def watched_tags(self):
+        """
+        Set of tags whose end may satisfy 'enough' or None for any tag. Parsers
+        overriding 'enough' should override this method as well.
+        """
+
+        tag = last_tag(self.xpath)
+        return {tag} if tag is not None else None
+
+    def enough(self, root):
+        """
+        Test if the partial tree already holds what is needed.
+
+        Parsers with different stop criteria should override this method.
+        """
+
+        if self.maxmatches is None:
+            return False
+        return len(self.filter(root.xpath(self.xpath))) >= self.maxmatches
+
+    def tree(self, response, threadid=None):
+        """
+        Incrementally parses the raw bytes of the response into a tree.
 
-        hs = html.fromstring(response.text).xpath(self.xpath)
+        Returns the root element or None if nothing could be parsed.
+        """
+
+        try:
+            parser = etree.HTMLPullParser(events=('end',),
+                                          encoding=self.page_encoding(response))
+        except LookupError:  # known to Python but not to libxml2
+            parser = etree.HTMLPullParser(events=('end',))
+        parser.set_element_class_lookup(html.HtmlElementClassLookup())
+
+        # 'enough' evaluates the whole partial tree, so it runs only once a
+        # watched tag ended and the page fed doubled since the last run. Its
+        # total cost stays linear in the page size.
+        watched = self.watched_tags() if self.maxmatches is not None else set()
+        content = response.content
+        fed = 0
+        checked = 0
+        pending = False
+        element = None
+        while fed < len(content):
+            parser.feed(content[fed:fed + self.chunksize])
+            fed += self.chunksize
+
+            stop = False
+            for _, element in parser.read_events():
+                if self.stoptag is not None and element.tag == self.stoptag:
+                    stop = True
+                if watched is None or element.tag in watched:
+                    pending = True
+            if not stop and pending and fed >= 2 * checked:
+                pending = False
+                checked = fed
+                stop = self.enough(element.getroottree().getroot())
+            if stop:
+                self.log('Stopped parsing at {} of {} bytes [Thread {}]'.format(
+                    min(fed, len(content)), len(content), threadid))
+                break
+
+        try:
+            return parser.close()
+        except etree.XMLSyntaxError:
+            return None
+
+    def filter(self, hs):
+        """Applies the regex to the collected info."""
+
+        if not self.brg:
+            return hs
+        return [h for h in hs if self.apply_bool_rg(h)]
+
+    def extract(self, root, threadid=None):
+        """Applies the xpath and the regex to an already parsed tree."""
+
+        hs = root.xpath(self.xpath)
         self.log('Collected {} from page using xpath {} [Thread {}]'.format(
             len(hs), self.xpath, threadid))
-        hs = [h for h in hs if self.apply_bool_rg(h)]
+        hs = self.filter(hs)
         self.log('After regex, {} remaining [Thread {}]'.format(len(hs), threadid))
-        return hs
+        return hs[:self.maxmatches] if self.maxmatches else hs
+
+    def links(self, root, baseurl, threadid=None):
+        """Absolute http(s) URLs selected by 'follow' in an already parsed tree."""
+
+        if self.follow is None:
+            return []
+
+        found = []
+        for h in root.xpath(self.follow):
+            href = h.get('href') if hasattr(h, 'get') else h
+            if not href: continue
+            url = urldefrag(urljoin(baseurl, str(href).strip()))[0]
+            if url.startswith('http://') or url.startswith('https://'):
+                found.append(url)
+        found = list(dict.fromkeys(found))
+        self.log('Found {} links to follow [Thread {}]'.format(len(found), threadid))
+        return found
+
+    def parse_and_follow(self, response, threadid=None):
+        """
+        Parses the response as 'parse' does and also collects the links to be
+        followed from the same tree.
+
+        Returns:
+            res: parsed result, as in 'parse'
+            links: list of str absolute URLs
+        """
+
+        if not self.valid_response(response, threadid): return [], []
+
+        root = self.tree(response, threadid)
+        if root is None: return [], []
+
+        return (self.extract(root, threadid),
+                self.links(root, response.url, threadid))
+
+    def parse(self, response, threadid=None):
+        """From a requests.model.Response, applies the xpath and retrieves data."""
+
+        if not self.valid_response(response, threadid): return []
+
+        root = self.tree(response, threadid)
+        if root is None: return []
+
+        return self.extract(root, threadid)
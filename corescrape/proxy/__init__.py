@@ -0,0 +1,12 @@
+"""Subpackage proxy."""
+
+from .. import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    'proxy',
+    'rotator',
+    'request_stats',
+    'circuit_breaker',
+    'domain_health',
+    'fetch_profile',
+])
@@ -0,0 +1,93 @@
+"""
+Circuit Breaker
+
+Per proxy circuit breaker. Instead of a proxy being either re-queued or dropped for
+good, each proxy carries a breaker with three states:
+
+* CLOSED: the proxy is healthy and serves requests. Consecutive failures are
+  counted and, once they reach 'threshold', the breaker opens. A ban page opens it
+  at once.
+* OPEN: the proxy is quarantined by the rotator for a cooldown that doubles each
+  time the breaker opens again. After 'maxopens' openings the proxy is dropped.
+* HALF_OPEN: the cooldown is over and the proxy is on probation. It is either
+  probed by the rotator or trusted with a single request. A success closes the
+  breaker, a failure opens it again.
+"""
+
+# pylint: disable=invalid-name, too-many-arguments
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a single proxy.
+
+    Params:
+        threshold: int consecutive failures needed to open the breaker
+        cooldown: int or float seconds of the first quarantine
+        maxcooldown: int or float maximum seconds of a quarantine
+        maxopens: int or None. Number of openings after which the proxy is
+            dropped. None means never.
+    """
+
+    def __init__(self, threshold=3, cooldown=60, maxcooldown=1800, maxopens=5):
+        """Constructor."""
+
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.maxcooldown = maxcooldown
+        self.maxopens = maxopens
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+
+    def success(self):
+        """Registers a success. Closes the breaker."""
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+
+    def failure(self):
+        """
+        Registers a failure.
+
+        Returns:
+            bool: True if the breaker is now open
+        """
+
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.trip()
+        return self.state == OPEN
+
+    def trip(self):
+        """Opens the breaker at once."""
+
+        self.state = OPEN
+        self.failures = 0
+        self.opens += 1
+
+    def probation(self):
+        """Cooldown is over. Half-opens the breaker."""
+
+        self.state = HALF_OPEN
+
+    def exhausted(self):
+        """Tells if the proxy opened too many times and must be dropped."""
+
+        return self.maxopens is not None and self.opens > self.maxopens
+
+    def quarantine_time(self):
+        """Seconds the proxy must stay in quarantine after the last opening."""
+
+        return min(self.maxcooldown, self.cooldown * 2 ** max(self.opens - 1, 0))
+
+    def is_open(self):
+        """Tells if the breaker is open."""
+
+        return self.state == OPEN
@@ -0,0 +1,100 @@
+"""
+Domain Health
+
+Health of each proxy per target domain. A proxy banned by one site (403 or a ban
+message) usually works fine for others, so bans are remembered per (domain, proxy)
+pair instead of changing the global priority of the proxy.
+
+The index is compact: for each domain only the proxies that had some trouble with
+it are stored, each one as a small list [penalty, strikes, banned until, bans].
+"""
+
+from threading import Lock
+from time import time
+
+# pylint: disable=invalid-name, too-many-arguments
+
+PENALTY, STRIKES, UNTIL, BANS = range(4)
+
+
+class DomainHealth:
+    """
+    Per (domain, proxy) health index.
+
+    Params:
+        threshold: int consecutive 403s that ban a proxy for a domain
+        cooldown: int or float seconds of the first ban. Doubles on each new ban of
+            the same pair.
+        maxcooldown: int or float maximum seconds of a ban
+        penalty: int penalty added to the pair on each 403
+    """
+
+    def __init__(self, threshold=3, cooldown=600, maxcooldown=21600, penalty=10):
+        """Constructor."""
+
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.maxcooldown = maxcooldown
+        self.penalty = penalty
+
+        self.index = {}  # domain -> {address: [penalty, strikes, until, bans]}
+        self.lock = Lock()
+
+    def __entry(self, domain, address):
+        """Returns the entry of the pair, creating it if needed."""
+
+        return self.index.setdefault(domain, {}).setdefault(address, [0, 0, 0., 0])
+
+    def banned(self, domain, address):
+        """Tells if the proxy is banned for the domain."""
+
+        entry = self.index.get(domain, {}).get(address)
+        return entry is not None and entry[UNTIL] > time()
+
+    def score(self, domain, address):
+        """Penalty of the proxy for the domain. The lower the better."""
+
+        entry = self.index.get(domain, {}).get(address)
+        return entry[PENALTY] if entry is not None else 0
+
+    def ban(self, domain, address):
+        """Bans the proxy for the domain."""
+
+        with self.lock:
+            entry = self.__entry(domain, address)
+            entry[BANS] += 1
+            entry[STRIKES] = 0
+            entry[UNTIL] = time() + min(self.maxcooldown,
+                                        self.cooldown * 2 ** (entry[BANS] - 1))
+            return entry[UNTIL]
+
+    def forbidden(self, domain, address):
+        """
+        Registers a 403 for the pair.
+
+        Returns:
+            bool: True if the proxy got banned for the domain
+        """
+
+        with self.lock:
+            entry = self.__entry(domain, address)
+            entry[PENALTY] += self.penalty
+            entry[STRIKES] += 1
+            strikes = entry[STRIKES]
+
+        if strikes >= self.threshold:
+            self.ban(domain, address)
+            return True
+        return False
+
+    def success(self, domain, address):
+        """Registers a success for the pair."""
+
+        with self.lock:
+            entry = self.index.get(domain, {}).get(address)
+            if entry is None:
+                return
+            entry[STRIKES] = 0
+            entry[PENALTY] = max(0, entry[PENALTY] - 1)
+            if not entry[PENALTY] and entry[UNTIL] <= time():
+                del self.index[domain][address]  # healthy again, keep it compact
@@ -0,0 +1,90 @@
+"""
+Fetch Profile
+
+Opt-in rules that reduce the bytes downloaded through the proxies, which are usually
+metered.
+
+* Compression: requests already advertises every encoding it can decode (gzip and
+  deflate, plus br and zstd when 'brotli' and 'zstandard' are installed). The
+  profile keeps it that way, except for prefix reads.
+* HEAD precheck: a HEAD request is sent first and resources that are not HTML or
+  that are larger than 'maxbytes' are not downloaded. The answer of the HEAD
+  request (with an empty body) stands for the page.
+* Prefix reads: when the parser only needs the beginning of the document (see
+  'prefix' in corescrape.pgparser.simple_parser.SimpleParser), only that byte range
+  is requested. Servers that support it answer '206 Partial Content'; for the
+  others, the download is interrupted once the prefix is read. Prefix reads ask for
+  the identity encoding, since a range of a compressed body cannot be decoded alone.
+"""
+
+import re
+
+# pylint: disable=invalid-name, too-many-arguments
+
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+MIMETYPE = re.compile(r'^\s*([\w.+-]+/[\w.+-]+)')
+
+
+class FetchProfile:
+    """
+    Bandwidth reducing fetch profile.
+
+    Params:
+        precheck: bool. Sends a HEAD request before each GET.
+        types: tuple of str. Content types accepted by the precheck. A response
+            without 'Content-Type' is accepted.
+        maxbytes: int or None. Maximum size of a page. Larger pages are skipped by
+            the precheck, or truncated when their size is not announced.
+        prefix: int or None. Number of leading bytes to be downloaded. If None, the
+            prefix declared by the parser, if any, is used.
+        parser: parser or None. Parser whose 'prefix' is used.
+    """
+
+    def __init__(self, precheck=False, types=HTML_TYPES, maxbytes=None, prefix=None,
+                 parser=None):
+        """Constructor."""
+
+        if prefix is None and parser is not None:
+            prefix = getattr(parser, 'prefix', None)
+
+        self.precheck = precheck
+        self.types = tuple(types)
+        self.maxbytes = maxbytes
+        self.prefix = prefix
+
+    def headers(self):
+        """Request headers of the profile."""
+
+        if self.prefix is None:
+            return {}
+        return {'Range': 'bytes=0-{}'.format(self.prefix - 1),
+                'Accept-Encoding': 'identity'}
+
+    def limit(self):
+        """Maximum number of bytes read from a body or None."""
+
+        if self.prefix is not None and self.maxbytes is not None:
+            return min(self.prefix, self.maxbytes)
+        return self.prefix if self.prefix is not None else self.maxbytes
+
+    def rejects(self, head):
+        """
+        Tells why the resource must not be downloaded, given its HEAD response.
+
+        Returns:
+            str reason or None if the resource must be downloaded
+        """
+
+        if not 200 <= head.status_code < 300:
+            return None  # e.g. HEAD not allowed. Let the GET decide.
+
+        found = MIMETYPE.match(head.headers.get('Content-Type', ''))
+        if found and found.group(1).lower() not in self.types:
+            return 'type {}'.format(found.group(1))
+
+        length = head.headers.get('Content-Length')
+        if self.maxbytes is not None and length is not None and \
+           length.isdigit() and int(length) > self.maxbytes:
+            return 'length {}'.format(length)
+
+        return None
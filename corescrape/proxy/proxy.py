@@ -7,12 +7,18 @@ IMPORTANT:
 
 # pylint: disable=invalid-name, too-many-instance-attributes
 
-from core.exceptions import CoreScrapeInvalidProxy
+from ..core.exceptions import CoreScrapeInvalidProxy
 
 class Proxy:
-    """Defines a proxy and its useful methods"""
+    """
+    Defines a proxy and its useful methods
 
-    def __init__(self, address):
+    Params:
+        address: str in IP:PORT format
+        breaker: corescrape.proxy.circuit_breaker.CircuitBreaker or None
+    """
+
+    def __init__(self, address, breaker=None):
         """Constructor."""
 
         self.ready = False  # should always be the first
@@ -29,6 +35,8 @@ class Proxy:
         # instead be a 'down_priority' to avoid reusing too much the same proxy.
         self.max_on_a_row = 3
         self.on_a_row = 0  # number of hits on a row
+        self.latency = None  # seconds taken by the last answered request
+        self.breaker = breaker
 
         self.ready = True  # should always be the last
 
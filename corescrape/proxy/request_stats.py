@@ -0,0 +1,100 @@
+"""
+Request Stats
+
+Thread safe counters of the outcomes of the requests made by the rotator. They are
+read by controllers that need to react to the health of the proxy pool and of the
+target, such as the adaptive concurrency controller.
+"""
+
+from collections import deque
+from threading import Lock
+
+# pylint: disable=invalid-name
+
+# Outcomes of a single attempt (one URL through one proxy)
+SUCCESS = 'success'
+FORBIDDEN = 'forbidden'  # 403
+BANNED = 'banned'  # ban message found in the page
+PROXYFAIL = 'proxyfail'  # proxy error, timeout or too many redirects
+CONNFAIL = 'connfail'  # SSL, invalid header, connection or chunked encoding errors
+
+OUTCOMES = [SUCCESS, FORBIDDEN, BANNED, PROXYFAIL, CONNFAIL]
+ERRORS = [FORBIDDEN, BANNED, PROXYFAIL, CONNFAIL]
+
+# Faults of a failed URL: failures another proxy would likely avoid point the
+# proxy, failures that follow the URL from proxy to proxy point the target
+PROXY_FAULT = 'proxy'
+TARGET_FAULT = 'target'
+PROXY_ERRORS = [FORBIDDEN, PROXYFAIL]
+TARGET_ERRORS = [BANNED, CONNFAIL]
+
+
+def classify(outcomes):
+    """Fault of a list of failed outcomes: the most frequent kind, target on ties."""
+
+    proxy = sum(outcome in PROXY_ERRORS for outcome in outcomes)
+    return PROXY_FAULT if proxy > len(outcomes) - proxy else TARGET_FAULT
+
+
+class RequestStats:
+    """
+    Counters of attempts by outcome and the latency of successful ones.
+
+    Params:
+        window: int number of recent latencies kept to compute percentiles
+    """
+
+    def __init__(self, window=500):
+        """Constructor."""
+
+        self.lock = Lock()
+        self.counts = {outcome: 0 for outcome in OUTCOMES}
+        self.latency = 0.  # sum of the latencies of successful attempts
+        self.recent = deque(maxlen=window)
+        self.extra = 0  # additional attempts fired by hedging
+        self.slow = 0  # attempts cancelled because a hedged one answered first
+
+    def add(self, outcome, latency=None):
+        """Counts an attempt."""
+
+        with self.lock:
+            self.counts[outcome] += 1
+            if latency is not None:
+                self.latency += latency
+                self.recent.append(latency)
+
+    def add_extra(self):
+        """Counts an additional attempt fired by hedging."""
+
+        with self.lock:
+            self.extra += 1
+
+    def add_slow(self):
+        """Counts an attempt cancelled because a hedged one answered first."""
+
+        with self.lock:
+            self.slow += 1
+
+    def percentile(self, p, minsamples=20):
+        """
+        Percentile (0 to 100) of the recent latencies or None if there are less
+        than 'minsamples' samples.
+        """
+
+        with self.lock:
+            recent = sorted(self.recent)
+        if len(recent) < minsamples:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * p / 100.))]
+
+    def snapshot(self):
+        """Returns a copy of the counters."""
+
+        with self.lock:
+            snap = dict(self.counts)
+            snap['latency'] = self.latency
+            snap['extra'] = self.extra
+            snap['slow'] = self.slow
+        snap['attempts'] = sum(snap[outcome] for outcome in OUTCOMES)
+        snap['errors'] = sum(snap[outcome] for outcome in ERRORS)
+        return snap
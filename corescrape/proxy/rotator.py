@@ -22,7 +22,15 @@ a 404 code, others will return a HTML page with messages informing the deny.
 The list of 'reserved messages' should be stored in the file `ignoremsgs.txt`.
 This file is critical and must be present with each line containing a message that,
 if present in the HTML page, tells the rotator to dispose that proxy and carry on.
-More sophisticated pages may return a captcha.
+More sophisticated pages may return a captcha. A line may start with '@domain ' to
+restrict the message to that domain and its subdomains, e.g.
+`@example.com Access denied`. Status, header, size and regex rules can also be set
+in `banrules.txt`. Rules are compiled once and reloaded when the files change, see
+`corescrape.rules.rule_engine`.
+
+If enabled ('domain_conf'), bans (403 and ban messages) are remembered per proxy
+and target domain, so a proxy banned by one site keeps serving the others. Proxies
+are then picked per request domain, skipping those banned for it.
 
 Single proxy API can also be used by configuring the file `apisingleproxy.txt`.
 This type of API returns a single ip when requested, usually in JSON format. Along
@@ -37,6 +45,13 @@ a valid proxy, it will be added to the list. Please note that you must inform if
 content is plain text or json and also provide a function to successfully parse the
 proxy from the response.
 
+Proxies that keep failing, get a 403 too often or hit a ban page are not lost for
+good: each proxy carries a circuit breaker (see `circuit_breaker`). When it opens,
+the proxy goes to a timed quarantine and, once the time is over, it is put on
+probation. If a probe URL is informed, the proxy must answer it, probed in
+background, before going back to the pool; otherwise its next request is the
+probation.
+
 All files must be located in the `conf/` dir.
 
 IMPORTANT:
@@ -45,28 +60,82 @@ IMPORTANT:
 
 # pylint: disable=invalid-name, multiple-statements, too-many-arguments
 
-from os.path import dirname, abspath
 from random import choice, shuffle
-from queue import PriorityQueue
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from queue import PriorityQueue, Queue, Empty
 from warnings import warn
-from time import sleep
+from time import sleep, time, perf_counter
+from threading import Condition, Lock, Thread, local
+from http.cookiejar import DefaultCookiePolicy
+from itertools import count
+import heapq
 import json
 
 import requests
 
 from . import proxy as proxlib
-from core import CoreScrape
-from core.exceptions import CoreScrapeInvalidProxy
-from threads.corescrape_event import CoreScrapeEvent
+from . import request_stats as rstats
+from . import circuit_breaker as cb
+from . import domain_health as dh
+from ..core import CoreScrape
+from ..core.exceptions import CoreScrapeInvalidProxy, CoreScrapeUrlFailed
+from ..core.exceptions import CoreScrapeCancelled
+from ..rules.rule_engine import RuleEngine, confpattern
+from ..threads.corescrape_event import CoreScrapeEvent
+from ..logs.tracer import NOOP
 
 # pylint: disable=too-many-instance-attributes, too-many-branches
 
+# seconds between checks of an empty pool
+POOL_WAIT_STEP = 0.2
+# bytes read at a time from a body, between checks of the event
+READ_CHUNK = 16384
+
 def strip(l):
     """Strip strings from a list."""
 
     return list(map(lambda x: x.strip(), l))
 
 
+class ProxyPool(PriorityQueue):
+    """Priority queue of proxies that can also hand out a proxy picked by rules."""
+
+    def take(self, accept, key, candidates):
+        """
+        Removes and returns, among the first 'candidates' proxies accepted, the one
+        with the lowest key, or None if no proxy is accepted. Proxies are visited in
+        the order of the heap, without being taken out of the queue, so other
+        threads never find it emptied by the scan and only the proxies rejected
+        and the candidates are visited.
+
+        Params:
+            accept: callable telling if a proxy may be returned
+            key: callable giving the rank of a proxy. The lower the better.
+            candidates: int number of accepted proxies compared
+        """
+
+        with self.mutex:
+            found = []
+            for i, p in enumerate(self.queue):
+                if accept(p):
+                    found.append(i)
+                    if len(found) >= candidates: break
+            if not found:
+                return None
+
+            i = min(found, key=lambda i: key(self.queue[i]))
+            best = self.queue[i]
+            last = self.queue.pop()
+            if i < len(self.queue):
+                # pylint: disable=protected-access
+                self.queue[i] = last
+                heapq._siftup(self.queue, i)
+                heapq._siftdown(self.queue, 0, i)
+            self.not_full.notify()
+            return best
+
+
 class Rotator(CoreScrape):
     """
     This class implements a proxy rotation service for requests.
@@ -94,17 +163,67 @@ class Rotator(CoreScrape):
         importdyn: set containing strings of proxies to be imported in this rotator.
             Proxy string must respect the IP:PORT format. If the passed param is not
             a set, it will be ignored.
+        hedge: int, float or None. Percentile (0 to 100) of the recent latencies
+            after which a request still unanswered is hedged: a second attempt is
+            fired through a different proxy and the first good response wins. None
+            disables hedging.
+        hedgeratio: float. Maximum ratio of hedged attempts over all attempts, to
+            cap the extra load.
+        hedgeworkers: int. Number of workers available to run hedged attempts. When
+            hedging, the first attempt of a request runs in a thread of its own.
+        breaker_conf: dict or None. Params of the circuit breaker of each proxy
+            ('threshold', 'cooldown', 'maxcooldown' and 'maxopens'). See
+            corescrape.proxy.circuit_breaker.CircuitBreaker.
+        probeurl: str or None. Cheap URL requested through a quarantined proxy
+            before it goes back to the pool.
+        domain_conf: dict or None. Params of the per domain health index
+            ('threshold', 'cooldown', 'maxcooldown' and 'penalty'), e.g. {} for the
+            defaults. See corescrape.proxy.domain_health.DomainHealth. If None, bans
+            are global and handled by the circuit breaker of each proxy.
+        candidates: int. Number of proxies not banned for the domain compared to
+            pick the one with the best priority for it. Only used with
+            'domain_conf'.
+        rules: corescrape.rules.rule_engine.RuleEngine or None. Ban detection rules.
+            If None, they are loaded from 'confpath'.
+        archive: corescrape.archive.page_archive.PageArchive or None. If informed,
+            every answered page is archived with its outcome, for offline replay.
+        sessions: bool. If True, each thread keeps a requests.Session, so the
+            connections to the proxies are reused between requests. Cookies are
+            never stored, to avoid linking requests made through different proxies.
+        lowwatermark: int or None. When the number of proxies available in the pool
+            falls below it, new proxies are collected from the APIs in background
+            (see 'retrieve'). Proxies already known by the rotator are not queued
+            again. None disables the replenishment.
+        refill_conf: dict or None. Params of 'retrieve' used by the replenishment
+            ('sep', 'parse_func', 'timeout', 'retry' and 'waitbtwn').
+        refillinterval: int or float. Minimum seconds between two replenishments.
+        poolwait: int or float. Seconds a request waits for a proxy when the pool is
+            empty, before giving up with OUT_OF_PROXIES.
+        tracer: corescrape.logs.tracer.Tracer or None. If informed, the stages of
+            each request sampled are traced.
+        urlbudget: int or None. Maximum number of failed attempts of a single
+            request. Once it is exhausted, 'request' raises
+            corescrape.core.exceptions.CoreScrapeUrlFailed with the outcomes of the
+            attempts and their fault (see corescrape.proxy.request_stats.classify),
+            so a broken URL does not churn through the whole pool. None tries until
+            the page is collected or the pool is empty.
+        profile: corescrape.proxy.fetch_profile.FetchProfile or None. Opt-in rules
+            to spend less bandwidth: HEAD prechecks that skip non HTML or oversized
+            resources and prefix reads. Skipped resources are returned as the HEAD
+            response, with the reason in its attribute 'skipped'. Pages read
+            partially may have status 206.
     """
 
     def __init__(self, confpath=None, maxtriesproxy=2, timeout=3, logoperator=None,
-                 dynamic_proxy_conf=None, importdyn=None):
+                 dynamic_proxy_conf=None, importdyn=None, hedge=None,
+                 hedgeratio=0.1, hedgeworkers=64, breaker_conf=None, probeurl=None,
+                 domain_conf=None, candidates=3, rules=None, archive=None,
+                 sessions=False, lowwatermark=None, refill_conf=None,
+                 refillinterval=60, poolwait=10, tracer=None, urlbudget=None,
+                 profile=None):
         """Constructor."""
 
-        if confpath is None:
-            conf = abspath(dirname(__file__) + '/..') + '/conf/{}.txt'
-        else:
-            conf = abspath(confpath)
-            conf += '{}.txt' if conf.endswith('/') else '/{}.txt'
+        conf = confpattern(confpath)
 
         with open(conf.format('apilist'), 'r') as _file:
             self.apilist = strip(_file.readlines())
@@ -115,8 +234,9 @@ class Rotator(CoreScrape):
         except FileNotFoundError:
             self.usragnts = None
 
-        with open(conf.format('ignoremsgs'), 'r') as _file:
-            self.ignoremsgs = strip(_file.readlines())
+        self.rules = rules
+        if self.rules is None:
+            self.rules = RuleEngine(confpath, logoperator=logoperator)
 
         with open(conf.format('stdconf'), 'r') as _file:
             self.stdusrgnt = _file.read().strip()
@@ -143,10 +263,50 @@ class Rotator(CoreScrape):
                 self.dynamic_proxy_parse_func = dynamic_proxy_conf[
                     self.dynamic_proxy_key]
 
-        self.proxies = PriorityQueue()
+        self.proxies = ProxyPool()
         self.maxtriesproxy = maxtriesproxy
         self.timeout = timeout
         self.dynproxies = set()
+        self.stats = rstats.RequestStats()
+
+        if hedge is not None and not 0 < hedge < 100:
+            raise ValueError("Param 'hedge' must be between 0 and 100 or None")
+        self.hedge = hedge
+        self.hedgeratio = hedgeratio
+        self.executor = None
+        if self.hedge is not None:
+            self.executor = ThreadPoolExecutor(max_workers=hedgeworkers)
+        self.timers = []  # heap of [due time, seq, callback or None]
+        self.tseq = count()
+        self.tcond = Condition()
+        self.timer = None
+
+        self.breaker_conf = breaker_conf if breaker_conf is not None else {}
+        self.probeurl = probeurl
+        self.quarantine = []  # heap of (release time, seq, proxy)
+        self.qseq = count()
+        self.qlock = Lock()
+        self.probing = []  # proxies on probation waiting for their probe
+        self.prober = False
+
+        self.health = None
+        if isinstance(domain_conf, dict):
+            self.health = dh.DomainHealth(**domain_conf)
+        self.candidates = max(1, candidates)
+        self.archive = archive
+        self.sessions = local() if sessions else None
+
+        self.lowwatermark = lowwatermark
+        self.refill_conf = refill_conf if refill_conf is not None else {}
+        self.refillinterval = refillinterval
+        self.poolwait = poolwait
+        self.known = set()  # addresses of every proxy queued so far
+        self.refilling = False
+        self.lastrefill = None
+        self.rlock = Lock()
+        self.tracer = tracer
+        self.urlbudget = urlbudget
+        self.profile = profile
 
         if isinstance(importdyn, set):
             self.dynproxies = importdyn
@@ -163,6 +323,64 @@ class Rotator(CoreScrape):
         for proxy in self.dynproxies:
             self.__put_proxy(proxy)
 
+    def __get(self, url, event=None, method='GET', limit=None, **kwargs):
+        """
+        Request through the session of the current thread, if sessions are on.
+
+        If an event is informed, the body is read in chunks and the response is
+        registered in the event, so setting it tears the connection down. Raises
+        CoreScrapeCancelled if the event is set meanwhile. If a limit is informed,
+        the download stops once 'limit' bytes are read.
+        """
+
+        getter = requests.request
+        if self.sessions is not None:
+            session = getattr(self.sessions, 'session', None)
+            if session is None:
+                session = requests.Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                self.sessions.session = session
+            getter = session.request
+
+        if event is None and limit is None:
+            return getter(method, url, **kwargs)
+
+        page = getter(method, url, stream=True, **kwargs)
+        if event is not None:
+            event.register(page)
+        size = 0
+        try:
+            chunks = []
+            for chunk in page.iter_content(READ_CHUNK):
+                if event is not None and event.is_set(): break
+                chunks.append(chunk)
+                size += len(chunk)
+                if limit is not None and size >= limit: break
+        except Exception:  # pylint: disable=broad-except
+            # the connection shut down by the event may raise anything
+            if event is None or not event.is_set():
+                raise
+        finally:
+            if event is not None:
+                event.unregister(page)
+
+        if event is not None and event.is_set():
+            page.close()
+            raise CoreScrapeCancelled
+        content = b''.join(chunks)
+        if limit is not None and size >= limit:
+            page.close()  # the rest is not downloaded
+            content = content[:limit]
+        page._content = content  # pylint: disable=protected-access
+        return page
+
+    def __span(self, name, **args):
+        """Span of the tracer, if any."""
+
+        if self.tracer is None:
+            return NOOP
+        return self.tracer.span(name, **args)
+
     def __get_usr_agent(self):
         """Returns a random user agent."""
 
@@ -171,13 +389,172 @@ class Rotator(CoreScrape):
 
         return {'User-Agent': choice(self.usragnts)}
 
-    def __get_proxy(self):
-        """Returns a proxy from the priority list."""
+    def __quarantine(self, curproxy, threadid=None):
+        """Sends a proxy with an open breaker to quarantine or drops it."""
 
-        if self.proxies.empty():
-            return None
+        if curproxy.breaker.exhausted():
+            self.log('Dropping proxy {} [Thread {}]'.format(curproxy, threadid),
+                     tmsg='warning')
+            return
+
+        wait_time = curproxy.breaker.quarantine_time()
+        self.log('Quarantining proxy {} for {}s [Thread {}]'.format(
+            curproxy, wait_time, threadid), tmsg='warning')
+        with self.qlock:
+            heapq.heappush(self.quarantine,
+                           (time() + wait_time, next(self.qseq), curproxy))
+
+    def __fail(self, curproxy, threadid=None, ban=False):
+        """
+        Registers a failure of the proxy. Re-queues it while its breaker is
+        closed, otherwise quarantines it.
+        """
+
+        if ban:
+            curproxy.breaker.trip()
+        elif not curproxy.breaker.failure():
+            self.proxies.put(curproxy)
+            return
+        curproxy.numtries = 0
+        self.__quarantine(curproxy, threadid)
+
+    def __probe(self, curproxy):
+        """Tells if the proxy answers the probe URL without being banned."""
+
+        try:
+            page = self.__get(self.probeurl, headers=self.__get_usr_agent(),
+                              proxies=curproxy.requests_formatted(),
+                              timeout=self.timeout)
+        except Rotator.any_exception():
+            return False
+
+        return page.status_code < 400 and \
+            self.rules.banned(page, Rotator.domain(self.probeurl)) is None
+
+    def __release(self):
+        """Puts proxies whose quarantine is over on probation."""
+
+        now = time()
+        released = []
+        with self.qlock:
+            while self.quarantine and self.quarantine[0][0] <= now:
+                released.append(heapq.heappop(self.quarantine)[2])
+
+        for curproxy in released:
+            curproxy.breaker.probation()
+        if self.probeurl is None:
+            for curproxy in released:
+                self.proxies.put(curproxy)  # next request is the probation
+            return
+        if not released:
+            return
+
+        # probes run in background, not in the path of the requests
+        with self.qlock:
+            self.probing.extend(released)
+            if self.prober:
+                return
+            self.prober = True
+        Thread(target=self.__run_probes, daemon=True).start()
+
+    def __run_probes(self):
+        """Probes the proxies on probation until there are none left."""
+
+        while True:
+            with self.qlock:
+                if not self.probing:
+                    self.prober = False
+                    return
+                curproxy = self.probing.pop(0)
+
+            if self.__probe(curproxy):
+                self.log('Proxy {} passed probation'.format(curproxy))
+                curproxy.breaker.success()
+                self.proxies.put(curproxy)
+            else:
+                curproxy.breaker.trip()
+                self.__quarantine(curproxy)
+
+    @staticmethod
+    def domain(url):
+        """Host of the URL."""
+
+        return (urlsplit(url).hostname or '').lower()
+
+    def __check_watermark(self):
+        """Starts a background replenishment if the pool is running low."""
+
+        if self.lowwatermark is None or self.proxies.qsize() >= self.lowwatermark:
+            return
+
+        with self.rlock:
+            if self.refilling:
+                return
+            if self.lastrefill is not None and \
+               time() - self.lastrefill < self.refillinterval:
+                return
+            self.refilling = True
+
+        self.log('Pool has {} proxies, below the watermark of {}. Refilling'.format(
+            self.proxies.qsize(), self.lowwatermark), tmsg='warning')
+        Thread(target=self.__refill, daemon=True).start()
+
+    def __refill(self):
+        """Collects proxies from the APIs and queues the ones not known yet."""
+
+        queued = 0
+        try:
+            for proxy in self.__collect_proxies(**self.refill_conf):
+                if proxy not in self.known and self.__put_proxy(proxy) is not None:
+                    queued += 1
+            self.log('Refill queued {} new proxies'.format(queued), tmsg='info')
+        except Exception as err:  # pylint: disable=broad-except
+            self.log('Refill failed: {}'.format(err), tmsg='error')
+        finally:
+            with self.rlock:
+                self.refilling = False
+                self.lastrefill = time()
+
+    def __get_proxy(self, domain=None, event=None):
+        """
+        Returns a proxy for the domain. If there is none, waits up to 'poolwait'
+        seconds for one to be released, refilled or to come back from quarantine.
+        """
 
-        return self.proxies.get()
+        deadline = time() + self.poolwait
+        while True:
+            self.__check_watermark()
+            curproxy = self.__pick_proxy(domain)
+            if curproxy is not None or time() >= deadline:
+                return curproxy
+            if event is not None and event.is_set():
+                return None
+            if event is not None:
+                event.wait(POOL_WAIT_STEP)
+            else:
+                sleep(POOL_WAIT_STEP)
+
+    def __pick_proxy(self, domain=None):
+        """
+        Returns a proxy from the priority list. If the health per domain is on and
+        a domain is informed, proxies banned for it are skipped and, among the
+        first 'candidates' ones, the proxy with the best priority for the domain is
+        returned.
+        """
+
+        if self.quarantine:
+            self.__release()
+
+        if domain is None or self.health is None:
+            try:
+                return self.proxies.get_nowait()
+            except Empty:
+                return None
+
+        return self.proxies.take(
+            lambda p: not self.health.banned(domain, p.address),
+            lambda p: p.priority + self.health.score(domain, p.address),
+            self.candidates)
 
     @staticmethod
     def proxy_exceptions():
@@ -214,8 +591,10 @@ class Rotator(CoreScrape):
         """Safely insert a new proxy."""
 
         try:
-            p = proxlib.Proxy(proxy)
+            p = proxlib.Proxy(proxy,
+                              breaker=cb.CircuitBreaker(**self.breaker_conf))
             if p:
+                self.known.add(p.address)
                 self.proxies.put(p)
                 if dyn: self.dynproxies.add(proxy)
                 return p
@@ -247,6 +626,16 @@ class Rotator(CoreScrape):
             None
         """
 
+        proxies = self.__collect_proxies(sep, parse_func, timeout, retry, waitbtwn)
+
+        self.log('Queueing {} proxies'.format(len(proxies)))
+        for proxy in proxies:
+            self.__put_proxy(proxy)
+
+    def __collect_proxies(self, sep='\n', parse_func=None, timeout=30,
+                          retry=None, waitbtwn=30):
+        """Collects proxies from the APIs. See 'retrieve'."""
+
         if not self.apilist:
             raise TypeError(
                 'Api list invalid. Expected a file with each line being an URL')
@@ -283,12 +672,10 @@ class Rotator(CoreScrape):
         ignore = ['', ' ', ':', ' : ', ' :', ': ']
         proxies = list({x for x in proxies if x not in ignore})
         shuffle(proxies)
+        return proxies
 
-        self.log('Queueing {} proxies'.format(len(proxies)))
-        for proxy in proxies:
-            self.__put_proxy(proxy)
-
-    def __request(self, url, uagnt, curproxy, ignore_tries=False):
+    def __request(self, url, uagnt, curproxy, ignore_tries=False, outcomes=None,
+                  event=None, profile=None):
         """
         Make a single request using the informed user agent, proxy and url.
 
@@ -297,6 +684,11 @@ class Rotator(CoreScrape):
             uagnt: dict or None user agent
             curproxy: corescrape.proxlib.Proxy proxy
             ignore_tries: bool indicating the proxy try counting must be ignored
+            outcomes: list or None. Outcome of a failed request is appended to it.
+            event: CoreScrapeEvent or None. Cancels the request once set.
+            profile: corescrape.proxy.fetch_profile.FetchProfile or None. If its
+                precheck rejects the resource, the HEAD response is returned with
+                the reason in its attribute 'skipped'.
 
         Returns:
             page: requests.models.Response page collected
@@ -305,20 +697,58 @@ class Rotator(CoreScrape):
 
         page = None
         _continue = False
+        outcome = None
+        start = time()
         try:
-            page = requests.get(url, headers=uagnt,
-                                proxies=curproxy.requests_formatted(),
-                                timeout=self.timeout)
+            with self.__span('fetch', proxy=curproxy.address):
+                if profile is not None and profile.precheck:
+                    with self.__span('precheck'):
+                        page = self.__get(url, event, method='HEAD', headers=uagnt,
+                                          proxies=curproxy.requests_formatted(),
+                                          timeout=self.timeout)
+                    page.skipped = profile.rejects(page)
+                if page is None or page.skipped is None:
+                    page = self.__get(url, event, headers=uagnt,
+                                      proxies=curproxy.requests_formatted(),
+                                      timeout=self.timeout,
+                                      limit=profile.limit() if profile else None)
+                curproxy.latency = time() - start
+                if self.tracer is not None:
+                    # 'elapsed' goes from sending the request to parsing headers
+                    began = perf_counter() - curproxy.latency
+                    waited = page.elapsed.total_seconds()
+                    self.tracer.record('connect', began, waited)
+                    self.tracer.record('download', began + waited,
+                                       max(curproxy.latency - waited, 0))
+        except CoreScrapeCancelled:
+            if not ignore_tries:
+                if getattr(event, 'lost', False):
+                    # a hedged attempt answered first, this proxy was too slow
+                    self.stats.add_slow()
+                    curproxy.down_priority()
+                self.proxies.put(curproxy)
+            return None, True
         except Rotator.proxy_exceptions():
+            outcome = rstats.PROXYFAIL
+            _continue = True
             if not ignore_tries:
                 tries = curproxy.add_up_try()
-                if tries < self.maxtriesproxy:
-                    self.proxies.put(curproxy)
-                    _continue = True
+                self.__fail(curproxy, ban=tries >= self.maxtriesproxy)
         except Rotator.conn_exceptions():
+            outcome = rstats.CONNFAIL
             _continue = True
+            if not ignore_tries:
+                self.__fail(curproxy)
         except Rotator.comm_exceptions():
+            outcome = rstats.CONNFAIL
             _continue = True
+            if not ignore_tries:
+                self.__fail(curproxy)
+
+        if outcome is not None and not ignore_tries:
+            self.stats.add(outcome)
+        if outcome is not None and outcomes is not None:
+            outcomes.append(outcome)
 
         return page, _continue
 
@@ -340,7 +770,7 @@ class Rotator(CoreScrape):
             if dynprxy is not None:
                 if dynprxy.status_code == 403 or dynprxy.status_code == 404:
                     dynprxy = None
-                elif any([ignmsg in dynprxy.text for ignmsg in self.ignoremsgs]):
+                elif self.rules.banned(dynprxy) is not None:
                     dynprxy = None
                 elif self.dynamic_proxy_key == 'json':
                     try:
@@ -367,20 +797,247 @@ class Rotator(CoreScrape):
                         tmsg='info'
                     )
 
-    def request(self, url, event=None, threadid=None):
+    def __attempt(self, url, curproxy, threadid, headers=None, outcomes=None,
+                  event=None, profile=None):
+        """
+        Try to collect the URL using the informed proxy and score the proxy
+        according to the outcome. Outcomes of failures are appended to 'outcomes'.
+        The fetch profile, if any, is applied.
+
+        Returns:
+            page: requests.models.Response or None if the attempt failed
+        """
+
+        uagnt = self.__get_usr_agent()
+        domain = Rotator.domain(url)
+
+        self.log('Trying proxy {} and agent {} [Thread {}]'.format(
+            curproxy, list(uagnt.values())[0], threadid))
+
+        with self.__span('dynamic_proxy'):
+            self.__treat_new_proxy(uagnt, curproxy, threadid)
+
+        if profile is not None:
+            headers = dict(profile.headers(), **(headers or {}))
+        page, _continue = self.__request(url, dict(uagnt, **(headers or {})),
+                                         curproxy, outcomes=outcomes, event=event,
+                                         profile=profile)
+
+        if _continue or page is None:
+            return None
+
+        if getattr(page, 'skipped', None) is not None:
+            # nothing to scan for bans, the proxy answered the HEAD request
+            self.log('{} skipped, {} [Thread {}]'.format(
+                url, page.skipped, threadid))
+            self.stats.add(rstats.SUCCESS, curproxy.latency)
+            curproxy.breaker.success()
+            if self.health is not None:
+                self.health.success(domain, curproxy.address)
+            self.proxies.put(curproxy)
+            return page
+
+        reason = None
+        if page.status_code != 403:
+            with self.__span('ban_scan'):  # includes decoding 'page.text'
+                reason = self.rules.banned(page, domain)
+
+        if self.archive is not None:
+            outcome = rstats.SUCCESS if reason is None else rstats.BANNED
+            if page.status_code == 403: outcome = rstats.FORBIDDEN
+            with self.__span('archive'):
+                self.archive.write(page, url=url, outcome=outcome)
+
+        if page.status_code == 403:
+            # Forbidden code. It does not mean this proxy is useless, but
+            # for now the provider detected too much requests were made
+            # by it. We should down its priority and hope in the future,
+            # when it is used again, the provider whitelisted it. If it keeps
+            # happening, the breaker opens and the proxy is quarantined.
+            self.log('Proxy {} forbidden (403) [Thread {}]'.format(
+                curproxy, threadid))
+            self.stats.add(rstats.FORBIDDEN)
+            if outcomes is not None: outcomes.append(rstats.FORBIDDEN)
+            if self.health is not None:
+                # only this domain forbids the proxy
+                if self.health.forbidden(domain, curproxy.address):
+                    self.log('Proxy {} banned for {} [Thread {}]'.format(
+                        curproxy, domain, threadid), tmsg='warning')
+                self.proxies.put(curproxy)
+                return None
+            curproxy.down_priority(10)  # 10 priority points down
+            self.__fail(curproxy, threadid)
+            return None
+
+        if reason is None:
+            # did not find any token pointing the ban of this proxy
+            self.log('{} collected [Thread {}]'.format(url, threadid))
+            self.stats.add(rstats.SUCCESS, curproxy.latency)
+            curproxy.breaker.success()
+            if self.health is not None:
+                self.health.success(domain, curproxy.address)
+            curproxy.up_priority()
+            self.proxies.put(curproxy)
+            return page
+
+        self.stats.add(rstats.BANNED)
+        if outcomes is not None: outcomes.append(rstats.BANNED)
+        if self.health is not None:
+            self.health.ban(domain, curproxy.address)
+            self.log('Proxy {} banned for {} ({}) [Thread {}]'.format(
+                curproxy, domain, reason, threadid), tmsg='warning')
+            self.proxies.put(curproxy)
+            return None
+        self.__fail(curproxy, threadid, ban=True)
+        return None
+
+    def __can_hedge(self):
+        """Tells if one more hedged attempt fits in the extra load cap."""
+
+        snap = self.stats.snapshot()
+        return snap['extra'] < self.hedgeratio * max(snap['attempts'], 1)
+
+    def __schedule(self, delay, callback):
+        """
+        Calls 'callback' after 'delay' seconds in the timer thread of the rotator.
+        Returns an entry that cancels the call once its callback is set to None.
+        """
+
+        entry = [time() + delay, next(self.tseq), callback]
+        with self.tcond:
+            heapq.heappush(self.timers, entry)
+            if self.timer is None:
+                self.timer = Thread(target=self.__run_timers, daemon=True)
+                self.timer.start()
+            self.tcond.notify()
+        return entry
+
+    def __run_timers(self):
+        """Loop of the timer thread."""
+
+        while True:
+            with self.tcond:
+                while not self.timers or self.timers[0][0] > time():
+                    self.tcond.wait(self.timers[0][0] - time() if self.timers
+                                    else None)
+                entry = heapq.heappop(self.timers)
+            if entry[2] is None:
+                continue  # cancelled
+            try:
+                entry[2]()
+            except Exception as err:  # pylint: disable=broad-except
+                self.log('Timer callback failed: {}'.format(err), tmsg='error')
+
+    def __hedged(self, url, curproxy, threadid, headers=None, outcomes=None,
+                 event=None, profile=None):
+        """
+        Attempt with hedging. The attempt runs in a thread of its own. If it takes
+        longer than the percentile 'hedge' of the recent latencies, a second
+        attempt is fired in background through another proxy and the first good
+        response is returned right away. The losing attempt is cancelled through
+        its own event and torn down in background, even if it is still waiting for
+        its response headers. Its proxy loses priority and the attempt is counted
+        as slow.
+
+        Returns:
+            page: requests.models.Response or None if every attempt failed
+        """
+
+        delay = self.stats.percentile(self.hedge)
+        if delay is None:
+            return self.__attempt(url, curproxy, threadid, headers, outcomes, event,
+                                  profile)
+
+        done = Queue()
+        lock = Lock()
+        hedge = {'done': False, 'running': []}
+
+        def run(child, proxy):
+            """Runs an attempt and reports its outcome to the calling thread."""
+            try:
+                done.put((child, self.__attempt(url, proxy, threadid, headers,
+                                                outcomes, child, profile), None))
+            except Exception as err:  # pylint: disable=broad-except
+                done.put((child, None, err))
+
+        def launch():
+            """Event of a new attempt. Called under the lock."""
+            child = event.child()
+            child.lost = False
+            hedge['running'].append(child)
+            return child
+
+        def fire():
+            """Fires the hedge if the primary attempt is still running."""
+            with lock:
+                if hedge['done'] or not self.__can_hedge():
+                    return
+                second = self.__pick_proxy(Rotator.domain(url))
+                if not second:
+                    return
+                self.log('Hedging {} after {:.2f}s with proxy {} [Thread {}]'.format(
+                    url, delay, second, threadid))
+                self.stats.add_extra()
+                hedge['done'] = True  # a single hedge per attempt
+                self.executor.submit(run, launch(), second)
+
+        with lock:
+            Thread(target=run, args=(launch(), curproxy),
+                   daemon=True).start()
+        timer = self.__schedule(delay, fire)
+
+        try:
+            while True:
+                child, page, err = done.get()
+                with lock:
+                    hedge['done'] = True  # no hedge after an attempt ended
+                    hedge['running'].remove(child)
+                    event.release(child)
+                    if err is not None:
+                        raise err
+                    if page is not None or not hedge['running']:
+                        return page
+        finally:
+            timer[2] = None
+            with lock:
+                hedge['done'] = True
+                for child in hedge['running']:
+                    child.lost = True  # the proxy is penalised once it is back
+                    child.set()
+                    event.release(child)
+
+    def request(self, url, event=None, threadid=None, headers=None, profile=None):
         """
         Make a request using a proxy selected from the priority queue and a
         random user agent if available.
 
         Params:
             url: str representation of a URL to access. URL must be escaped.
-            event: object event to trigger interruptions between eventual threads
+            event: object event to trigger interruptions between eventual threads.
+                If informed, bodies are read in chunks so that setting the event
+                cancels the request in flight.
             threadid: int or None representing the current thread
+            headers: dict or None. Additional request headers, e.g. conditional
+                request headers like 'If-None-Match'.
+            profile: corescrape.proxy.fetch_profile.FetchProfile, False or None.
+                Fetch profile of this request, False for none. If None, the
+                profile of the rotator is used.
+
+        Raises:
+            CoreScrapeUrlFailed if 'urlbudget' is set and was exhausted or if every
+                proxy in the pool is banned for the domain of the URL
         """
 
         if threadid is not None and event is None:
             raise TypeError("Param 'event' cannot be 'NoneType' in threading")
 
+        if profile is None:
+            profile = self.profile
+        elif profile is False:
+            profile = None
+
+        # bodies are streamed, to be cancellable, only if the caller can cancel
+        cancellable = event is not None
         if event is None:
             event = CoreScrapeEvent()
 
@@ -392,49 +1049,52 @@ class Rotator(CoreScrape):
         msgeventset = 'Event set. Breaking loop for {} [Thread {}]'.format(
             url, threadid)
 
+        if self.tracer is None:
+            return self.__loop(url, event, threadid, headers, msgeventset,
+                               cancellable, profile)
+        with self.tracer.trace(url):
+            return self.__loop(url, event, threadid, headers, msgeventset,
+                               cancellable, profile)
+
+    def __loop(self, url, event, threadid, headers, msgeventset, cancellable=True,
+               profile=None):
+        """Tries proxies until the page is collected. See 'request'."""
+
+        domain = Rotator.domain(url)
+        outcomes = []
         while True:
+            if self.urlbudget is not None and len(outcomes) >= self.urlbudget:
+                fault = rstats.classify(outcomes)
+                self.log('URL {} exhausted its budget ({} fault) [Thread {}]'.format(
+                    url, fault, threadid), tmsg='warning')
+                raise CoreScrapeUrlFailed(url, outcomes, fault)
+
             if event.is_set():
                 self.log(msgeventset)
                 break
 
-            curproxy = self.__get_proxy()
+            with self.__span('wait_proxy'):
+                curproxy = self.__get_proxy(domain, event)
+            if not curproxy and not event.is_set() and self.health is not None \
+               and self.proxies.qsize() > 0:
+                # the pool is not empty, all of its proxies are banned for the domain
+                self.log('No proxy left for {} [Thread {}]'.format(domain, threadid),
+                         tmsg='warning')
+                raise CoreScrapeUrlFailed(url, outcomes, rstats.TARGET_FAULT)
             if not curproxy:
                 self.log('No proxy. {}'.format(msgeventset))
                 event.state.set_OUT_OF_PROXIES()
                 break
 
-            uagnt = self.__get_usr_agent()
-
-            self.log('Trying proxy {} and agent {} [Thread {}]'.format(
-                curproxy, list(uagnt.values())[0], threadid))
-
-            self.__treat_new_proxy(uagnt, curproxy, threadid)
-
-            page, _continue = self.__request(url, uagnt, curproxy)
-
-            if _continue:
-                continue
+            with self.__span('attempt', proxy=curproxy.address):
+                if self.hedge is None:
+                    page = self.__attempt(url, curproxy, threadid, headers, outcomes,
+                                          event if cancellable else None, profile)
+                else:
+                    page = self.__hedged(url, curproxy, threadid, headers, outcomes,
+                                         event, profile)
 
             if page is not None:
-                if page.status_code == 403:
-                    # Forbidden code. It does not mean this proxy is useless, but
-                    # for now the provider detected too much requests were made
-                    # by it. We should down its priority and hope in the future,
-                    # when it is used again, the provider whitelisted it.
-                    self.log('Proxy {} forbidden (403) [Thread {}]'.format(
-                        curproxy, threadid))
-                    curproxy.down_priority(10)  # 10 priority points down
-                    self.proxies.put(curproxy)
-                    continue
-
-                if not any([ignmsg in page.text for ignmsg in self.ignoremsgs]):
-                    # did not find any token pointing the ban of this proxy
-                    self.log('{} collected [Thread {}]'.format(url, threadid))
-                    curproxy.up_priority()
-                    self.proxies.put(curproxy)
-                    return page
-
-            self.log('Disposing proxy {} [Thread {}]'.format(curproxy, threadid),
-                     tmsg='warning')
+                return page
 
         return None
@@ -0,0 +1,7 @@
+"""Subpackage rules."""
+
+from .. import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    'rule_engine',
+])
@@ -0,0 +1,346 @@
+"""
+Rule Engine
+
+Loads the rules stored in the `conf/` dir once, compiles them and reloads them
+whenever the files change, without restarting the threads.
+
+Ban detection rules tell the rotator a page is a ban page. They come from two
+files:
+
+* `ignoremsgs.txt` (required): each line is a message that, if present in the
+  page, points the ban. All messages of a scope are compiled into a single regex.
+* `banrules.txt` (optional): each line is a rule of one of the kinds below.
+    text <message>          message present in the page
+    regex <pattern>         regex found in the page
+    status <codes>          status code, e.g. `status 429` or `status 500-599,999`
+    header <name> <pattern> regex found in the value of a response header
+    size <op> <bytes>       body size, op being '<' or '>', e.g. `size < 512`.
+                            Not checked on pages without a body: 204, 304, HEAD
+                            responses and resources skipped by a fetch profile.
+
+In both files a line may start with '@domain ' to restrict it to that domain and
+its subdomains. Empty lines and lines starting with '#' are ignored.
+
+Routing rules come from the optional file `routes.txt`. Each line holds a URL regex
+and a parser name separated by whitespace. The first regex matching the URL gives
+the name of the parser, see `ParserRouter`.
+"""
+
+import re
+from hashlib import blake2b
+from os import stat
+from os.path import dirname, abspath
+from threading import Lock
+from time import time
+
+from ..core import CoreScrape
+
+# pylint: disable=invalid-name, too-many-instance-attributes, multiple-statements
+
+BANFILES = ['ignoremsgs', 'banrules']
+ROUTEFILE = 'routes'
+
+def confpattern(confpath=None):
+    """Pattern of the path of a conf file, to be formatted with its name."""
+
+    if confpath is None:
+        return abspath(dirname(__file__) + '/..') + '/conf/{}.txt'
+    conf = abspath(confpath)
+    return conf + ('{}.txt' if conf.endswith('/') else '/{}.txt')
+
+
+def domain_matches(domain, scope):
+    """Tells if the domain is the scope or one of its subdomains."""
+
+    return domain == scope or domain.endswith('.' + scope)
+
+
+def read_lines(path, required=False):
+    """Reads the useful lines of a conf file."""
+
+    try:
+        with open(path, 'r') as _file:
+            lines = [line.strip() for line in _file.readlines()]
+    except FileNotFoundError:
+        if required:
+            raise
+        return []
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def split_scope(line):
+    """Splits '@domain rule' into ('domain', 'rule'). Global rules have None."""
+
+    if line.startswith('@') and ' ' in line:
+        scope, rule = line[1:].split(' ', 1)
+        return scope.lower(), rule.strip()
+    return None, line
+
+
+def has_body(page):
+    """Tells if the page is expected to carry a body."""
+
+    if getattr(page, 'status_code', None) in (204, 304):
+        return False
+    if getattr(page, 'skipped', None) is not None:
+        return False  # HEAD response of a resource skipped by a fetch profile
+    request = getattr(page, 'request', None)
+    return getattr(request, 'method', None) != 'HEAD'
+
+
+class BanRules:
+    """Compiled ban rules of a single scope (global or one domain)."""
+
+    def __init__(self):
+        """Constructor."""
+
+        self.patterns = []  # regex sources, texts are escaped
+        self.statuses = []  # (min, max)
+        self.headers = []  # (name, compiled regex)
+        self.sizes = []  # (op, bytes)
+        self.regex = None
+
+    def add(self, kind, arg):
+        """Adds a rule. Raises ValueError if it is malformed."""
+
+        if kind == 'text':
+            self.patterns.append(re.escape(arg))
+        elif kind == 'regex':
+            re.compile(arg)  # validates
+            self.patterns.append('(?:{})'.format(arg))
+        elif kind == 'status':
+            for part in arg.replace(' ', '').split(','):
+                low, _, high = part.partition('-')
+                self.statuses.append((int(low), int(high or low)))
+        elif kind == 'header':
+            name, pattern = arg.split(None, 1)
+            self.headers.append((name, re.compile(pattern)))
+        elif kind == 'size':
+            op, size = arg.split()
+            if op not in ['<', '>']:
+                raise ValueError("Size rule operator must be '<' or '>'")
+            self.sizes.append((op, int(size)))
+        else:
+            raise ValueError('Unknown rule kind {}'.format(kind))
+
+    def compile(self):
+        """Joins every message and regex into a single regex."""
+
+        if self.patterns:
+            self.regex = re.compile('|'.join(self.patterns))
+        return self
+
+    def match(self, page):
+        """Returns the description of the first rule matched by the page or None."""
+
+        code = getattr(page, 'status_code', None)
+        for low, high in self.statuses:
+            if code is not None and low <= code <= high:
+                return 'status {}'.format(code)
+
+        if self.sizes and has_body(page):
+            size = len(page.content or b'')
+            for op, limit in self.sizes:
+                if (op == '<' and size < limit) or (op == '>' and size > limit):
+                    return 'size {} {}'.format(op, limit)
+
+        for name, regex in self.headers:
+            value = page.headers.get(name)
+            if value is not None and regex.search(value):
+                return 'header {}'.format(name)
+
+        if self.regex is not None:
+            found = self.regex.search(page.text)
+            if found:
+                return 'message {}'.format(found.group(0))
+
+        return None
+
+
+class RuleEngine(CoreScrape):
+    """
+    Rule engine for the conf dir.
+
+    Params:
+        confpath: str indicating where the configuration files are stored
+        interval: int or float. Minimum seconds between checks for changes in the
+            files. None disables hot reload.
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, confpath=None, interval=5, logoperator=None):
+        """Constructor."""
+
+        self.conf = confpattern(confpath)
+        self.interval = interval
+        self.lastcheck = time()
+        self.mtimes = None
+        self.lock = Lock()
+
+        # compiled state: (global BanRules, {domain: BanRules}, [(regex, name)])
+        self.compiled = None
+
+        super().__init__(logoperator=logoperator)
+
+        self.load()
+
+    def __mtimes(self):
+        """Modification times of the rule files."""
+
+        mtimes = []
+        for name in BANFILES + [ROUTEFILE]:
+            try:
+                mtimes.append(stat(self.conf.format(name)).st_mtime)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return mtimes
+
+    def load(self):
+        """Reads and compiles every rule. Raises ValueError on malformed rules."""
+
+        mtimes = self.__mtimes()
+        scopes = {None: BanRules()}
+        for name in BANFILES:
+            for line in read_lines(self.conf.format(name),
+                                   required=name == 'ignoremsgs'):
+                scope, rule = split_scope(line)
+                rules = scopes.setdefault(scope, BanRules())
+                if name == 'ignoremsgs':
+                    rules.add('text', rule)
+                    continue
+                kind, _, arg = rule.partition(' ')
+                try:
+                    rules.add(kind, arg.strip())
+                except (ValueError, re.error) as err:
+                    raise ValueError('Invalid rule "{}" in {}: {}'.format(
+                        line, name, err))
+
+        routes = []
+        for line in read_lines(self.conf.format(ROUTEFILE)):
+            try:
+                pattern, name = line.rsplit(None, 1)
+                routes.append((re.compile(pattern), name))
+            except (ValueError, re.error) as err:
+                raise ValueError('Invalid route "{}": {}'.format(line, err))
+
+        generic = scopes.pop(None).compile()
+        domains = {scope: rules.compile() for scope, rules in scopes.items()}
+        self.compiled = (generic, domains, routes)  # swapped at once
+        self.mtimes = mtimes
+        self.log('Rules loaded: {} domain scopes, {} routes'.format(
+            len(domains), len(routes)), tmsg='info')
+
+    def check_reload(self):
+        """Reloads the rules if any file changed. Keeps the old ones on errors."""
+
+        if self.interval is None or time() - self.lastcheck < self.interval:
+            return
+
+        with self.lock:
+            if time() - self.lastcheck < self.interval:
+                return
+            self.lastcheck = time()
+            if self.__mtimes() == self.mtimes:
+                return
+            try:
+                self.load()
+            except (ValueError, FileNotFoundError) as err:
+                self.mtimes = self.__mtimes()  # do not retry until next change
+                self.log('Rules not reloaded: {}'.format(err), tmsg='warning')
+
+    def banned(self, page, domain=None):
+        """
+        Tells why the page is a ban page.
+
+        Returns:
+            str describing the rule matched or None if the page is not banned
+        """
+
+        self.check_reload()
+        generic, domains, _ = self.compiled
+
+        reason = generic.match(page)
+        if reason is not None or not domain:
+            return reason
+
+        for scope, rules in domains.items():
+            if domain_matches(domain, scope):
+                reason = rules.match(page)
+                if reason is not None:
+                    return reason
+        return None
+
+    def route(self, url):
+        """Name of the parser routed for the URL or None."""
+
+        self.check_reload()
+        for regex, name in self.compiled[2]:
+            if regex.search(url):
+                return name
+        return None
+
+
+class ParserRouter(CoreScrape):
+    """
+    Parser that delegates to other parsers according to the routing rules.
+
+    Params:
+        engine: RuleEngine
+        parsers: dict name -> parser (object with a 'parse' method)
+        default: parser or None used when no route matches
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, engine, parsers, default=None, logoperator=None):
+        """Constructor."""
+
+        if not isinstance(parsers, dict):
+            raise TypeError("Param 'parsers' must be 'dict'")
+
+        self.engine = engine
+        self.parsers = parsers
+        self.default = default
+
+        super().__init__(logoperator=logoperator)
+
+    def fingerprint(self):
+        """Combined fingerprint of the routes and of the routed parsers."""
+
+        parts = sorted((name, parser.fingerprint())
+                       for name, parser in self.parsers.items())
+        if self.default is not None:
+            parts.append((None, self.default.fingerprint()))
+        # the order of the routes matters, the first one matched wins
+        parts.append([(regex.pattern, name)
+                      for regex, name in self.engine.compiled[2]])
+        return blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+    def parser_for(self, url):
+        """Parser routed for the URL or the default one."""
+
+        return self.parsers.get(self.engine.route(url), self.default)
+
+    def parse(self, response, threadid=None):
+        """Parses the response with the parser routed for its URL."""
+
+        parser = self.parser_for(response.url)
+        if parser is None:
+            self.log('No parser routed for {} [Thread {}]'.format(
+                response.url, threadid), tmsg='warning')
+            return []
+        return parser.parse(response, threadid=threadid)
+
+    def parse_and_follow(self, response, threadid=None):
+        """
+        Parses the response and collects its links with the parser routed for its
+        URL. Parsers without 'parse_and_follow' emit no links.
+        """
+
+        parser = self.parser_for(response.url)
+        if parser is None:
+            self.log('No parser routed for {} [Thread {}]'.format(
+                response.url, threadid), tmsg='warning')
+            return [], []
+        if not hasattr(parser, 'parse_and_follow'):
+            return parser.parse(response, threadid=threadid), []
+        return parser.parse_and_follow(response, threadid=threadid)
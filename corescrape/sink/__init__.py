@@ -0,0 +1,7 @@
+"""Subpackage sink."""
+
+from .. import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    'result_sink',
+])
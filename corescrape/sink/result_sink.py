@@ -0,0 +1,291 @@
+"""
+Result Sink
+
+Batched output for parsed results. Instead of keeping every result in memory until
+the threads are joined, the thread controller hands each parsed record to a sink.
+The sink accumulates records in columnar chunks, one column for the URL and one for
+each key of the parser (the keys of `CustomPageParser.xpaths` or a single 'result'
+column for parsers returning lists), and writes them incrementally once the batch is
+full or the flush interval has elapsed.
+
+Available formats are NDJSON (no dependencies), Arrow IPC stream and Parquet. The
+last two require the package 'pyarrow'.
+"""
+
+import json
+from threading import Lock
+from time import time
+
+from ..core import CoreScrape
+
+# pylint: disable=invalid-name, too-many-arguments, import-outside-toplevel
+
+def plain(value):
+    """Converts lxml results (str subclasses) and containers to plain values."""
+
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    return value
+
+
+class ResultSink(CoreScrape):
+    """
+    Base batched sink.
+
+    Subclasses implement '_write' (receives a dict column -> list of values) and
+    optionally '_close'.
+
+    Params:
+        path: str file path to write to
+        columns: list of str or None. Columns of the records besides 'url'. If None,
+            they are taken from the parser given to 'CoreScrapeThread' or, lacking
+            that, from the first record.
+        batchsize: int number of records held before writing
+        flushinterval: int or None. Max time in seconds a record waits in the batch.
+            Checked whenever a new record arrives.
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, path, columns=None, batchsize=1000, flushinterval=30,
+                 logoperator=None):
+        """Constructor."""
+
+        if not isinstance(batchsize, int) or batchsize < 1:
+            raise ValueError("Param 'batchsize' must be a positive 'int'")
+
+        self.path = path
+        self.columns = list(columns) if columns is not None else None
+        self.batchsize = batchsize
+        self.flushinterval = flushinterval
+
+        self.batch = None
+        self.size = 0
+        self.written = 0
+        self.lastflush = time()
+        self.lock = Lock()
+
+        super().__init__(logoperator=logoperator)
+
+    def set_columns_from(self, parser):
+        """Takes the columns from a parser if they were not informed."""
+
+        if self.columns is not None or parser is None:
+            return
+        if hasattr(parser, 'xpaths'):
+            self.columns = list(parser.xpaths.keys())
+        else:
+            self.columns = ['result']
+
+    def __new_batch(self):
+        """Empty columnar batch."""
+
+        self.batch = {column: [] for column in ['url'] + self.columns}
+        self.size = 0
+
+    def put(self, url, result):
+        """Adds a record to the batch. Thread safe."""
+
+        with self.lock:
+            if self.columns is None:
+                self.columns = list(result.keys()) if isinstance(result, dict) \
+                    else ['result']
+            if self.batch is None:
+                self.__new_batch()
+
+            self.batch['url'].append(url)
+            for column in self.columns:
+                if isinstance(result, dict):
+                    value = result.get(column)
+                else:
+                    value = result
+                self.batch[column].append(plain(value))
+            self.size += 1
+
+            expired = (self.flushinterval is not None and
+                       time() - self.lastflush >= self.flushinterval)
+            if self.size >= self.batchsize or expired:
+                self.__flush()
+
+    def __flush(self):
+        """Writes the current batch. Caller must hold the lock."""
+
+        self.lastflush = time()
+        if not self.size:
+            return
+
+        self._write(self.batch)
+        self.written += self.size
+        self.log('Sink wrote {} records into {} ({} total)'.format(
+            self.size, self.path, self.written))
+        self.__new_batch()
+
+    def flush(self):
+        """Writes whatever is in the batch."""
+
+        with self.lock:
+            self.__flush()
+
+    def close(self):
+        """Flushes and closes the sink."""
+
+        with self.lock:
+            self.__flush()
+            self._close()
+
+    def _write(self, batch):
+        """Writes a columnar batch."""
+
+        raise NotImplementedError
+
+    def _close(self):
+        """Releases resources."""
+
+
+class NDJSONSink(ResultSink):
+    """Writes one JSON object per line, appending to the file."""
+
+    def __init__(self, path, **kwargs):
+        """Constructor."""
+
+        super().__init__(path, **kwargs)
+        self.__file = open(self.path, 'a', encoding='utf-8')
+
+    def _write(self, batch):
+        """Writes a columnar batch as rows."""
+
+        columns = list(batch.keys())
+        lines = []
+        for row in zip(*batch.values()):
+            lines.append(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        self.__file.write('\n'.join(lines) + '\n')
+        self.__file.flush()
+
+    def _close(self):
+        """Closes the file."""
+
+        self.__file.close()
+
+
+class ArrowSink(ResultSink):
+    """
+    Writes batches into an Arrow IPC stream or a Parquet file.
+
+    Unless a schema is informed, it is inferred from the values written. Columns
+    whose values are all None have no type yet, so batches are held until every
+    column got one (or 'maxpending' batches are held) and later batches are cast to
+    that schema. Columns of empty lists have no type either. Columns still without a
+    type are written as null columns, where a later value is an error, or as lists
+    of strings if only empty lists were found: inform a schema if some keys are
+    rarely found.
+
+    Params:
+        path: str file path to write to
+        fmt: str either 'arrow' (IPC stream) or 'parquet'
+        schema: pyarrow.Schema or None. Schema of the file, with a field for 'url'
+            and for each column.
+        maxpending: int number of batches held while some column has no type
+        kwargs: as in ResultSink
+    """
+
+    def __init__(self, path, fmt='parquet', schema=None, maxpending=10, **kwargs):
+        """Constructor."""
+
+        if fmt not in ['arrow', 'parquet']:
+            raise ValueError("Param 'fmt' must either be 'arrow' or 'parquet'")
+
+        try:
+            import pyarrow
+        except ImportError as err:
+            raise ImportError("ArrowSink requires the package 'pyarrow'") from err
+
+        if schema is not None and not isinstance(schema, pyarrow.Schema):
+            raise ValueError("Param 'schema' must be a 'pyarrow.Schema' or None")
+
+        self.pa = pyarrow
+        self.fmt = fmt
+        self.writer = None
+        self.schema = schema
+        self.maxpending = maxpending
+        self.pending = []
+        super().__init__(path, **kwargs)
+
+    def __untyped(self, kind):
+        """Tells if the type is null or a list of null, e.g. of an empty list."""
+
+        if self.pa.types.is_null(kind):
+            return True
+        if self.pa.types.is_list(kind) or self.pa.types.is_large_list(kind) or \
+           self.pa.types.is_fixed_size_list(kind):
+            return self.__untyped(kind.value_type)
+        return False
+
+    def __infer(self):
+        """Schema of the pending tables, each field with its first typed type."""
+
+        fields = []
+        for field in self.pending[0].schema:
+            for table in self.pending:
+                kind = table.schema.field(field.name).type
+                if not self.__untyped(kind):
+                    field = self.pa.field(field.name, kind)
+                    break
+            fields.append(field)
+        return self.pa.schema(fields)
+
+    def __settle(self, schema):
+        """Schema with the untyped list columns as lists of strings, as parsed."""
+
+        fields = []
+        for field in schema:
+            if not self.pa.types.is_null(field.type) and self.__untyped(field.type):
+                field = self.pa.field(field.name, self.pa.list_(self.pa.string()))
+            fields.append(field)
+        return self.pa.schema(fields)
+
+    def __open(self):
+        """Opens the writer and writes the pending tables."""
+
+        nulls = [f.name for f in self.schema if self.pa.types.is_null(f.type)]
+        if nulls:
+            self.log('Columns {} of {} had no values and are written as null '
+                     'columns'.format(nulls, self.path), tmsg='warning')
+
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        else:
+            self.writer = self.pa.ipc.new_stream(self.path, self.schema)
+
+        pending, self.pending = self.pending, []
+        for table in pending:
+            self.writer.write_table(table.cast(self.schema))
+
+    def _write(self, batch):
+        """Writes a columnar batch as an Arrow record batch."""
+
+        if self.schema is not None:
+            table = self.pa.table(batch, schema=self.schema)
+            if self.writer is None:
+                self.__open()
+            self.writer.write_table(table)
+            return
+
+        self.pending.append(self.pa.table(batch))
+        schema = self.__infer()
+        typed = not any(self.__untyped(f.type) for f in schema)
+        if typed or len(self.pending) >= self.maxpending:
+            self.schema = self.__settle(schema)
+            self.__open()
+
+    def _close(self):
+        """Writes the batches held and closes the writer."""
+
+        if self.pending:
+            self.schema = self.__settle(self.__infer())
+            self.__open()
+        if self.writer is not None:
+            self.writer.close()
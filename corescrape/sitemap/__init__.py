@@ -0,0 +1,8 @@
+"""Subpackage sitemap."""
+
+from .. import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    'sitemap_reader',
+    'recrawl_planner',
+])
@@ -0,0 +1,211 @@
+"""
+Recrawl Planner
+
+Incremental recrawls. A SQLite store keeps, for each URL collected, the time of its
+last fetch and the hash of its body. Given the entries of a sitemap (see
+corescrape.sitemap.sitemap_reader), the planner submits only the URLs that are:
+
+* new: never fetched before;
+* changed: their 'lastmod' is later than the last fetch;
+* stale: fetched longer than 'maxage' seconds ago, whatever their 'lastmod' says.
+
+Pass the planner to corescrape.threads.corescrape_thread.CoreScrapeThread (param
+'planner') to record every page collected. Recorded bodies are compared with the
+previous hash, so the stats tell how many recrawls actually found a new content.
+
+Note 'lastmod' comes from the clock of the site, while fetch times come from the
+local clock. Use 'skew' to allow for the difference.
+"""
+
+import sqlite3
+from threading import Lock
+from time import time
+
+from ..core import CoreScrape
+from ..pgparser.memo_store import content_hash
+from ..threads.scheduler import WorkItem
+
+# pylint: disable=invalid-name, too-many-arguments
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fetches (
+    url TEXT PRIMARY KEY,
+    fetched REAL NOT NULL,
+    hash TEXT
+);
+"""
+
+# URLs looked up in the store at a time
+LOOKUP_BATCH = 500
+
+
+class RecrawlPlanner(CoreScrape):
+    """
+    Plans recrawls from sitemap entries and the history of fetches.
+
+    Params:
+        path: str path of the SQLite file. Use ':memory:' for a store that lives
+            only during the process.
+        maxage: int, float or None. Seconds after which a page is refetched even if
+            its 'lastmod' did not change or is absent. None refetches pages without
+            'lastmod' only if they were never fetched.
+        skew: int or float. Seconds added to the fetch time before comparing it
+            with 'lastmod'. Negative values make the planner more eager.
+        commitevery: int number of fetches recorded between two commits. Pending
+            records are also committed on 'flush' and 'close'.
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, path, maxage=None, skew=0, commitevery=100,
+                 logoperator=None):
+        """Constructor."""
+
+        self.path = path
+        self.maxage = maxage
+        self.skew = skew
+        self.commitevery = max(1, commitevery)
+        self.pending = 0  # records not committed yet
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+        self.counters = None
+        self.__reset()
+
+        super().__init__(logoperator=logoperator)
+
+    def __reset(self):
+        """Resets the counters."""
+
+        self.counters = {'new': 0, 'changed': 0, 'stale': 0, 'skipped': 0,
+                         'recorded': 0, 'unchanged': 0}
+
+    def __history(self, urls):
+        """Dict url -> last fetch time of the URLs already fetched."""
+
+        marks = ','.join('?' * len(urls))
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT url, fetched FROM fetches WHERE url IN ({})'.format(marks),
+                urls).fetchall()
+        return dict(rows)
+
+    def reason(self, lastmod, fetched, now=None):
+        """
+        Why a page must be fetched or None if it must not.
+
+        Params:
+            lastmod: float epoch time or None, from the sitemap
+            fetched: float epoch time of the last fetch or None
+        """
+
+        if fetched is None:
+            return 'new'
+        if lastmod is not None and lastmod > fetched + self.skew:
+            return 'changed'
+        if self.maxage is not None and (now or time()) - fetched > self.maxage:
+            return 'stale'
+        return None
+
+    def plan(self, entries, priority=0, now=None):
+        """
+        Streams the work items to be collected. The counters are reset, so they
+        describe this plan and the fetches recorded after it.
+
+        Params:
+            entries: iterable of (url, lastmod) as yielded by
+                corescrape.sitemap.sitemap_reader.SitemapReader.entries
+            priority: int priority of the work items
+
+        Yields:
+            corescrape.threads.scheduler.WorkItem
+        """
+
+        self.__reset()
+        now = now or time()
+        batch = []
+        seen = set()
+        for url, lastmod in entries:
+            if url in seen: continue  # listed twice
+            seen.add(url)
+            batch.append((url, lastmod))
+            if len(batch) >= LOOKUP_BATCH:
+                yield from self.__plan_batch(batch, priority, now)
+                batch = []
+        if batch:
+            yield from self.__plan_batch(batch, priority, now)
+
+        self.log('Recrawl plan: {}'.format(self.stats()), tmsg='info')
+
+    def __plan_batch(self, batch, priority, now):
+        """Work items of a batch of entries."""
+
+        history = self.__history([url for url, _ in batch])
+        for url, lastmod in batch:
+            reason = self.reason(lastmod, history.get(url), now)
+            if reason is None:
+                self.counters['skipped'] += 1
+                continue
+            self.counters[reason] += 1
+            yield WorkItem(url, priority=priority)
+
+    def record(self, url, content=None, fetched=None):
+        """
+        Records a fetch of the URL.
+
+        Params:
+            content: bytes or None. Body fetched. None (e.g. the server answered
+                304) keeps the previous hash.
+            fetched: float or None. Epoch time of the fetch. Default now.
+
+        Returns:
+            bool telling if the body changed since the previous fetch
+        """
+
+        bodyhash = content_hash(content) if content is not None else None
+        with self.lock:
+            row = self.conn.execute('SELECT hash FROM fetches WHERE url = ?',
+                                    (url,)).fetchone()
+            previous = row[0] if row is not None else None
+            if bodyhash is None:
+                bodyhash = previous
+            self.conn.execute('INSERT OR REPLACE INTO fetches VALUES (?, ?, ?)',
+                              (url, fetched or time(), bodyhash))
+            self.pending += 1
+            if self.pending >= self.commitevery:
+                self.conn.commit()
+                self.pending = 0
+
+            self.counters['recorded'] += 1
+            changed = previous is None or previous != bodyhash
+            if not changed:
+                self.counters['unchanged'] += 1
+        return changed
+
+    def forget(self, url):
+        """Removes the history of the URL, so the next plan submits it."""
+
+        with self.lock:
+            self.conn.execute('DELETE FROM fetches WHERE url = ?', (url,))
+            self.conn.commit()
+            self.pending = 0
+
+    def flush(self):
+        """Commits the pending records."""
+
+        with self.lock:
+            if self.pending:
+                self.conn.commit()
+                self.pending = 0
+
+    def stats(self):
+        """Planner counters."""
+
+        return dict(self.counters)
+
+    def close(self):
+        """Closes the store."""
+
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
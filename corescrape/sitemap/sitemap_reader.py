@@ -0,0 +1,219 @@
+"""
+Sitemap Reader
+
+Streams the entries of sitemaps (https://www.sitemaps.org/protocol.html) and of
+sitemap indexes. Documents are parsed incrementally and each entry is discarded
+once read, so the memory used does not grow with the size of the sitemap. Gzipped
+sitemaps ('sitemap.xml.gz') are detected by their content and decompressed on the
+fly.
+
+Sitemaps given by URL are fetched through a rotator, if informed, or directly
+otherwise. Fetching through the rotator keeps the proxies in front of the requests,
+but the body of each sitemap is then kept in memory while it is parsed. The fetch
+profile of the rotator, if any, is not applied: it would skip or truncate them.
+
+Broken documents are parsed as far as possible. Entries after an error may be lost,
+so the reader warns about every sitemap the parser had to recover.
+"""
+
+import gzip
+import io
+from datetime import datetime, timezone
+
+from lxml import etree
+
+from ..core import CoreScrape
+
+# pylint: disable=invalid-name, too-many-arguments
+
+GZIP_MAGIC = b'\x1f\x8b'
+TAGS = ('{*}url', '{*}sitemap')
+MAXERRORS = 5
+
+
+def parse_lastmod(value):
+    """
+    Epoch time of a W3C datetime ('2024', '2024-05', '2024-05-01',
+    '2024-05-01T10:00:00+02:00', ...) or None if it can not be read. Dates without
+    a timezone are taken as UTC.
+    """
+
+    if not value:
+        return None
+    value = value.strip()
+    if len(value) == 4: value += '-01'
+    if len(value) == 7: value += '-01'
+    if value.endswith('Z') or value.endswith('z'):
+        value = value[:-1] + '+00:00'
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def open_stream(source):
+    """Binary stream of a path, bytes or binary file, decompressed if gzipped."""
+
+    if isinstance(source, bytes):
+        stream = io.BytesIO(source)
+    elif isinstance(source, str):
+        stream = open(source, 'rb')
+    else:
+        stream = source
+
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return stream
+
+
+def iter_entries(source, errors=None):
+    """
+    Streams the entries of a single sitemap or sitemap index.
+
+    Params:
+        source: path, bytes or binary file of the document
+        errors: list or None. Once the document is read, the first MAXERRORS
+            errors the parser recovered from are appended to it. Entries after an
+            error may have been dropped.
+
+    Yields:
+        kind: str 'url' (page) or 'sitemap' (entry of an index)
+        loc: str URL of the entry
+        lastmod: float epoch time or None
+    """
+
+    stream = open_stream(source)
+    try:
+        context = etree.iterparse(stream, events=('end',), tag=TAGS,
+                                  resolve_entities=False, no_network=True,
+                                  huge_tree=True, recover=True)
+        for _, elem in context:
+            loc = lastmod = None
+            for child in elem:
+                name = child.tag.rpartition('}')[2] if isinstance(child.tag, str) \
+                    else None  # comments
+                if name == 'loc': loc = child.text
+                elif name == 'lastmod': lastmod = child.text
+            kind = elem.tag.rpartition('}')[2]
+
+            # frees the entries already read
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+            if loc and loc.strip():
+                yield kind, loc.strip(), parse_lastmod(lastmod)
+
+        if errors is not None:
+            errors.extend(str(entry) for entry in context.error_log[:MAXERRORS])
+    finally:
+        stream.close()
+
+
+class SitemapReader(CoreScrape):
+    """
+    Reads the pages listed by a sitemap, following sitemap indexes.
+
+    Params:
+        rotator: corescrape.proxy.rotator.Rotator or None. If informed, sitemaps
+            given by URL are fetched through it. Otherwise they are streamed
+            straight from the server, without proxies.
+        timeout: int or float. Timeout of the direct requests, in seconds.
+        maxsitemaps: int. Maximum number of sitemaps read per call of 'entries',
+            guarding against index loops and runaway indexes.
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, rotator=None, timeout=30, maxsitemaps=10000,
+                 logoperator=None):
+        """Constructor."""
+
+        self.rotator = rotator
+        self.timeout = timeout
+        self.maxsitemaps = maxsitemaps
+
+        super().__init__(logoperator=logoperator)
+
+    def __open(self, location):
+        """Binary stream of a sitemap given by URL or path, or None on failure."""
+
+        if not (location.startswith('http://') or location.startswith('https://')):
+            return open(location, 'rb')
+
+        if self.rotator is not None:
+            page = self.rotator.request(location, profile=False)
+            if page is None or page.status_code >= 400:
+                return None
+            if getattr(page, 'skipped', None) is not None:
+                self.log('Sitemap {} skipped, {}'.format(location, page.skipped),
+                         tmsg='warning')
+                return None
+            return io.BytesIO(page.content)
+
+        import requests  # pylint: disable=import-outside-toplevel
+
+        page = requests.get(location, stream=True, timeout=self.timeout)
+        if page.status_code >= 400:
+            page.close()
+            return None
+        page.raw.decode_content = True  # only the transfer encoding
+        return page.raw
+
+    def entries(self, location, since=None):
+        """
+        Streams the pages of a sitemap or sitemap index.
+
+        Params:
+            location: str URL or path of the sitemap
+            since: float or None. Epoch time. Sitemaps of an index whose 'lastmod'
+                is older than it are not read.
+
+        Yields:
+            loc: str URL of the page
+            lastmod: float epoch time or None
+        """
+
+        pending = [location]
+        visited = set()
+        while pending and len(visited) < self.maxsitemaps:
+            current = pending.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+
+            try:
+                stream = self.__open(current)
+            except Exception as err:  # pylint: disable=broad-except
+                self.log('Could not fetch sitemap {}: {}'.format(current, err),
+                         tmsg='warning')
+                continue
+            if stream is None:
+                self.log('Could not fetch sitemap {}'.format(current),
+                         tmsg='warning')
+                continue
+
+            npages = 0
+            errors = []
+            try:
+                for kind, loc, lastmod in iter_entries(stream, errors):
+                    if kind == 'url':
+                        npages += 1
+                        yield loc, lastmod
+                    elif since is None or lastmod is None or lastmod >= since:
+                        pending.append(loc)
+            except (etree.XMLSyntaxError, OSError, EOFError) as err:
+                self.log('Sitemap {} is broken after {} pages: {}'.format(
+                    current, npages, err), tmsg='warning')
+            if errors:
+                self.log('Sitemap {} is malformed, pages after {} may be missing: '
+                         '{}'.format(current, npages, errors[0]), tmsg='warning')
+            self.log('Read {} pages from sitemap {}'.format(npages, current))
+
+        if pending:
+            self.log('Stopped after {} sitemaps, {} left unread'.format(
+                len(visited), len(pending)), tmsg='warning')
@@ -1,4 +1,13 @@
 """Subpackage threads."""
 
-from . import corescrape_event
-from . import corescrape_thread
+from .. import lazy_submodules
+
+__getattr__ = lazy_submodules(__name__, [
+    'corescrape_event',
+    'corescrape_thread',
+    'scheduler',
+    'service',
+    'retry_policy',
+    'concurrency',
+    'frontier',
+])
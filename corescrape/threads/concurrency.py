@@ -0,0 +1,118 @@
+"""
+Concurrency Controller
+
+Adaptive control of the number of active threads. The right concurrency depends on
+the health of the proxy pool, the latency of the target and its ban rate, and all
+of those change during a run. The controller follows an AIMD policy (additive
+increase, multiplicative decrease), evaluated once per window:
+
+* if the error rate of the window (403, ban pages, proxy and connection failures
+  counted by the rotator) is above 'maxerrorrate', the limit is multiplied by
+  'decrease';
+* else, if the throughput (URLs finished per second) did not drop compared to the
+  previous window, one more thread is admitted;
+* else the limit is kept.
+
+The limit always stays between 'minthreads' and 'maxthreads'.
+"""
+
+from threading import Lock
+from time import time
+
+from ..core import CoreScrape
+
+# pylint: disable=invalid-name, too-many-arguments, too-many-instance-attributes
+
+class ConcurrencyController(CoreScrape):
+    """
+    AIMD concurrency controller.
+
+    Params:
+        minthreads: int minimum number of active threads
+        maxthreads: int maximum number of active threads. This is the number of
+            threads started by 'CoreScrapeThread'.
+        initial: int or None. Initial limit. Default 'minthreads'.
+        interval: int or float. Seconds between evaluations.
+        maxerrorrate: float. Error rate above which the limit decreases.
+        decrease: float. Multiplicative factor applied on decrease.
+        tolerance: float. Relative throughput drop still considered stable.
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, minthreads, maxthreads, initial=None, interval=10,
+                 maxerrorrate=0.3, decrease=0.5, tolerance=0.05, logoperator=None):
+        """Constructor."""
+
+        if not 1 <= minthreads <= maxthreads:
+            raise ValueError("Params must respect 1 <= 'minthreads' <= 'maxthreads'")
+
+        if not 0 < decrease < 1:
+            raise ValueError("Param 'decrease' must be between 0 and 1")
+
+        self.minthreads = minthreads
+        self.maxthreads = maxthreads
+        self.limit = minthreads if initial is None else \
+            max(minthreads, min(maxthreads, initial))
+        self.interval = interval
+        self.maxerrorrate = maxerrorrate
+        self.decrease = decrease
+        self.tolerance = tolerance
+
+        self.lock = Lock()
+        self.last = None  # (time, completed, snapshot) of the last evaluation
+        self.throughput = None
+
+        super().__init__(logoperator=logoperator)
+
+    def reset(self):
+        """Forgets the last window. Called when threads start."""
+
+        with self.lock:
+            self.last = None
+            self.throughput = None
+
+    def admits(self, threadid):
+        """Tells if the thread is allowed to work under the current limit."""
+
+        return threadid < self.limit
+
+    def tick(self, completed, snapshot=None):
+        """
+        Evaluates the window if 'interval' has elapsed.
+
+        Params:
+            completed: int number of URLs finished so far
+            snapshot: dict from corescrape.proxy.request_stats.RequestStats or None
+        """
+
+        now = time()
+        with self.lock:
+            if self.last is None:
+                self.last = (now, completed, snapshot)
+                return
+            if now - self.last[0] < self.interval:
+                return
+
+            lasttime, lastcompleted, lastsnapshot = self.last
+            self.last = (now, completed, snapshot)
+
+            throughput = (completed - lastcompleted) / (now - lasttime)
+            errorrate = 0.
+            if snapshot is not None and lastsnapshot is not None:
+                attempts = snapshot['attempts'] - lastsnapshot['attempts']
+                if attempts:
+                    errorrate = (snapshot['errors'] - lastsnapshot['errors']) / \
+                        attempts
+
+            previous = self.limit
+            if errorrate > self.maxerrorrate:
+                self.limit = max(self.minthreads, int(self.limit * self.decrease))
+            elif (self.throughput is None or
+                  throughput >= self.throughput * (1 - self.tolerance)):
+                self.limit = min(self.maxthreads, self.limit + 1)
+            self.throughput = throughput
+
+        if self.limit != previous:
+            self.log(
+                'Concurrency {} -> {} (throughput {:.2f}/s, error rate {:.2f})'
+                .format(previous, self.limit, throughput, errorrate), tmsg='info')
@@ -4,12 +4,14 @@ Event manager
 Implements a basic event with states for thread control
 """
 
+import os
+import socket
 from sys import stdout
 from traceback import print_exc
 from inspect import getmembers
-from threading import Event
+from threading import Event, RLock
 
-from core import CoreScrape
+from ..core import CoreScrape
 
 # pylint: disable=invalid-name
 
@@ -148,10 +150,87 @@ class States(CoreScrape):
 
 
 class CoreScrapeEvent(Event):
-    """Core Scrape Event."""
+    """
+    Core Scrape Event.
+
+    In-flight responses can be registered in the event. Once it is set, their
+    connections are shut down, so the threads reading them are released right
+    away.
+    """
 
     def __init__(self, logoperator=None):
         """Constructor."""
 
         super().__init__()  # this class is an event
         self.state = States(self, logoperator=logoperator)  # but it has states
+        self.inflight = set()
+        self.children = set()
+        self.iflock = RLock()
+
+    def register(self, response):
+        """Registers a response being read. Closes it if the event is set."""
+
+        with self.iflock:
+            self.inflight.add(response)
+            if self.is_set():
+                self.__close(response)
+
+    def unregister(self, response):
+        """Unregisters a response."""
+
+        with self.iflock:
+            self.inflight.discard(response)
+
+    def child(self):
+        """
+        New event set along with this one, which can also be set alone, e.g. to
+        cancel one of many attempts. Release it with 'release' once done.
+        """
+
+        event = CoreScrapeEvent()
+        with self.iflock:
+            self.children.add(event)
+            if self.is_set():
+                event.set()
+        return event
+
+    def release(self, event):
+        """Releases a child event."""
+
+        with self.iflock:
+            self.children.discard(event)
+
+    @staticmethod
+    def __close(response):
+        """
+        Shuts down the connection of a response, waking up the thread blocked
+        reading it. The response itself is closed by that thread.
+        """
+
+        try:
+            fd = os.dup(response.raw.fileno())
+        except (AttributeError, OSError, ValueError):
+            return  # already closed
+        try:
+            # a duplicate of the socket, with its own family (IPv4, IPv6)
+            sock = socket.socket(fileno=fd)
+        except OSError:
+            os.close(fd)
+            return
+
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    def set(self):
+        """Sets the event and closes the in-flight responses."""
+
+        super().set()
+        with self.iflock:  # responses are unregistered before being closed
+            for response in self.inflight:
+                self.__close(response)
+            for event in self.children:
+                event.set()
@@ -7,15 +7,24 @@ Thread control for this package.
 import signal
 from warnings import warn
 from queue import Queue
-from threading import Thread
+from threading import Thread, Lock
+from time import time
 
 from . import corescrape_event
-from core import CoreScrape
-from core.exceptions import CoreScrapeTimeout
+from .scheduler import Scheduler, WorkItem
+from ..core import CoreScrape
+from ..core.exceptions import CoreScrapeTimeout, CoreScrapeUrlFailed
+from ..pgparser.memo_store import content_hash
+from ..logs.tracer import NOOP
 
 # pylint: disable=invalid-name, too-few-public-methods, multiple-statements
 # pylint: disable=bare-except, too-many-arguments, too-many-instance-attributes
 
+# seconds a thread parked by the concurrency controller waits before checking again
+PARKED_WAIT = 0.5
+# seconds an idle thread waits for the links of pages still in flight, when crawling
+IDLE_WAIT = 0.05
+
 def alarm_handler(signum, frame):
     """Handles the alarm."""
 
@@ -36,11 +45,27 @@ class CoreScrapeThread(CoreScrape):
     'timeout' during 'start_threads' method processing. The timer is unset in
     'wait_for_threads' method.
 
+    URLs are kept in a scheduler shared by the threads, each one taking the next URL
+    as soon as it is done with the previous. The most urgent URLs (see
+    corescrape.threads.scheduler.WorkItem) are taken first. Optionally, a
+    concurrency controller adjusts how many of the threads are active during the
+    run.
+
+    In crawl mode (see param 'frontier'), the parser also emits the links found in
+    each page and those admitted by the frontier are collected in the same run. The
+    threads only stop once the scheduler is empty and no page is in flight.
+
+    If the parser has a 'batchsize' (see
+    corescrape.pgparser.custom_parser.CustomPageParser), its batched filters run
+    over batches of pages in a corescrape.pgparser.custom_parser.FilterBatch, kept
+    in 'batcher', and the filtered results reach the sink or 'join_responses' as
+    batches complete. The last batch is flushed by 'wait_for_threads'.
+
     Params:
         nthreads: int. Desired number of threads. Once the method 'start_threads' is
-            called, the controller will try to split the given input into chunks of
-            number 'nthreads'. If it is not possible to split in 'nthreads' chunks,
-            then the actual number of threads is available in 'actualnthreads'.
+            called, the controller starts 'nthreads' threads, or less if there are
+            not enough items. The actual number of threads is available in
+            'actualnthreads'.
         rotator: corescrape.proxy.Rotator (preferably). Uses this rotator to make
             requests using different proxies and user agents. There is always the
             possibility to pass the 'requests' module to this parameter, but that is
@@ -54,15 +79,80 @@ class CoreScrapeThread(CoreScrape):
             reached.
         logoperator: corescrape.logs.LogOperator or None. Log to be fed with process
             runtime information.
+        sink: corescrape.sink.result_sink.ResultSink or None. If informed, parsed
+            results are written incrementally by the sink instead of being kept for
+            'join_responses'. Requires a parser.
+        dedup: corescrape.pgparser.deduplicator.Deduplicator or None. If informed,
+            bodies already seen are not parsed again. Requires a parser. Its mode
+            'mark' can not be used with 'sink'.
+        controller: corescrape.threads.concurrency.ConcurrencyController or None. If
+            informed, 'controller.maxthreads' threads are started instead of
+            'nthreads' and only 'controller.limit' of them take URLs at a time.
+        memo: corescrape.pgparser.memo_store.MemoStore or None. If informed, parsed
+            results are memoized across runs. Pages answered with 304 or whose body
+            did not change are not parsed again. Requires a parser with a
+            'fingerprint' method.
+        storage: corescrape.archive.segment_store.SegmentStore or None. Only used
+            without a parser. If informed, whole pages are written to the store and
+            'join_responses' returns lightweight handles instead of responses.
+        scheduler: corescrape.threads.scheduler.Scheduler or None. Queue of the URLs
+            to be collected. If None, a scheduler dropping expired URLs is used.
+            Stats by priority are available in 'scheduler.stats()'. It is cleared
+            at the start of each run.
+        tracer: corescrape.logs.tracer.Tracer or None. If informed, the stages of
+            each URL sampled are traced. Pass the same tracer to the rotator to
+            trace its stages as well.
+        retry: corescrape.threads.retry_policy.RetryPolicy or None. URLs whose
+            request exhausted the rotator 'urlbudget' are deferred according to the
+            policy. URLs out of retries, or every failed URL if there is no policy,
+            are kept in 'deadletters'.
+        jointimeout: int, float or None. Once the event is set, seconds to wait for
+            the threads to finish. In-flight requests are cancelled when the event
+            is set, but a request still connecting only stops at its own timeout.
+            Threads still running after this time are abandoned and their results
+            are lost. None waits for them indefinitely. Default None.
+        frontier: corescrape.threads.frontier.Frontier or None. If informed, the
+            URLs passed to 'start_threads' are the seeds of a crawl. Requires a
+            parser with a 'parse_and_follow' method (see 'follow' in
+            corescrape.pgparser.simple_parser.SimpleParser). Pages deduplicated by
+            'dedup' do not have their links followed. Can not be used with 'memo'.
+            Stats are available in 'frontier.stats()'.
+        planner: corescrape.sitemap.recrawl_planner.RecrawlPlanner or None. If
+            informed, the fetch of every page answered (status below 400) is
+            recorded, so the next recrawl plan skips pages that did not change.
     """
 
     def __init__(self, nthreads, rotator, parser=None, timeout=None,
-                 logoperator=None):
+                 logoperator=None, sink=None, dedup=None, controller=None,
+                 memo=None, storage=None, scheduler=None, tracer=None, retry=None,
+                 jointimeout=None, frontier=None, planner=None):
         """Constructor."""
 
         if timeout is not None and not isinstance(timeout, int):
             raise TypeError("Param. 'timeout' must be 'int' or 'NoneType'")
 
+        if sink is not None and parser is None:
+            raise ValueError("Param. 'sink' requires a 'parser'")
+
+        if dedup is not None and parser is None:
+            raise ValueError("Param. 'dedup' requires a 'parser'")
+
+        if dedup is not None and dedup.mode == 'mark' and sink is not None:
+            # the sink has no column for the marks, duplicates would be empty rows
+            raise ValueError("Param. 'dedup' in mode 'mark' can not be used with "
+                             "'sink'")
+
+        if memo is not None and not hasattr(parser, 'fingerprint'):
+            raise ValueError("Param. 'memo' requires a parser with 'fingerprint'")
+
+        if frontier is not None and not hasattr(parser, 'parse_and_follow'):
+            raise ValueError(
+                "Param. 'frontier' requires a parser with 'parse_and_follow'")
+
+        if frontier is not None and memo is not None:
+            # memoized results carry no links, so the crawl would stop at them
+            raise ValueError("Param. 'frontier' can not be used with 'memo'")
+
         # inputs
         self.nthreads = nthreads
         self.actualnthreads = nthreads
@@ -70,32 +160,40 @@ class CoreScrapeThread(CoreScrape):
         self.parser = parser
         self.timeout = timeout  # CAREFUL! This is not timeout for requests
         self.timeoutset = False
+        self.sink = sink
+        if self.sink is not None:
+            self.sink.set_columns_from(self.parser)
+        self.dedup = dedup
+        self.controller = controller
+        self.memo = memo
+        self.parserfp = parser.fingerprint() if memo is not None else None
+        self.storage = storage
+        self.tracer = tracer
+        self.retry = retry
+        self.jointimeout = jointimeout
+        self.frontier = frontier
+        self.planner = planner
+        self.batcher = None
+        if getattr(parser, 'batchsize', None):
+            # pylint: disable=import-outside-toplevel
+            from ..pgparser.custom_parser import FilterBatch
+            self.batcher = FilterBatch(parser, self.__keep_filtered,
+                                       logoperator=logoperator)
 
         # control attrs
+        self.scheduler = scheduler if scheduler is not None else Scheduler(
+            logoperator=logoperator)
+        self.completed = 0
+        self.deadletters = []
+        self.busy = set()  # threads with a URL in flight
+        self.filtered = []  # results of the batched filters, without a sink
+        self.lock = Lock()
         self.queue = Queue()
         self.event = corescrape_event.CoreScrapeEvent(logoperator=logoperator)
         self.threads = []
 
         super().__init__(logoperator=logoperator)
 
-    def __split(self, a):
-        """
-        Tries to split the input into chunks for each thread.
-
-        Input must be a list.
-        """
-
-        if not isinstance(a, list):
-            raise TypeError("Param 'a' must be 'list'")
-
-        n = self.nthreads  # desired number of threads
-        k, m = divmod(len(a), n)
-        split = [a[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
-        split = [part for part in split if part]  # drops empty chunks
-        # actual number of threads. Sometimes differs from 'nthreads'
-        self.actualnthreads = len(split)
-        return split
-
     def __warn_wait_threads(self):
         """Produce warning to wait for threads if needed."""
 
@@ -137,49 +235,244 @@ class CoreScrapeThread(CoreScrape):
         if condition:
             self.event.state.set_DUTY_FREE()
 
-    def __iterate(self, threadid, data, *args):
+    def __trace(self, url):
+        """Trace of the URL, if there is a tracer."""
+
+        if self.tracer is None:
+            return NOOP
+        return self.tracer.trace(url)
+
+    def __span(self, name):
+        """Span of the tracer, if any."""
+
+        if self.tracer is None:
+            return NOOP
+        return self.tracer.span(name)
+
+    def __keep_filtered(self, url, result):
+        """Keeps a result of the batched filters or hands it to the sink."""
+
+        if self.sink is not None:
+            self.sink.put(url, result)
+        else:
+            with self.lock:
+                self.filtered.append({url: result})
+
+    def __store(self, res, url, result):
+        """Keeps a parsed result or hands it to the sink."""
+
+        if self.batcher is not None and result is not None:
+            self.batcher.put(url, result)  # filtered later, with its batch
+        elif self.sink is not None:
+            self.sink.put(url, result)
+        else:
+            res.append({url: result})
+
+    def __parse(self, item, page, threadid):
+        """Parses the page unless its result is memoized."""
+
+        url = item.url
+        if self.memo is None:
+            return self.__parse_new(item, page, threadid)
+
+        bodyhash = None
+        if page.status_code == 304:
+            found, _res = self.memo.get(url, self.parserfp)
+        else:
+            bodyhash = content_hash(page.content)
+            found, _res = self.memo.get(url, self.parserfp, bodyhash)
+        if found:
+            self.log('URL {} unchanged, using memoized result. Thread {}'.format(
+                url, threadid))
+            return _res
+
+        _res = self.__parse_new(item, page, threadid)
+        if bodyhash is not None:
+            self.memo.put(url, self.parserfp, bodyhash, _res,
+                          etag=page.headers.get('ETag'))
+        return _res
+
+    def __parse_new(self, item, page, threadid):
+        """Parses the page unless its body was already seen."""
+
+        url = item.url
+        if self.dedup is None:
+            return self.__parse_page(item, page, threadid)
+
+        key, entry = self.dedup.check(page.content)
+        if entry is not None:
+            self.log('URL {} has the same content as {}. Thread {}'.format(
+                url, entry[0], threadid))
+            return self.dedup.emit(entry)
+
+        _res = self.__parse_page(item, page, threadid)
+        self.dedup.add(key, url, _res)
+        return _res
+
+    def __parse_page(self, item, page, threadid):
+        """Parses the page and, when crawling, schedules the links admitted."""
+
+        if self.frontier is None:
+            return self.parser.parse(page, threadid=threadid)
+
+        _res, links = self.parser.parse_and_follow(page, threadid=threadid)
+        children = self.frontier.follow(item, links)
+        for child in children:
+            self.scheduler.put(child)
+        if children:
+            self.log('Following {} of {} links of {}. Thread {}'.format(
+                len(children), len(links), item.url, threadid))
+        return _res
+
+    def __next_item(self, threadid):
+        """Next WorkItem for the thread or None if there is nothing left to do."""
+
+        # asking for the next item means the previous one is done
+        with self.lock:
+            self.busy.discard(threadid)
+
+        # the reason here does not matter. If it is set, break out
+        while not self.event.is_set():
+            if self.controller is not None and not self.controller.admits(threadid):
+                if self.scheduler.empty() and not self.busy: return None
+                self.event.wait(PARKED_WAIT)  # parked by the controller
+                continue
+
+            with self.lock:
+                item = self.scheduler.get()
+                if item is not None:
+                    self.busy.add(threadid)
+                    return item
+                # pages in flight may still bring links to be followed
+                crawling = self.frontier is not None and bool(self.busy)
+
+            waiting = self.scheduler.waiting()
+            if waiting is None and not crawling:
+                return None
+            if waiting is None: waiting = IDLE_WAIT
+            if crawling: waiting = min(waiting, IDLE_WAIT)
+            self.event.wait(min(waiting, PARKED_WAIT))
+        return None
+
+    def __tick(self, item):
+        """Counts a finished URL and feeds the concurrency controller."""
+
+        self.scheduler.done(item)
+        with self.lock:
+            self.completed += 1
+            completed = self.completed
+
+        if self.controller is not None:
+            stats = getattr(self.rotator, 'stats', None)
+            self.controller.tick(completed,
+                                 stats.snapshot() if stats is not None else None)
+
+    def __failed(self, item, err, threadid):
+        """Defers a failed URL or turns it into a dead letter."""
+
+        delay = None
+        if self.retry is not None:
+            delay = self.retry.delay(item, err.fault)
+
+        if delay is not None:
+            self.log('Retrying {} in {:.1f}s ({} fault). Thread {}'.format(
+                item.url, delay, err.fault, threadid), tmsg='warning')
+            self.scheduler.defer(item, delay)
+            return
+
+        self.log('URL {} is a dead letter ({} fault). Thread {}'.format(
+            item.url, err.fault, threadid), tmsg='warning')
+        with self.lock:
+            self.deadletters.append({'url': item.url, 'fault': err.fault,
+                                     'outcomes': err.outcomes,
+                                     'retries': item.retries})
+        self.__tick(item)
+
+    def __handle(self, res, item, page, threadid):
+        """Records, parses and stores a page collected."""
+
+        url = item.url
+        if page is None: return  # not able to retrieve the page
+
+        if self.planner is not None and page.status_code < 400:
+            self.planner.record(
+                url, None if page.status_code == 304 else page.content)
+
+        if self.parser is None:
+            if self.storage is not None:
+                with self.__span('store'):
+                    page = self.storage.put(page, url)
+            res.append(page)
+            self.log('Storing whole response for {}. Thread {}'.format(
+                url, threadid))
+        elif page.status_code == 404:
+            self.log('URL {} returned a 404. Thread {}'.format(
+                url, threadid), tmsg='warning')
+            self.__store(res, url, None)  # collected but useless
+        else:
+            with self.__span('parse'):
+                _res = self.__parse(item, page, threadid)
+            if not _res:
+                self.log('URL {} could not be parsed. Thread {}'.format(
+                    url, threadid))
+                return  # no info collected, must go on
+            self.log('URL {} collected. Thread {}'.format(url, threadid),
+                     tmsg='header')
+            with self.__span('store'):
+                self.__store(res, url, _res)
+
+    def __iterate(self, threadid, *args):
         """Do iterations in threads, each one calling the passed code."""
 
         # pylint: disable=unused-argument
 
-        self.log('Starting iteration in threadid {} for {} items'.format(
-            threadid, len(data)))
+        self.log('Starting iteration in threadid {}'.format(threadid))
         res = []
-        for url in data:
-            # the reason here does not matter. If it is set, break out
-            if self.event.is_set(): break
-
-            try:
-                page = self.rotator.request(url, self.event, threadid=threadid)
-            except:
-                self.event.state.set_ABORT_THREAD()
-                break
-
-            if page is None: continue  # not able to retrieve the page
-
-            if self.parser is None:
-                res.append(page)
-                self.log('Storing whole response for {}. Thread {}'.format(
-                    url, threadid))
-            elif page.status_code == 404:
-                self.log('URL {} returned a 404. Thread {}'.format(url, threadid),
-                         tmsg='warning')
-                res.append({url: None})  # points it was collected but useless
-            else:
-                _res = self.parser.parse(page, threadid=threadid)
-                if not _res:
-                    self.log('URL {} could not be parsed. Thread {}'.format(
-                        url, threadid))
-                    continue  # no info collected, must go on
-                self.log('URL {} collected. Thread {}'.format(url, threadid),
-                         tmsg='header')
-                res.append({url: _res})
+        while True:
+            item = self.__next_item(threadid)
+            if item is None: break
+            url = item.url
+
+            with self.__trace(url):
+                try:
+                    headers = None
+                    if self.memo is not None:
+                        headers = self.memo.validators(url, self.parserfp)
+                    with self.__span('request'):
+                        if headers:
+                            page = self.rotator.request(url, self.event,
+                                                        threadid=threadid,
+                                                        headers=headers)
+                        else:
+                            page = self.rotator.request(url, self.event,
+                                                        threadid=threadid)
+                except CoreScrapeUrlFailed as err:
+                    self.__failed(item, err, threadid)
+                    continue
+                except:
+                    self.event.state.set_ABORT_THREAD()
+                    break
+
+                self.__tick(item)
+
+                try:
+                    self.__handle(res, item, page, threadid)
+                except:
+                    self.event.state.set_ABORT_THREAD()
+                    break
 
         self.__check_am_i_the_last()
         return res
 
     def start_threads(self, to_split_params, *fixed_args):
-        """Starts threads."""
+        """
+        Starts threads.
+
+        Params:
+            to_split_params: list of str URLs or of
+                corescrape.threads.scheduler.WorkItem, for URLs with a priority or a
+                deadline.
+        """
 
         def test_if_urls(p):
             return [a.startswith('http://') or a.startswith('https://') for a in p]
@@ -190,18 +483,49 @@ class CoreScrapeThread(CoreScrape):
         if abort:
             return False
 
-        if not all(test_if_urls(to_split_params)):
-            raise ValueError('List of strings must begin with protocol')
+        if not isinstance(to_split_params, list):
+            raise TypeError("Param 'to_split_params' must be 'list'")
 
-        self.log('Starting threads for {} items'.format(len(to_split_params)))
+        items = [p if isinstance(p, WorkItem) else WorkItem(p)
+                 for p in to_split_params]
+        if not all(test_if_urls([item.url for item in items])):
+            raise ValueError('List of strings must begin with protocol')
 
+        self.log('Starting threads for {} items'.format(len(items)))
+
+        # items left by a past run, e.g. deferred retries, belong to that run
+        left = self.scheduler.clear()
+        if left:
+            self.log('Dropped {} items left by the last run'.format(left),
+                     tmsg='warning')
+        for item in items:
+            self.scheduler.put(item)
+        if self.frontier is not None:
+            self.frontier.seed(items)
+
+        nthreads = self.nthreads
+        if self.controller is not None:
+            nthreads = self.controller.maxthreads
+            self.controller.reset()
+        # actual number of threads. Sometimes differs from 'nthreads'
+        self.actualnthreads = min(nthreads, len(to_split_params))
+        if self.frontier is not None and to_split_params:
+            self.actualnthreads = nthreads  # the crawl grows from the seeds
+        self.completed = 0
+        self.deadletters = []
+        self.busy = set()
+        self.filtered = []
+
+        self.queue = Queue()  # abandoned threads of past runs keep the old one
         self.threads = []
         self.event.state.set_EXECUTING()
-        for threadid, split in enumerate(self.__split(to_split_params)):
-            pargs = (threadid, split, *fixed_args)
+        if not self.actualnthreads:
+            self.event.state.set_DUTY_FREE()
+        for threadid in range(self.actualnthreads):
+            pargs = (threadid, *fixed_args)
             thread = Thread(
                 target=lambda q, *args: q.put(self.__iterate(*args)),
-                args=(self.queue, *pargs)
+                args=(self.queue, *pargs), daemon=True
             )
             thread.start()
             self.threads.append(thread)
@@ -221,13 +545,46 @@ class CoreScrapeThread(CoreScrape):
             self.event.state.set_TIMEOUT()
         finally:
             self.__disarm_timeout()
+            deadline = None
+            if self.jointimeout is not None:
+                deadline = time() + self.jointimeout
             for thread in self.threads:
-                thread.join()
+                thread.join(None if deadline is None else max(deadline - time(), 0))
+                if thread.is_alive():
+                    self.log('Abandoning thread {} still running'.format(
+                        thread.name), tmsg='warning')
+            if self.batcher is not None:
+                self.batcher.flush()
+                self.log('Batched filters: {}'.format(self.batcher.stats()),
+                         tmsg='info')
+            if self.sink is not None:
+                self.sink.flush()
+            if self.dedup is not None:
+                self.log('Deduplication: {}'.format(self.dedup.stats()),
+                         tmsg='info')
+            if self.memo is not None:
+                self.memo.flush()
+                self.log('Memo: {}'.format(self.memo.stats()), tmsg='info')
+            if self.storage is not None:
+                self.storage.flush()
+            self.log('Scheduler: {}'.format(self.scheduler.stats()), tmsg='info')
+            if self.frontier is not None:
+                self.log('Frontier: {}'.format(self.frontier.stats()), tmsg='info')
+            if self.planner is not None:
+                self.planner.flush()
+                self.log('Recrawl: {}'.format(self.planner.stats()), tmsg='info')
+            if self.deadletters:
+                self.log('{} dead letters'.format(len(self.deadletters)),
+                         tmsg='warning')
             self.event.clear()
             self.threads = []
 
     def join_responses(self):
-        """Join responses from the threads."""
+        """
+        Join responses from the threads.
+
+        Results handed to a sink are not returned here.
+        """
 
         abort = self.__warn_wait_threads()
         if abort:
@@ -236,7 +593,7 @@ class CoreScrapeThread(CoreScrape):
         res = []
         while not self.queue.empty():
             res += self.queue.get()
-        return res
+        return res + self.filtered
 
     def is_sentenced(self):
         """
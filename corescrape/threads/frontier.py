@@ -0,0 +1,153 @@
+"""
+Frontier
+
+Decides which links found while crawling become new work items. Links are
+normalized and deduplicated against every URL already admitted in the run, and
+only those within the depth limit, the crawl scope (allowed domains and their
+subdomains) and the per domain and total budgets are admitted.
+
+Children inherit the priority of the page they were found in, so within a priority
+the crawl goes breadth first (see corescrape.threads.scheduler.Scheduler).
+"""
+
+from threading import Lock
+from urllib.parse import urlsplit, urlunsplit
+
+from .scheduler import WorkItem
+from ..core import CoreScrape
+from ..rules.rule_engine import domain_matches
+
+# pylint: disable=invalid-name, too-many-arguments
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize(url):
+    """Canonical form of a URL used for deduplication."""
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    try:
+        port = parts.port
+    except ValueError:  # invalid port
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = '{}:{}'.format(netloc, port)
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+class Frontier(CoreScrape):
+    """
+    Deduplicated, depth and domain limited frontier of a crawl.
+
+    Params:
+        maxdepth: int. Links are followed up to this distance from the seeds.
+        domains: list of str or None. Domains to be crawled, subdomains included.
+            If None, the domains of the seeds.
+        maxperdomain: int or None. Maximum number of URLs admitted per domain.
+        maxurls: int or None. Maximum number of URLs admitted in the run, seeds
+            included.
+        depthpenalty: int. Added to the priority of children on each level, to
+            favour shallow pages over deep ones when priorities compete.
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, maxdepth=2, domains=None, maxperdomain=None, maxurls=None,
+                 depthpenalty=0, logoperator=None):
+        """Constructor."""
+
+        if not isinstance(maxdepth, int) or maxdepth < 0:
+            raise ValueError("Param 'maxdepth' must be a non negative 'int'")
+
+        self.maxdepth = maxdepth
+        self.domains = None
+        if domains is not None:
+            self.domains = {domain.lower() for domain in domains}
+        self.maxperdomain = maxperdomain
+        self.maxurls = maxurls
+        self.depthpenalty = depthpenalty
+        self.scope = self.domains if self.domains is not None else set()
+
+        self.seen = set()
+        self.perdomain = {}
+        self.rejected = {'seen': 0, 'depth': 0, 'scope': 0, 'budget': 0}
+        self.lock = Lock()
+
+        super().__init__(logoperator=logoperator)
+
+    def seed(self, items):
+        """
+        Registers the seed items of a run. If no domains were informed, the crawl
+        is scoped to the domains of the seeds.
+        """
+
+        with self.lock:
+            self.seen = set()
+            self.perdomain = {}
+            self.rejected = dict.fromkeys(self.rejected, 0)
+            scope = set()
+            for item in items:
+                url = normalize(item.url)
+                self.seen.add(url)
+                domain = urlsplit(url).hostname or ''
+                self.perdomain[domain] = self.perdomain.get(domain, 0) + 1
+                scope.add(domain)
+            if self.domains is None:
+                self.scope = scope
+            else:
+                self.scope = self.domains
+
+        self.log('Frontier scoped to {}'.format(sorted(self.scope)), tmsg='info')
+
+    def __admits(self, url, depth):
+        """Reason to reject the normalized URL or None. Call within the lock."""
+
+        if url in self.seen:
+            return 'seen'
+        if depth > self.maxdepth:
+            return 'depth'
+        domain = urlsplit(url).hostname or ''
+        if not any(domain_matches(domain, scope) for scope in self.scope):
+            return 'scope'
+        if self.maxurls is not None and len(self.seen) >= self.maxurls:
+            return 'budget'
+        if self.maxperdomain is not None and \
+           self.perdomain.get(domain, 0) >= self.maxperdomain:
+            return 'budget'
+        return None
+
+    def follow(self, parent, links):
+        """
+        Work items for the links found in the page of the parent item.
+
+        Params:
+            parent: corescrape.threads.scheduler.WorkItem
+            links: list of str absolute URLs
+
+        Returns:
+            list of corescrape.threads.scheduler.WorkItem admitted
+        """
+
+        depth = parent.depth + 1
+        priority = parent.priority + self.depthpenalty
+        children = []
+        with self.lock:
+            for link in links:
+                url = normalize(link)
+                reason = self.__admits(url, depth)
+                if reason is not None:
+                    self.rejected[reason] += 1
+                    continue
+                self.seen.add(url)
+                domain = urlsplit(url).hostname or ''
+                self.perdomain[domain] = self.perdomain.get(domain, 0) + 1
+                children.append(WorkItem(url, priority=priority, depth=depth))
+        return children
+
+    def stats(self):
+        """URLs admitted, in total and per domain, and links rejected by reason."""
+
+        with self.lock:
+            return {'admitted': len(self.seen), 'perdomain': dict(self.perdomain),
+                    'rejected': dict(self.rejected)}
@@ -0,0 +1,60 @@
+"""
+Retry Policy
+
+Tells when a URL that exhausted the budget of its request (see 'urlbudget' in
+corescrape.proxy.rotator.Rotator) is tried again. Retries are deferred with
+exponential backoff, so the other URLs go on meanwhile. Target faults (the URL
+keeps failing whatever the proxy) wait longer than proxy faults. URLs out of
+retries are dead letters.
+"""
+
+from random import uniform
+
+from ..proxy.request_stats import TARGET_FAULT
+
+# pylint: disable=invalid-name, too-many-arguments, too-few-public-methods
+
+class RetryPolicy:
+    """
+    Exponential backoff policy.
+
+    Params:
+        maxretries: int. Number of retries of a URL before it is a dead letter.
+        backoff: int or float. Seconds before the first retry.
+        factor: int or float. Multiplier of the delay for each retry.
+        maxbackoff: int or float. Maximum delay in seconds.
+        targetfactor: int or float. Multiplier of the delay for target faults.
+        jitter: float. Random variation of the delay, as a fraction of it.
+    """
+
+    def __init__(self, maxretries=3, backoff=5, factor=2, maxbackoff=300,
+                 targetfactor=4, jitter=0.1):
+        """Constructor."""
+
+        self.maxretries = maxretries
+        self.backoff = backoff
+        self.factor = factor
+        self.maxbackoff = maxbackoff
+        self.targetfactor = targetfactor
+        self.jitter = jitter
+
+    def delay(self, item, fault):
+        """
+        Delay of the next retry of the item.
+
+        Params:
+            item: corescrape.threads.scheduler.WorkItem
+            fault: str fault of the last failure (see corescrape.proxy.request_stats)
+
+        Returns:
+            float seconds or None if the item is out of retries
+        """
+
+        if item.retries >= self.maxretries:
+            return None
+
+        delay = self.backoff * self.factor ** item.retries
+        if fault == TARGET_FAULT:
+            delay *= self.targetfactor
+        delay = min(delay, self.maxbackoff)
+        return delay * (1 + uniform(-self.jitter, self.jitter))
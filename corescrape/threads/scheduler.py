@@ -0,0 +1,204 @@
+"""
+Scheduler
+
+Priority and deadline aware queue of work items shared by the threads. Items with
+the lowest priority value are taken first (the same convention of the proxies
+queue) and, within a priority, those with the earliest deadline. Items taken after
+their deadline are either dropped or demoted to a lower priority, according to the
+scheduler policy.
+
+Items can also be deferred, e.g. URLs to be retried later: they wait in a separate
+heap until their time comes and only then compete with the others.
+
+The scheduler also keeps throughput stats per priority.
+"""
+
+import heapq
+from itertools import count
+from threading import Lock
+from time import time
+
+from ..core import CoreScrape
+
+# pylint: disable=invalid-name, too-many-arguments, too-few-public-methods
+
+INF = float('inf')
+
+
+class WorkItem:
+    """
+    A URL to be collected.
+
+    Params:
+        url: str URL starting with protocol
+        priority: int. Lower values are taken first. Default 0.
+        deadline: float or None. Epoch time (as in time.time()) after which the item
+            is expired.
+        depth: int. Distance from the seed URLs, when crawling.
+    """
+
+    __slots__ = ['url', 'priority', 'deadline', 'depth', 'retries']
+
+    def __init__(self, url, priority=0, deadline=None, depth=0):
+        """Constructor."""
+
+        self.url = url
+        self.priority = priority
+        self.deadline = deadline
+        self.depth = depth
+        self.retries = 0
+
+    def expired(self, now=None):
+        """Tells if the deadline has passed."""
+
+        return self.deadline is not None and self.deadline < (now or time())
+
+    def __repr__(self):
+        """Representation."""
+
+        return '<WorkItem {} p={} d={}>'.format(self.url, self.priority,
+                                                self.deadline)
+
+
+class Scheduler(CoreScrape):
+    """
+    Thread safe priority queue of work items.
+
+    Params:
+        expired: str either 'drop' (expired items are discarded) or 'demote'
+            (expired items lose their deadline and get priority 'demoteto')
+        demoteto: int priority given to demoted items
+        ondrop: callable or None. Called with each item dropped.
+        logoperator: corescrape.logs.LogOperator or None
+    """
+
+    def __init__(self, expired='drop', demoteto=100, ondrop=None, logoperator=None):
+        """Constructor."""
+
+        if expired not in ['drop', 'demote']:
+            raise ValueError("Param 'expired' must either be 'drop' or 'demote'")
+
+        self.expired = expired
+        self.demoteto = demoteto
+        self.ondrop = ondrop
+
+        self.heap = []
+        self.deferred = []  # heap of (time, seq, item)
+        self.seq = count()
+        self.lock = Lock()
+        self.started = time()
+        # priority -> {'queued', 'done', 'dropped', 'demoted', 'retried'}
+        self.counters = {}
+
+        super().__init__(logoperator=logoperator)
+
+    def __count(self, priority, key):
+        """Increments a counter. Caller must hold the lock."""
+
+        counters = self.counters.setdefault(
+            priority, {'queued': 0, 'done': 0, 'dropped': 0, 'demoted': 0,
+                       'retried': 0})
+        counters[key] += 1
+
+    def __push(self, item):
+        """Pushes into the heap. Caller must hold the lock."""
+
+        heapq.heappush(self.heap, (item.priority,
+                                   INF if item.deadline is None else item.deadline,
+                                   next(self.seq), item))
+
+    def put(self, item):
+        """Queues a WorkItem or a URL (str) with default priority."""
+
+        if isinstance(item, str):
+            item = WorkItem(item)
+
+        with self.lock:
+            self.__push(item)
+            self.__count(item.priority, 'queued')
+
+    def defer(self, item, delay):
+        """Queues the item again after 'delay' seconds, counting one more retry."""
+
+        item.retries += 1
+        with self.lock:
+            heapq.heappush(self.deferred, (time() + delay, next(self.seq), item))
+            self.__count(item.priority, 'retried')
+
+    def get(self):
+        """Next WorkItem not expired or None if the queue is empty."""
+
+        now = time()
+        while True:
+            with self.lock:
+                while self.deferred and self.deferred[0][0] <= now:
+                    self.__push(heapq.heappop(self.deferred)[2])
+                if not self.heap:
+                    return None
+                item = heapq.heappop(self.heap)[3]
+                if not item.expired(now):
+                    return item
+
+                dropped = self.expired == 'drop'
+                if dropped:
+                    self.__count(item.priority, 'dropped')
+                    msg = 'Dropped expired {}'.format(item.url)
+                else:
+                    self.__count(item.priority, 'demoted')
+                    item.priority = self.demoteto
+                    item.deadline = None
+                    self.__push(item)
+                    self.__count(item.priority, 'queued')
+                    msg = 'Demoted expired {}'.format(item.url)
+            self.log(msg, tmsg='warning')
+            if dropped and self.ondrop is not None:
+                self.ondrop(item)
+
+    def clear(self):
+        """
+        Drops every item, deferred ones included, and resets the stats. Returns the
+        number of items dropped.
+        """
+
+        with self.lock:
+            dropped = len(self.heap) + len(self.deferred)
+            self.heap = []
+            self.deferred = []
+            self.counters = {}
+            self.started = time()
+        return dropped
+
+    def done(self, item):
+        """Counts a finished item."""
+
+        with self.lock:
+            self.__count(item.priority, 'done')
+
+    def empty(self):
+        """Tells if there are no items queued, deferred ones included."""
+
+        return not self.heap and not self.deferred
+
+    def waiting(self):
+        """Seconds until the next deferred item is due or None if there is none."""
+
+        with self.lock:
+            if not self.deferred:
+                return None
+            return max(self.deferred[0][0] - time(), 0)
+
+    def __len__(self):
+        """Number of items queued, deferred ones included."""
+
+        return len(self.heap) + len(self.deferred)
+
+    def stats(self):
+        """Counters and throughput (items done per second) by priority."""
+
+        elapsed = max(time() - self.started, 1e-9)
+        with self.lock:
+            stats = {priority: dict(counters)
+                     for priority, counters in self.counters.items()}
+        for counters in stats.values():
+            counters['throughput'] = counters['done'] / elapsed
+        return stats
@@ -0,0 +1,259 @@
+"""
+Scrape Service
+
+Long-running alternative to CoreScrapeThread. A persistent pool of threads takes
+URLs submitted at any time and hands back futures (concurrent.futures.Future) or
+streams of results. The rotator, its proxy scores, quarantines and sessions are
+kept warm between submissions, since the threads are not torn down after each
+batch.
+"""
+
+from concurrent.futures import Future, as_completed
+from threading import Thread, Condition
+
+from . import corescrape_event
+from .scheduler import Scheduler, WorkItem
+from ..core import CoreScrape
+
+# pylint: disable=invalid-name, too-many-arguments, too-many-instance-attributes
+# pylint: disable=broad-except, multiple-statements
+
+class ScrapeService(CoreScrape):
+    """
+    Persistent scrape service.
+
+    Usage:
+        with ScrapeService(8, rotator, parser) as service:
+            future = service.submit('https://...')
+            for url, result in service.stream(urls):
+                ...
+
+    The result of each future is the parsed result, the whole page if there is no
+    parser, or None if the page could not be retrieved. If the rotator has a
+    'urlbudget', futures of URLs that exhausted it raise
+    corescrape.core.exceptions.CoreScrapeUrlFailed.
+
+    Params:
+        nthreads: int. Number of threads of the pool.
+        rotator: corescrape.proxy.Rotator (preferably). Use it with 'sessions=True'
+            to reuse connections between requests.
+        parser: corescrape.pgparser.SimpleParser, based on or None. Parsers with
+            batched filters ('batchsize') are not supported.
+        logoperator: corescrape.logs.LogOperator or None.
+        sink: corescrape.sink.result_sink.ResultSink or None. If informed, parsed
+            results are also written by the sink. Requires a parser.
+        scheduler: corescrape.threads.scheduler.Scheduler or None. Futures of items
+            dropped by the scheduler are cancelled.
+    """
+
+    def __init__(self, nthreads, rotator, parser=None, logoperator=None, sink=None,
+                 scheduler=None):
+        """Constructor."""
+
+        if sink is not None and parser is None:
+            raise ValueError("Param. 'sink' requires a 'parser'")
+
+        if getattr(parser, 'batchsize', None):
+            # each future resolves alone, so filters can not wait for a batch
+            raise ValueError("Param. 'parser' can not have a 'batchsize'")
+
+        self.nthreads = nthreads
+        self.rotator = rotator
+        self.parser = parser
+        self.sink = sink
+        if self.sink is not None:
+            self.sink.set_columns_from(self.parser)
+        self.scheduler = scheduler if scheduler is not None else Scheduler(
+            logoperator=logoperator)
+        self.scheduler.ondrop = self.__dropped
+
+        self.cond = Condition()
+        self.futures = {}  # WorkItem -> Future
+        self.stopping = False
+        self.event = corescrape_event.CoreScrapeEvent(logoperator=logoperator)
+        self.threads = []
+
+        super().__init__(logoperator=logoperator)
+
+    def start(self):
+        """
+        Starts the pool. A service stopped, by 'shutdown' or by a state that sets
+        its event, can be started again.
+        """
+
+        if self.running:
+            return self
+
+        # threads of a past start still running resume serving
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        self.stopping = False
+        self.event.clear()
+        self.event.state.set_EXECUTING()
+        for threadid in range(len(self.threads), self.nthreads):
+            thread = Thread(target=self.__serve, args=(threadid,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.log('ScrapeService started {} threads'.format(self.nthreads),
+                 tmsg='info')
+        return self
+
+    @property
+    def running(self):
+        """Tells if the service accepts submissions."""
+
+        return any(thread.is_alive() for thread in self.threads) and \
+            not self.stopping and not self.event.is_set()
+
+    def submit(self, url, priority=0, deadline=None):
+        """
+        Submits a URL.
+
+        Params:
+            url: str URL starting with protocol or
+                corescrape.threads.scheduler.WorkItem
+            priority: int. Ignored if 'url' is a WorkItem.
+            deadline: float or None. Ignored if 'url' is a WorkItem.
+
+        Returns:
+            concurrent.futures.Future
+        """
+
+        item = url if isinstance(url, WorkItem) else WorkItem(url, priority,
+                                                              deadline)
+        if not item.url.startswith('http://') and \
+           not item.url.startswith('https://'):
+            raise ValueError('URL must begin with protocol')
+
+        future = Future()
+        with self.cond:
+            if not self.running:
+                raise RuntimeError('ScrapeService is not running')
+            self.futures[item] = future
+            self.scheduler.put(item)
+            self.cond.notify()
+        return future
+
+    def map(self, urls, priority=0, deadline=None):
+        """Submits several URLs. Returns the list of futures, in order."""
+
+        return [self.submit(url, priority, deadline) for url in urls]
+
+    def stream(self, urls, priority=0, deadline=None):
+        """Submits several URLs and yields (url, result) as they are completed."""
+
+        futures = {self.submit(url, priority, deadline): url for url in urls}
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            url = futures[future]
+            yield getattr(url, 'url', url), future.result()
+
+    def __dropped(self, item):
+        """Cancels the future of an item dropped by the scheduler."""
+
+        future = self.futures.pop(item, None)  # called under 'cond'
+        if future is not None:
+            future.cancel()
+
+    def __next_item(self):
+        """Blocks until there is an item. None means the thread must stop."""
+
+        with self.cond:
+            while True:
+                if self.event.is_set():
+                    return None
+                item = self.scheduler.get()
+                if item is not None:
+                    return item, self.futures.pop(item)
+                if self.stopping:
+                    return None
+                self.cond.wait()
+
+    def __collect(self, url, threadid):
+        """Requests and parses a URL."""
+
+        page = self.rotator.request(url, self.event, threadid=threadid)
+        if page is None or self.parser is None:
+            return page
+        if page.status_code == 404:
+            self.log('URL {} returned a 404. Thread {}'.format(url, threadid),
+                     tmsg='warning')
+            return None
+
+        _res = self.parser.parse(page, threadid=threadid)
+        if self.sink is not None and _res:
+            self.sink.put(url, _res)
+        return _res
+
+    def __serve(self, threadid):
+        """Thread loop."""
+
+        self.log('Starting service in threadid {}'.format(threadid))
+        while True:
+            taken = self.__next_item()
+            if taken is None: break
+            item, future = taken
+            if not future.set_running_or_notify_cancel():
+                continue  # cancelled by the user
+
+            try:
+                future.set_result(self.__collect(item.url, threadid))
+            except Exception as err:
+                self.log('URL {} failed: {}. Thread {}'.format(item.url, err,
+                                                               threadid),
+                         tmsg='error')
+                future.set_exception(err)
+            self.scheduler.done(item)
+
+        with self.cond:
+            self.cond.notify_all()  # the event may have been set by this thread
+        self.__cancel_pending()
+
+    def __cancel_pending(self):
+        """Cancels futures of every item still queued."""
+
+        with self.cond:
+            while True:
+                item = self.scheduler.get()
+                if item is None: break
+                self.futures.pop(item).cancel()
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        Stops the service.
+
+        Params:
+            wait: bool. Waits for the threads to finish.
+            cancel: bool. Cancels the URLs not started yet and breaks the ongoing
+                requests. Otherwise every URL submitted is collected before the
+                threads stop.
+        """
+
+        with self.cond:
+            self.stopping = True
+            if cancel:
+                self.event.state.set_ABORT_USER()
+            self.cond.notify_all()
+
+        if cancel:
+            self.__cancel_pending()
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+            if self.sink is not None:
+                self.sink.flush()
+            self.log('Scheduler: {}'.format(self.scheduler.stats()), tmsg='info')
+        self.log('ScrapeService stopped. State {}'.format(self.event.state),
+                 tmsg='info')
+
+    def __enter__(self):
+        """Starts the service."""
+
+        return self.start()
+
+    def __exit__(self, *args):
+        """Stops the service gracefully."""
+
+        self.shutdown(wait=True, cancel=args[0] is not None)